@@ -1,14 +1,18 @@
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, request, jsonify
-from pinecone import Pinecone, ServerlessSpec
-from openai import OpenAI
+from flask import Flask, request, jsonify, Response
 import os
-from cachetools import TTLCache
 import requests
 import logging
 from core.respond_toquery import handle_webhook_v2
 from core.utils import get_required_env_var
+from core.outbound import neynar_get, neynar_post, get_outbound_stats
+from core.rate_limiter import openai_rate_limiter
+from core.metrics import metrics
+from core.admission import admission_controller
+from core.logging_pipeline import setup_async_logging
+from core.warm_start import preload, readiness
+from core.lazy_client import LazyClient
 from datetime import datetime
 import time
 
@@ -18,6 +22,9 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hand log formatting and writing to a background thread so request threads never block on logging
+setup_async_logging()
+
 # Set logging level based on environment variable
 VERBOSE_LOGGING = get_required_env_var("VERBOSE_LOGGING").lower() == 'true'
 if VERBOSE_LOGGING:
@@ -32,20 +39,28 @@ PINECONE_INDEX_NAME = get_required_env_var("PINECONE_INDEX_NAME")
 OPENAI_KEY = get_required_env_var("OPENAI_API_KEY")
 NEYNAR_KEY = get_required_env_var("NEYNAR_API_KEY")
 NEYNAR_SIGNER_UUID = get_required_env_var("NEYNAR_BOT_SIGNER_UUID")
+get_required_env_var("BOT_ACCOUNT_FID")
 DRY_RUN_SIMULATION = os.getenv("DRY_RUN_SIMULATION", "false").lower() == "true"
 USE_LLM = os.getenv("USE_LLM", "true").lower() == "true"
 
-# Add timeouts to API clients
-TIMEOUT_SECONDS = 10
+# Timeouts, retries and circuit breakers for API clients live in core/outbound.py
 
 app = Flask(__name__)
 
-# Updated Pinecone initialization
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
+# The Pinecone and OpenAI clients (and their packages) are created on first use; see core/lazy_client.py
+def _create_pinecone_index():
+    from pinecone import Pinecone
+    return Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+
+
+def _create_openai_client():
+    from openai import OpenAI
+    # Retries are handled by core/outbound.py, so the client's own retry loop is turned off
+    return OpenAI(api_key=OPENAI_KEY, max_retries=0)
 
-# Initialize the OpenAI client
-openai_client = OpenAI(api_key=OPENAI_KEY)
+
+index = LazyClient(_create_pinecone_index, "pinecone_index")
+openai_client = LazyClient(_create_openai_client, "openai")
 
 # Initialize the Neynar client
 NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
@@ -56,9 +71,11 @@ NEYNAR_HEADERS = {
     "content-type": "application/json"    
 }
 
-# Create a cache to store processed cast hashes with a TTL to avoid duplicate replies
-processed_casts = TTLCache(maxsize=1000, ttl=300)  # Stores up to 1000 hashes for 5 minutes
+# Duplicate webhook deliveries are filtered by core/dedupe_store.py (shared by all workers)
 
+# Load metadata, transcripts and tokenizers now; under `gunicorn --preload` this runs once, before the workers
+# are forked, and they share the loaded data (see core/warm_start.py)
+preload(openai_client=openai_client, pinecone_index=index)
 
 
 
@@ -67,6 +84,31 @@ def home():
     return jsonify({"message": "API is running!"})
 
 
+@app.route("/ready")
+def ready():
+    ### Readiness probe: 200 once this worker has its data loaded and its upstream connections warm, 503 until then
+    state = readiness()
+    return jsonify(state), 200 if state["ready"] else 503
+
+
+@app.route("/outbound_status")
+def outbound_status():
+    ### Circuit breaker state, call counters and latency histograms for each upstream dependency,
+    ### plus the shared OpenAI rate limiter budget and this worker's admission control state
+    return jsonify({
+        "dependencies": get_outbound_stats(),
+        "openai_rate_limits": openai_rate_limiter.snapshot(),
+        "admission": admission_controller.stats()
+    })
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    ### Per-stage and per-route latency histograms plus route, cache, error, truncation and depth-refusal counters,
+    ### summed over all gunicorn workers, in the Prometheus text format
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/gm", methods=["POST"])
 def post_gm():
     ### Use this end point to post a top level cast from the bot;
@@ -80,7 +122,7 @@ def post_gm():
             "text": cast_text,            
             "signer_uuid": NEYNAR_SIGNER_UUID
         }
-        response = requests.post(NEYNAR_CAST_URL, json=payload, headers=NEYNAR_HEADERS)       
+        response = neynar_post(NEYNAR_CAST_URL, json=payload, headers=NEYNAR_HEADERS)       
        
         print (response.text)
         return jsonify({"message": "Cast created successfully"}), 200
@@ -111,12 +153,11 @@ def test_webhook():
             logger.debug(f"Received custom cast content: {custom_cast_content}")
 
         # Hydrate the cast using Neynar
-        response = requests.get(
+        response = neynar_get(
             f"{NEYNAR_CAST_URL}",
             params={"identifier": cast_url, "type": "url"},
             headers=NEYNAR_HEADERS
         )
-        response.raise_for_status()
         cast_data = response.json()["cast"]
         
         # Override the cast text if custom content was provided
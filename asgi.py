@@ -0,0 +1,178 @@
+"""
+ASGI entry point for the webhook pipeline.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Serves the same /webhook_v2, /ready, /outbound_status and /metrics endpoints as api.py, but handles each mention as an
+asyncio task on an AsyncOpenAI client and an httpx.AsyncClient, so a single process can hold hundreds of mentions
+in flight while they wait on OpenAI, Pinecone and Neynar. The Flask app (api.py, gunicorn) keeps working unchanged;
+the test and /gm endpoints are only served there.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+import asyncio
+import json
+import logging
+import os
+import httpx
+from openai import AsyncOpenAI
+from pinecone import Pinecone
+from core.respond_toquery_async import handle_webhook_v2_async
+from core.utils import get_required_env_var
+from core.outbound import get_outbound_stats
+from core.rate_limiter import openai_rate_limiter
+from core.metrics import metrics
+from core.admission import admission_controller
+from core.logging_pipeline import setup_async_logging
+from core.warm_start import preload, readiness
+
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Hand log formatting and writing to a background thread so the event loop never blocks on logging
+setup_async_logging()
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = get_required_env_var("VERBOSE_LOGGING").lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Environment variables with validation
+PINECONE_API_KEY = get_required_env_var("PINECONE_API_KEY")
+PINECONE_INDEX_NAME = get_required_env_var("PINECONE_INDEX_NAME")
+OPENAI_KEY = get_required_env_var("OPENAI_API_KEY")
+NEYNAR_KEY = get_required_env_var("NEYNAR_API_KEY")
+NEYNAR_SIGNER_UUID = get_required_env_var("NEYNAR_BOT_SIGNER_UUID")
+get_required_env_var("BOT_ACCOUNT_FID")
+DRY_RUN_SIMULATION = os.getenv("DRY_RUN_SIMULATION", "false").lower() == "true"
+USE_LLM = os.getenv("USE_LLM", "true").lower() == "true"
+
+# One event loop holds far more mentions in flight than a sync worker, so admission control gets its own limit
+ASGI_MAX_IN_FLIGHT = int(os.getenv("ASGI_MAX_IN_FLIGHT", "200"))
+# Connection pool for Neynar calls, shared by every in-flight mention
+ASGI_NEYNAR_MAX_CONNECTIONS = int(os.getenv("ASGI_NEYNAR_MAX_CONNECTIONS", "100"))
+
+NEYNAR_HEADERS = {
+    "x-api-key": NEYNAR_KEY,
+    "accept": "application/json",
+    "content-type": "application/json"
+}
+
+# Clients are created in the lifespan handler, inside the event loop that uses them
+clients = {}
+
+
+async def _startup():
+    admission_controller.max_in_flight = ASGI_MAX_IN_FLIGHT
+    # Retries are handled by core/outbound.py, so the client's own retry loop is turned off
+    clients["openai"] = AsyncOpenAI(api_key=OPENAI_KEY, max_retries=0)
+    clients["http"] = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=ASGI_NEYNAR_MAX_CONNECTIONS, max_keepalive_connections=ASGI_NEYNAR_MAX_CONNECTIONS)
+    )
+    clients["pinecone_index"] = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+    # The async clients open their connections on first use; only the Pinecone connection is warmed here
+    await asyncio.to_thread(preload, None, clients["pinecone_index"])
+    logger.info(f"ASGI APP STARTED | MAX IN FLIGHT: {ASGI_MAX_IN_FLIGHT}")
+
+
+async def _shutdown():
+    if "http" in clients:
+        await clients["http"].aclose()
+    if "openai" in clients:
+        await clients["openai"].close()
+    metrics.flush()
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _send_response(send, status: int, body, headers=None, content_type: str = "application/json"):
+    payload = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+    raw_headers = [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(payload)).encode("latin-1"))]
+    raw_headers.extend((k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in (headers or {}).items())
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _handle_webhook_v2_endpoint(scope, receive, send):
+    content_type = dict(scope.get("headers", [])).get(b"content-type", b"").decode("latin-1")
+    if "application/json" not in content_type:
+        await _send_response(send, 400, {"error": "Content-Type must be application/json"})
+        return
+
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+    except ValueError:
+        await _send_response(send, 400, {"error": "Invalid JSON"})
+        return
+
+    try:
+        body, status, headers = await handle_webhook_v2_async(
+            data=data,
+            async_openai_client=clients["openai"],
+            pinecone_index=clients["pinecone_index"],
+            http_client=clients["http"],
+            neynar_headers=NEYNAR_HEADERS,
+            neynar_signer_uuid=NEYNAR_SIGNER_UUID,
+            use_llm=USE_LLM,
+            dry_run=DRY_RUN_SIMULATION
+        )
+    except Exception as e:
+        logger.error(f"Error in webhook_v2 endpoint: {str(e)}")
+        body, status, headers = {"error": "Internal server error"}, 500, {}
+
+    await _send_response(send, status, body, headers)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await _startup()
+            except Exception as e:
+                logger.error(f"Error starting ASGI app: {e}")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if path == "/" and method == "GET":
+        await _send_response(send, 200, {"message": "API is running!"})
+    elif path == "/ready" and method == "GET":
+        state = readiness()
+        await _send_response(send, 200 if state["ready"] else 503, state)
+    elif path == "/outbound_status" and method == "GET":
+        await _send_response(send, 200, {
+            "dependencies": get_outbound_stats(),
+            "openai_rate_limits": openai_rate_limiter.snapshot(),
+            "admission": admission_controller.stats()
+        })
+    elif path == "/metrics" and method == "GET":
+        await _send_response(send, 200, metrics.render_prometheus(), content_type="text/plain; version=0.0.4")
+    elif path == "/webhook_v2" and method == "POST":
+        await _handle_webhook_v2_endpoint(scope, receive, send)
+    else:
+        await _send_response(send, 404, {"error": "Not found"})
@@ -0,0 +1,191 @@
+"""
+Admission control for webhook bursts.
+
+Every mention used to go through the full pipeline (history fetch, routing, generation) no matter how busy we were.
+The controller looks at how much work this worker already has in flight, how long the event sat in Neynar's queue
+and whether upstreams are healthy, and decides before any upstream call is made:
+
+- below the soft limit everything is admitted
+- between the soft limit and ADMISSION_MAX_IN_FLIGHT, low-value events are shed (no reply)
+- at the limit, low-value events are shed and first-touch questions are deferred with a 503 so Neynar redelivers them
+- under load, events older than ADMISSION_MAX_QUEUE_AGE_SECONDS are shed as stale
+
+Low-value events are casts in threads that are close to the depth cutoff, casts from authors who have mentioned
+the bot several times recently, and casts that look like they would be routed to IGNORE.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+from cachetools import TTLCache
+from core.outbound import is_available
+from core.metrics import inc_counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+ADMISSION_SOFT_LIMIT = float(os.getenv("ADMISSION_SOFT_LIMIT", "0.75"))
+ADMISSION_MAX_QUEUE_AGE_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_AGE_SECONDS", "120"))
+ADMISSION_REPEAT_AUTHOR_LIMIT = int(os.getenv("ADMISSION_REPEAT_AUTHOR_LIMIT", "3"))
+ADMISSION_REPEAT_AUTHOR_WINDOW_SECONDS = int(os.getenv("ADMISSION_REPEAT_AUTHOR_WINDOW_SECONDS", "600"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "30"))
+
+# The pipeline refuses threads deeper than 8; threads this deep get at most a couple more replies
+DEEP_THREAD_DEPTH = 6
+
+ADMIT = "admit"
+SHED = "shed"
+DEFER = "defer"
+
+INTERROGATIVE_WORDS = {
+    "what", "when", "where", "who", "whom", "whose", "why", "how", "which",
+    "can", "could", "would", "should", "do", "does", "did", "is", "are", "was", "were", "will",
+    "tell", "explain", "summarize", "summarise", "recommend", "help", "show", "list", "give", "find",
+}
+
+
+def looks_like_ignore(text: str) -> bool:
+    """
+    Cheap stand-in for the router's IGNORE label: no question mark and no interrogative word.
+    Only used to pick what to shed under load, never to skip a reply when we have capacity.
+    """
+    text = re.sub(r"https?://\S+|@[\w.-]+", " ", text or "").strip().lower()
+    if "?" in text:
+        return False
+    words = re.findall(r"[a-z']+", text)
+    return not any(word in INTERROGATIVE_WORDS for word in words)
+
+
+def queue_age_seconds(cast_data: dict) -> Optional[float]:
+    """Seconds since the cast was created, from its ISO timestamp; None if it can't be parsed."""
+    timestamp = cast_data.get("timestamp")
+    if not timestamp:
+        return None
+    try:
+        created = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, time.time() - created.timestamp())
+
+
+class AdmissionDecision:
+    def __init__(self, action: str, reasons: Optional[List[str]] = None):
+        self.action = action
+        self.reasons = reasons or []
+
+    @property
+    def admitted(self) -> bool:
+        return self.action == ADMIT
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, soft_limit: float, max_queue_age_seconds: float):
+        self.max_in_flight = max_in_flight
+        self.soft_limit = soft_limit
+        self.max_queue_age_seconds = max_queue_age_seconds
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        # Recent mentions per author fid, and the last known depth of each thread
+        self._author_mentions = TTLCache(maxsize=10000, ttl=ADMISSION_REPEAT_AUTHOR_WINDOW_SECONDS)
+        self._thread_depths = TTLCache(maxsize=10000, ttl=3600)
+        self.admitted = 0
+        self.shed = 0
+        self.deferred = 0
+
+    def _low_value_reasons(self, cast_data: dict, author_mentions: int) -> List[str]:
+        reasons = []
+        thread_hash = cast_data.get("thread_hash")
+        is_reply = bool(cast_data.get("parent_hash"))
+
+        if thread_hash and self._thread_depths.get(thread_hash, 0) >= DEEP_THREAD_DEPTH:
+            reasons.append("deep_thread")
+        if is_reply and not is_available("neynar_get"):
+            # History can't be fetched, so the reply would be refused after the depth check anyway
+            reasons.append("history_unavailable")
+        if author_mentions > ADMISSION_REPEAT_AUTHOR_LIMIT:
+            reasons.append("repeat_author")
+        if looks_like_ignore(cast_data.get("text", "")):
+            reasons.append("likely_ignore")
+        return reasons
+
+    def admit(self, cast_data: dict) -> AdmissionDecision:
+        """
+        Decides whether to process a cast now. An admitted cast counts as in flight until release() is called.
+        """
+        author_fid = str(cast_data.get("author", {}).get("fid", "0"))
+        age = queue_age_seconds(cast_data)
+
+        with self._lock:
+            author_mentions = self._author_mentions.get(author_fid, 0) + 1
+            self._author_mentions[author_fid] = author_mentions
+            load = self.in_flight / self.max_in_flight if self.max_in_flight > 0 else 0.0
+            reasons = self._low_value_reasons(cast_data, author_mentions)
+
+            if load < self.soft_limit:
+                decision = AdmissionDecision(ADMIT)
+            elif age is not None and age > self.max_queue_age_seconds:
+                decision = AdmissionDecision(SHED, reasons + ["stale"])
+            elif reasons:
+                decision = AdmissionDecision(SHED, reasons)
+            elif load >= 1.0:
+                decision = AdmissionDecision(DEFER, ["at_capacity"])
+            else:
+                decision = AdmissionDecision(ADMIT)
+
+            if decision.admitted:
+                self.in_flight += 1
+                self.admitted += 1
+            elif decision.action == SHED:
+                self.shed += 1
+            else:
+                self.deferred += 1
+            in_flight = self.in_flight
+
+        if not decision.admitted:
+            logger.warning(
+                f"ADMISSION {decision.action.upper()}: cast {cast_data.get('hash')} "
+                f"({', '.join(decision.reasons)}) | in flight {in_flight}/{self.max_in_flight}"
+            )
+            for reason in decision.reasons:
+                inc_counter("admission_decisions_total", action=decision.action, reason=reason)
+        return decision
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def record_thread_depth(self, thread_hash: Optional[str], depth: int) -> None:
+        """Remembers how deep a thread is once its history has been fetched, for shedding later casts in it."""
+        if thread_hash:
+            with self._lock:
+                self._thread_depths[thread_hash] = depth
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": ADMISSION_ENABLED,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "deferred": self.deferred,
+            }
+
+
+admission_controller = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    soft_limit=ADMISSION_SOFT_LIMIT,
+    max_queue_age_seconds=ADMISSION_MAX_QUEUE_AGE_SECONDS
+)
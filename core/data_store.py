@@ -0,0 +1,279 @@
+"""
+Versioned data directory.
+
+Refresh scripts never write into the directory the API is reading from. Each refresh stages a complete copy of the
+data in DATA_DIR/versions/<version>/, verifies it and publishes it by atomically replacing the DATA_DIR/CURRENT
+pointer file. Unchanged files are hard links to the previous version, so staging a small update costs almost nothing.
+
+Requests pin the current version when they start (pin_data_dir) and read from it until they finish, so a refresh
+never changes the files under a running request and workers pick up new data without a restart.
+Superseded versions are deleted by gc_versions once they have been out of service for DATA_VERSION_GRACE_SECONDS,
+always keeping the newest DATA_KEEP_VERSIONS.
+
+Without a CURRENT pointer (fresh checkouts, benchmarks) DATA_DIR itself is the data directory.
+
+load_metadata() parses a version's metadata.json once per process (or once before forking, see core/warm_start.py)
+instead of once per request.
+
+Caches keyed by data directory (the parsed metadata here, the metadata index, the name matcher, preloaded
+transcripts) register an evictor with register_cache_evictor(). When CURRENT moves, the version it moved away from
+is retired: its entries are evicted and, while it stays retired, not cached again by requests still pinned to it.
+gc_versions retires the versions it deletes as well.
+"""
+import contextvars
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+DATA_KEEP_VERSIONS = int(os.getenv("DATA_KEEP_VERSIONS", "3"))
+DATA_VERSION_GRACE_SECONDS = int(os.getenv("DATA_VERSION_GRACE_SECONDS", "600"))
+
+POINTER_FILENAME = "CURRENT"
+VERSIONS_DIRNAME = "versions"
+STAGING_PREFIX = ".staging-"
+# What a version contains; anything else in DATA_DIR (the dedupe database, sample data) is shared by all versions
+DATA_ENTRIES = ("metadata.json", "transcripts", "summaries", ".sync_manifest.json", ".transcript_manifest.json")
+
+_pinned_data_dir: contextvars.ContextVar = contextvars.ContextVar("pinned_data_dir", default=None)
+# DATA_DIR -> ((inode, mtime_ns), resolved dir), so resolving costs one stat unless the pointer changed
+_pointer_cache = {}
+# metadata.json path -> ((mtime_ns, size), parsed metadata)
+_metadata_cache = {}
+# Data directories no longer served; their data is not cached
+_retired_data_dirs = set()
+# Called with a retired data directory, to drop what a cache holds for it
+_cache_evictors: List[Callable[[str], None]] = []
+
+
+def register_cache_evictor(evict: Callable[[str], None]) -> None:
+    """Registers a function that drops a cache's entries for a data directory once it is retired."""
+    _cache_evictors.append(evict)
+
+
+def is_retired_data_dir(data_dir: str) -> bool:
+    """True for versions CURRENT has moved away from; caches shouldn't keep their data."""
+    return data_dir in _retired_data_dirs
+
+
+def retire_data_dir(data_dir: str) -> None:
+    """Evicts a data directory from every registered cache."""
+    _retired_data_dirs.add(data_dir)
+    for evict in _cache_evictors:
+        try:
+            evict(data_dir)
+        except Exception as e:
+            logger.error(f"Error evicting cached data for {data_dir}: {e}")
+    logger.debug(f"Evicted cached data for retired data directory {data_dir}")
+
+
+def _evict_metadata(data_dir: str) -> None:
+    _metadata_cache.pop(os.path.join(data_dir, "metadata.json"), None)
+
+
+register_cache_evictor(_evict_metadata)
+
+
+def data_root() -> str:
+    return os.getenv("DATA_DIR", "./data")
+
+
+def versions_dir(root: Optional[str] = None) -> str:
+    return os.path.join(root or data_root(), VERSIONS_DIRNAME)
+
+
+def resolve_data_dir() -> str:
+    """The directory of the published version, or DATA_DIR itself if nothing has been published yet."""
+    root = data_root()
+    pointer_path = os.path.join(root, POINTER_FILENAME)
+    try:
+        stat = os.stat(pointer_path)
+    except FileNotFoundError:
+        return root
+
+    stat_key = (stat.st_ino, stat.st_mtime_ns)
+    cached = _pointer_cache.get(root)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    try:
+        with open(pointer_path, "r") as f:
+            version = f.read().strip()
+    except OSError as e:
+        logger.error(f"Error reading data version pointer {pointer_path}: {e}")
+        return root
+
+    resolved = os.path.join(versions_dir(root), version) if version else root
+    if cached is None or cached[1] != resolved:
+        logger.info(f"DATA VERSION NOW SERVING: {version or 'unversioned'}")
+    _pointer_cache[root] = (stat_key, resolved)
+    # A rollback serves a retired version again
+    _retired_data_dirs.discard(resolved)
+    if cached is not None and cached[1] != resolved:
+        retire_data_dir(cached[1])
+    return resolved
+
+
+def current_data_dir() -> str:
+    """The data directory for the current request: the pinned version if there is one, else the published one."""
+    return _pinned_data_dir.get() or resolve_data_dir()
+
+
+def pin_data_dir():
+    """Pins the published version for the rest of the request. Returns a token for unpin_data_dir()."""
+    return _pinned_data_dir.set(resolve_data_dir())
+
+
+def unpin_data_dir(token) -> None:
+    _pinned_data_dir.reset(token)
+
+
+def load_metadata(data_dir: str) -> List[Dict]:
+    """
+    The parsed metadata.json of a data directory, shared by every caller in the process: treat it as read-only.
+    Costs one stat unless the file changed. Raises like json.load if it is missing or invalid.
+    """
+    metadata_path = os.path.join(data_dir, "metadata.json")
+    stat = os.stat(metadata_path)
+    stat_key = (stat.st_mtime_ns, stat.st_size)
+    cached = _metadata_cache.get(metadata_path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    with open(metadata_path, "r") as f:
+        metadata = json.load(f)
+    if not is_retired_data_dir(data_dir):
+        _metadata_cache[metadata_path] = (stat_key, metadata)
+    return metadata
+
+
+def _link_tree(src: str, dst: str) -> None:
+    """Recreates src under dst with hard links (copies where linking fails, e.g. across filesystems)."""
+    if os.path.isdir(src):
+        os.makedirs(dst, exist_ok=True)
+        for entry in os.listdir(src):
+            _link_tree(os.path.join(src, entry), os.path.join(dst, entry))
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def create_staging_dir(seed_from_current: bool = True) -> str:
+    """
+    Creates an empty staging directory for a new version. With seed_from_current, it starts as a hard-linked copy
+    of the published data, so a refresh only has to write what changed. Files must be replaced (os.replace), never
+    modified in place, because they are shared with the published version.
+    """
+    os.makedirs(versions_dir(), exist_ok=True)
+    staging_dir = os.path.join(versions_dir(), f"{STAGING_PREFIX}{_new_version_name()}")
+    os.makedirs(staging_dir)
+
+    if seed_from_current:
+        source_dir = resolve_data_dir()
+        for entry in DATA_ENTRIES:
+            source_path = os.path.join(source_dir, entry)
+            if os.path.exists(source_path):
+                _link_tree(source_path, os.path.join(staging_dir, entry))
+        logger.info(f"Staging {staging_dir} seeded from {source_dir}")
+    return staging_dir
+
+
+def _new_version_name() -> str:
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{os.getpid()}"
+
+
+def publish_version(staging_dir: str) -> str:
+    """
+    Turns a verified staging directory into a version and atomically points CURRENT at it.
+    Workers switch to it at their next request. Returns the version name.
+    """
+    root = data_root()
+    version = os.path.basename(staging_dir)[len(STAGING_PREFIX):]
+    version_dir = os.path.join(versions_dir(root), version)
+    os.rename(staging_dir, version_dir)
+
+    previous_dir = resolve_data_dir()
+    pointer_path = os.path.join(root, POINTER_FILENAME)
+    tmp_path = f"{pointer_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer_path)
+
+    # The grace period of the version we just replaced starts now
+    if previous_dir != root and os.path.isdir(previous_dir):
+        os.utime(previous_dir)
+    logger.info(f"Published data version {version}")
+    return version
+
+
+def discard_staging_dir(staging_dir: str) -> None:
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def list_versions() -> List[str]:
+    """Published version names, oldest first."""
+    try:
+        return sorted(
+            name for name in os.listdir(versions_dir())
+            if not name.startswith(STAGING_PREFIX) and os.path.isdir(os.path.join(versions_dir(), name))
+        )
+    except FileNotFoundError:
+        return []
+
+
+def _last_modified(path: str) -> float:
+    """Latest mtime of a version directory and its subdirectories, so a staging dir still being written is never stale."""
+    mtimes = [os.path.getmtime(path)]
+    for entry in os.scandir(path):
+        if entry.is_dir():
+            mtimes.append(entry.stat().st_mtime)
+    return max(mtimes)
+
+
+def gc_versions(keep: int = DATA_KEEP_VERSIONS, grace_seconds: int = DATA_VERSION_GRACE_SECONDS) -> List[str]:
+    """
+    Deletes versions beyond the newest `keep` that have been out of service for longer than the grace period,
+    plus abandoned staging directories. Never deletes the published version. Returns the names removed.
+    """
+    current = os.path.basename(resolve_data_dir())
+    cutoff = time.time() - grace_seconds
+    removed = []
+
+    versions = list_versions()
+    candidates = [name for name in (versions[:-keep] if keep > 0 else versions) if name != current]
+    try:
+        candidates += [name for name in os.listdir(versions_dir()) if name.startswith(STAGING_PREFIX)]
+    except FileNotFoundError:
+        return removed
+
+    for name in candidates:
+        path = os.path.join(versions_dir(), name)
+        try:
+            if _last_modified(path) > cutoff:
+                continue
+            shutil.rmtree(path)
+            removed.append(name)
+            retire_data_dir(path)
+        except OSError as e:
+            logger.warning(f"Could not remove old data version {name}: {e}")
+
+    if removed:
+        logger.info(f"Removed {len(removed)} old data versions: {', '.join(removed)}")
+    return removed
@@ -0,0 +1,136 @@
+"""
+Webhook dedupe shared by every worker on the host.
+
+Neynar retries a webhook if it doesn't get a timely 200, and the retry can land on a different gunicorn worker.
+Processed cast hashes are therefore recorded in a small SQLite database (WAL mode, so readers never block the
+writer) instead of a per-process cache. Claiming a hash is a single INSERT ... ON CONFLICT statement, so two
+workers racing on the same cast can't both win.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from cachetools import TTLCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+DEDUPE_RETENTION_SECONDS = int(os.getenv("DEDUPE_RETENTION_SECONDS", "3600"))
+# Expired rows are deleted (and the WAL checkpointed) every this many claims
+DEDUPE_COMPACT_EVERY = int(os.getenv("DEDUPE_COMPACT_EVERY", "500"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_casts (
+    cast_hash TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+# Inserts the hash, or takes over a row whose retention has run out. Exactly one row changes if we claimed it.
+_CLAIM = """
+INSERT INTO processed_casts (cast_hash, processed_at) VALUES (?, ?)
+ON CONFLICT(cast_hash) DO UPDATE SET processed_at = excluded.processed_at
+WHERE processed_casts.processed_at < ?
+"""
+
+
+class DedupeStore:
+    def __init__(self, db_path: str, retention_seconds: int = DEDUPE_RETENTION_SECONDS, compact_every: int = DEDUPE_COMPACT_EVERY):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.compact_every = compact_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._claims_since_compact = 0
+        # Used only if the database can't be opened, so a bad disk degrades to the old per-process behaviour
+        self._fallback = TTLCache(maxsize=1000, ttl=retention_seconds)
+        self.claims = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross a fork or be shared by threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def check_and_set(self, cast_hash: str) -> bool:
+        """
+        Atomically records cast_hash as processed.
+
+        Returns:
+            bool: True if this call claimed the cast (first time seen within the retention horizon),
+                  False if it is a duplicate
+        """
+        now = time.time()
+        try:
+            cursor = self._connection().execute(_CLAIM, (cast_hash, now, now - self.retention_seconds))
+            claimed = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Dedupe store unavailable, falling back to in-process dedupe: {e}")
+            with self._lock:
+                self.errors += 1
+                claimed = cast_hash not in self._fallback
+                self._fallback[cast_hash] = now
+            return claimed
+
+        with self._lock:
+            if claimed:
+                self.claims += 1
+                self._claims_since_compact += 1
+                compact_now = self._claims_since_compact >= self.compact_every
+                if compact_now:
+                    self._claims_since_compact = 0
+            else:
+                self.duplicates += 1
+                compact_now = False
+
+        if compact_now:
+            self.compact()
+        return claimed
+
+    def compact(self) -> int:
+        """Deletes rows older than the retention horizon and truncates the WAL. Returns the number of rows removed."""
+        try:
+            conn = self._connection()
+            removed = conn.execute(
+                "DELETE FROM processed_casts WHERE processed_at < ?", (time.time() - self.retention_seconds,)
+            ).rowcount
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            logger.debug(f"DEDUPE STORE COMPACTED: {removed} EXPIRED ROWS REMOVED")
+            return removed
+        except sqlite3.Error as e:
+            logger.error(f"Error compacting dedupe store: {e}")
+            return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "db_path": self.db_path,
+                "retention_seconds": self.retention_seconds,
+                "claims": self.claims,
+                "duplicates": self.duplicates,
+                "errors": self.errors,
+            }
+
+
+dedupe_store = DedupeStore(
+    db_path=os.getenv("DEDUPE_DB_PATH", os.path.join(os.getenv("DATA_DIR", "./data"), "dedupe.sqlite3"))
+)
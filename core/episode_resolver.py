@@ -0,0 +1,256 @@
+"""
+Local episode resolution for hybrid queries.
+
+HybridPath used to ask gpt-4 which episode every hybrid question is about, even when the question names it:
+"ep200", "last Monday's show", "the episode with chaskin", "the latest vibe check". resolve_episode() answers
+those from the MetadataIndex (core/metadata_query.py), which is sorted by air date and has host and series lookups:
+
+- episode numbers: "ep200", "episode 200", "module 3", "the hub ep1", "the hub #1" ("#1" alone is not a number)
+- days: "today", "yesterday", "monday's show", "last friday", "jan 10", "january 10, 2025", "1/10/2025", "2025-01-10"
+- date ranges: "in january 2025", "since march" (see parse_date_range)
+- guests and hosts, through the host index ("chaskin" finds chaskin.eth, see core/name_matcher.py); series
+- "latest" / "first", to pick one of several matches, when they say which episode ("the latest vibe check",
+  "the first episode") rather than something else ("the first farcaster hackathon")
+
+Every constraint found narrows the candidates. The result has a confidence: high when the constraints pick out
+one episode, low when they leave several candidates (even a few that aired the same day, since HybridPath answers
+from one transcript). HybridPath only uses results at or above EPISODE_RESOLVER_MIN_CONFIDENCE and asks the LLM
+otherwise.
+"""
+import bisect
+import logging
+import os
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from core.metadata_query import MONTHS, MONTH_PATTERN, MetadataIndex, parse_aired_date, parse_date_range
+from core.name_matcher import SERIES_VARIATIONS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Most episodes returned, as with the identification prompt
+MAX_EPISODES = 3
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+_EPISODE_NUMBER_RE = re.compile(r"\b(ep|episode|module)\s*#?\s*(\d{1,4})\b")
+_EPISODE_ID_RE = re.compile(r"(ep|episode|module)(\d+)$")
+_RELATIVE_DAY_RE = re.compile(r"\b(today|tonight|yesterday)(?:'s)?\b")
+_WEEKDAY_RE = re.compile(rf"\b(?:(last|this|past)\s+)?({'|'.join(WEEKDAYS)})(?:'s)?\b")
+_ISO_DATE_RE = re.compile(r"\b(20\d{2})-(\d{1,2})-(\d{1,2})\b")
+_NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(20\d{2}|\d{2}))?\b")
+_MONTH_DAY_RE = re.compile(rf"\b({MONTH_PATTERN})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s*(20\d{{2}}))?")
+_DAY_MONTH_RE = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({MONTH_PATTERN})\b(?:,?\s*(20\d{{2}}))?")
+_LATEST_WORDS = r"(?:latest|last|most recent|newest)"
+_EARLIEST_WORDS = r"(?:first|earliest|oldest)"
+_EPISODE_NOUNS = r"(?:episodes?|eps?|shows?|streams?|videos?|modules?)"
+
+
+class EpisodeResolution:
+    """Episode ids (most recent first), how sure the resolver is of them, and why."""
+
+    def __init__(self, episode_ids: List[str], confidence: float, reason: str):
+        self.episode_ids = episode_ids
+        self.confidence = confidence
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return f"<EpisodeResolution {self.episode_ids} confidence={self.confidence:.2f} ({self.reason})>"
+
+
+def _build_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _most_recent(month: int, day: int, today: date) -> Optional[date]:
+    """The date with this month and day on or before today (this year's, or last year's if that is still ahead)."""
+    candidate = _build_date(today.year, month, day)
+    if candidate is None or candidate > today:
+        candidate = _build_date(today.year - 1, month, day)
+    return candidate
+
+
+def parse_day(query: str, today: date):
+    """
+    Finds a reference to a single day in a lowercased query.
+    Returns (day, label, query without it), or (None, "", query).
+    """
+    match = _RELATIVE_DAY_RE.search(query)
+    if match:
+        day = today - timedelta(days=1) if match.group(1) == 'yesterday' else today
+        return day, match.group(1), query[:match.start()] + query[match.end():]
+
+    match = _WEEKDAY_RE.search(query)
+    if match:
+        # "monday's show" and "last monday" both mean the most recent monday before today
+        # ("this monday" includes today)
+        days_back = (today.weekday() - WEEKDAYS.index(match.group(2))) % 7
+        if days_back == 0 and match.group(1) in ('last', 'past'):
+            days_back = 7
+        return today - timedelta(days=days_back), match.group(0), query[:match.start()] + query[match.end():]
+
+    match = _ISO_DATE_RE.search(query)
+    if match:
+        day = _build_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        if day:
+            return day, match.group(0), query[:match.start()] + query[match.end():]
+
+    for pattern, month_group, day_group, year_group in ((_MONTH_DAY_RE, 1, 2, 3), (_DAY_MONTH_RE, 2, 1, 3)):
+        match = pattern.search(query)
+        if match:
+            month, day_of_month = MONTHS[match.group(month_group)], int(match.group(day_group))
+            year = match.group(year_group)
+            day = _build_date(int(year), month, day_of_month) if year else _most_recent(month, day_of_month, today)
+            if day:
+                return day, match.group(0), query[:match.start()] + query[match.end():]
+
+    match = _NUMERIC_DATE_RE.search(query)
+    if match:
+        # US order, like the show titles ("1/10/2025")
+        month, day_of_month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if year:
+            day = _build_date(int(year) + (2000 if len(year) == 2 else 0), month, day_of_month)
+        else:
+            day = _most_recent(month, day_of_month, today) if 1 <= month <= 12 else None
+        if day:
+            return day, match.group(0), query[:match.start()] + query[match.end():]
+
+    return None, "", query
+
+
+def _episode_number_key(episode_id: str):
+    """'The Hub ep1' -> ('ep', 1); 'Module 3' -> ('module', 3); None for ids without a number."""
+    match = _EPISODE_ID_RE.search(re.sub(r"\s+", "", str(episode_id).lower()))
+    if not match:
+        return None
+    kind = 'module' if match.group(1) == 'module' else 'ep'
+    return kind, int(match.group(2))
+
+
+def _series_pattern(mentioned_series: List[str]) -> Optional[str]:
+    """Alternation of the ways users write the mentioned series ("the hub", "hub", "vibecheck"), or None."""
+    variants = set()
+    for series in mentioned_series:
+        for variant in SERIES_VARIATIONS.get(series, {series.lower()}):
+            variants.update((variant, variant.replace(' ', '')))
+    if not variants:
+        return None
+    return '|'.join(re.escape(variant) for variant in sorted(variants, key=len, reverse=True))
+
+
+def _picks_one(words: str, text: str, series_pattern: Optional[str]) -> bool:
+    """
+    Whether "latest" / "first" (words) says which episode: it modifies an episode noun or a mentioned series,
+    as in "the latest episode", "the first hub episode", "the last vibe check".
+    """
+    target = _EPISODE_NOUNS if series_pattern is None else rf"(?:(?:{series_pattern})\s+)?{_EPISODE_NOUNS}|{series_pattern}"
+    return re.search(rf"\b{words}\s+(?:the\s+)?(?:{target})\b", text) is not None
+
+
+def resolve_episode(
+    index: MetadataIndex,
+    query: str,
+    mentioned_hosts: List[str],
+    mentioned_series: List[str],
+    today: Optional[date] = None,
+) -> Optional[EpisodeResolution]:
+    """
+    Resolves the episode(s) a hybrid query is about from the metadata alone.
+
+    Args:
+        index (MetadataIndex): Index of the current metadata
+        query (str): The user's query
+        mentioned_hosts (List[str]): Hosts found in the query (core/name_matcher.py)
+        mentioned_series (List[str]): Series found in the query
+        today (date): Date that relative days are resolved against (default: today)
+
+    Returns:
+        EpisodeResolution, or None if the query has nothing to resolve an episode from
+    """
+    today = today or date.today()
+    text = query.lower()
+    candidates: Optional[List[Dict]] = None
+    constraints = []
+    by_number = by_day = False
+
+    def narrow(episodes: List[Dict], constraint: str) -> None:
+        nonlocal candidates
+        ids = {id(episode) for episode in episodes}
+        candidates = episodes if candidates is None else [episode for episode in candidates if id(episode) in ids]
+        constraints.append(constraint)
+
+    series_pattern = _series_pattern(mentioned_series)
+    match = _EPISODE_NUMBER_RE.search(text)
+    if not match and series_pattern:
+        # "#1" is only an episode number right after a series: "the hub #1", not "the #1 tip"
+        match = re.search(rf"\b(?:{series_pattern})\s*()#\s*(\d{{1,4}})\b", text)
+    if match:
+        wanted = ('module' if match.group(1) == 'module' else 'ep', int(match.group(2)))
+        narrow([episode for episode in index.episodes + index.undated
+                if _episode_number_key(episode.get('episode', '')) == wanted], f"number {match.group(0).strip()}")
+        # Only the number is removed: a series written before "#1" stays in the text
+        text = text[:match.start(1)] + text[match.end():]
+        by_number = True
+
+    day, day_label, text = parse_day(text, today)
+    if day is not None:
+        lo, hi = bisect.bisect_left(index.dates, day), bisect.bisect_right(index.dates, day)
+        narrow(index.episodes[lo:hi], f"aired {day.isoformat()} ({day_label})")
+        by_day = True
+    else:
+        start, end, range_label, text = parse_date_range(text, today)
+        if range_label:
+            narrow(index.select([], [], start, end), range_label)
+
+    if mentioned_hosts:
+        # Every host mentioned must be on the episode
+        for host in mentioned_hosts:
+            narrow(index.select([host], [], None, None), f"host {host}")
+    if mentioned_series:
+        narrow(index.select([], mentioned_series, None, None), f"series {', '.join(mentioned_series)}")
+
+    latest = _picks_one(_LATEST_WORDS, text, series_pattern)
+    earliest = not latest and _picks_one(_EARLIEST_WORDS, text, series_pattern)
+    if candidates is None:
+        if not latest:
+            return None
+        # "what did I miss on the latest episode?"
+        candidates = index.episodes
+        constraints.append("latest")
+
+    reason = ", ".join(constraints)
+    # Dated candidates are in index order, oldest first
+    dated = [episode for episode in candidates if parse_aired_date(episode.get('aired_date', ''))]
+    undated = [episode for episode in candidates if not parse_aired_date(episode.get('aired_date', ''))]
+    # Most recent first, as the identification prompt asks for
+    ordered = list(reversed(dated)) + undated
+    ids = [episode.get('episode') for episode in ordered]
+
+    if not ids:
+        resolution = EpisodeResolution([], 0.0, f"no episode matches {reason}")
+    elif len(ids) == 1:
+        resolution = EpisodeResolution(ids, 0.95 if by_number or by_day else 0.9, reason)
+    elif latest and dated:
+        resolution = EpisodeResolution(ids[:1], 0.85, f"{reason}, most recent of {len(ids)}")
+    elif earliest and dated:
+        resolution = EpisodeResolution([dated[0].get('episode')], 0.85, f"{reason}, first of {len(ids)}")
+    elif by_day and len(ids) <= MAX_EPISODES:
+        # A few episodes aired that day. HybridPath answers from one transcript, so which one is left to the LLM,
+        # which can tell them apart by the rest of the question (as with the same episode number in several series)
+        resolution = EpisodeResolution(ids, 0.6, f"{reason}, {len(ids)} episodes")
+    else:
+        resolution = EpisodeResolution(ids[:MAX_EPISODES], 0.4, f"{reason}, {len(ids)} candidates")
+
+    logger.debug(f"EPISODE RESOLVER: {resolution}")
+    return resolution
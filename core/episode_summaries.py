@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from core.utils import format_timestamp
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Summaries live in a sibling directory of the transcripts so that a full transcript refresh
+# does not wipe them out; stale summaries are detected through the stored transcript hash.
+SUMMARIES_SUBDIR = 'summaries'
+
+# Questions that ask for a recap of an episode rather than a specific detail from it
+SUMMARY_QUERY_PATTERN = re.compile(
+    r"\b("
+    r"summar(y|ies|ize|ise|ized|ised|izing|ising)|recap|tl;?dr|rundown|overview|highlights|gist|"
+    r"what did i miss|what'?d i miss|what was (discussed|covered|talked about)|"
+    r"key (points|takeaways|topics)|main (points|takeaways|topics)"
+    r")\b",
+    re.IGNORECASE
+)
+
+
+def is_summary_query(query: str) -> bool:
+    """Returns True if the user is asking for a summary/recap of an episode."""
+    return bool(query) and SUMMARY_QUERY_PATTERN.search(query) is not None
+
+
+def get_summaries_dir(data_dir: str) -> str:
+    """Directory that holds the precomputed episode summaries."""
+    return os.path.join(data_dir, SUMMARIES_SUBDIR)
+
+
+def get_summary_filename(transcript_path: str) -> str:
+    """Maps a transcript filename (transcript_ep50.json) to its summary filename (summary_ep50.json)."""
+    if transcript_path.startswith('transcript_'):
+        return 'summary_' + transcript_path[len('transcript_'):]
+    return 'summary_' + transcript_path
+
+
+def get_summary_path(data_dir: str, transcript_path: str) -> str:
+    return os.path.join(get_summaries_dir(data_dir), get_summary_filename(transcript_path))
+
+
+def compute_file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Streams a file through sha256 so large transcripts are never fully held in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_episode_summary(data_dir: str, transcript_path: str) -> Optional[Dict]:
+    """
+    Loads the precomputed summary for an episode.
+    Returns None if there is no summary, or if the transcript on disk no longer matches the one the summary
+    was generated from (a cheap size check; the batch job does the full hash comparison).
+    """
+    summary_path = get_summary_path(data_dir, transcript_path)
+    if not os.path.exists(summary_path):
+        logger.debug(f"No precomputed summary found at {summary_path}")
+        return None
+
+    try:
+        with open(summary_path, 'r') as f:
+            summary = json.load(f)
+
+        full_transcript_path = os.path.join(data_dir, 'transcripts', transcript_path)
+        expected_size = summary.get('transcript_size')
+        if expected_size is not None and os.path.exists(full_transcript_path):
+            if os.path.getsize(full_transcript_path) != expected_size:
+                logger.warning(f"Summary for {transcript_path} is stale (transcript size changed). Ignoring...")
+                return None
+
+        if not summary.get('summary'):
+            return None
+
+        return summary
+
+    except Exception as e:
+        logger.error(f"Error loading episode summary {summary_path}: {e}")
+        return None
+
+
+def build_timestamped_transcript(transcript_data: Dict) -> str:
+    """
+    Builds a paragraph-per-line transcript prefixed with [MM:SS] start times.
+    Used by the batch job so the LLM can produce an outline with real timestamps.
+    """
+    alternatives = transcript_data['results']['channels'][0]['alternatives'][0]
+    paragraphs = alternatives.get('paragraphs', {}).get('paragraphs', [])
+
+    if not paragraphs:
+        return alternatives.get('transcript', '')
+
+    lines = []
+    for para in paragraphs:
+        text = " ".join(s['text'] for s in para.get('sentences', []))
+        if text:
+            lines.append(f"[{format_timestamp(para['start'])}] {text}")
+    return "\n".join(lines)
+
+
+def parse_timestamp(timestamp: str) -> Optional[int]:
+    """Converts MM:SS or HH:MM:SS into seconds. Returns None if the value can't be parsed."""
+    try:
+        parts = [int(p) for p in str(timestamp).strip().split(':')]
+    except ValueError:
+        return None
+    if not parts or len(parts) > 3:
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def format_summary_context(episode_metadata: Dict, summary: Dict) -> str:
+    """
+    Formats a precomputed summary and outline as LLM context, in the same layout as the full transcript context.
+    Outline entries get a YouTube link that jumps to the timestamp.
+    """
+    base_url = episode_metadata.get('youtube_url', '').split('?')[0]
+
+    outline_lines: List[str] = []
+    for item in summary.get('outline', []):
+        timestamp = item.get('timestamp', '')
+        topic = item.get('topic', '')
+        seconds = parse_timestamp(timestamp)
+        if base_url and seconds is not None:
+            outline_lines.append(f"[{timestamp}] {topic} ({base_url}?t={seconds})")
+        else:
+            outline_lines.append(f"[{timestamp}] {topic}")
+
+    return (
+        "EPISODE METADATA:\n"
+        f"Series: {episode_metadata.get('series', 'N/A')}\n"
+        f"Episode: {episode_metadata.get('episode', 'N/A')}\n"
+        f"Title: {episode_metadata.get('title', 'N/A')}\n"
+        f"Hosts: {', '.join(episode_metadata.get('hosts', ['N/A']))}\n"
+        f"Aired Date: {episode_metadata.get('aired_date', 'N/A')}\n"
+        f"YouTube URL: {episode_metadata.get('youtube_url', 'N/A')}\n"
+        "\nEPISODE SUMMARY:\n"
+        f"{summary.get('summary', '').strip()}\n"
+        "\nTIMESTAMPED OUTLINE:\n"
+        + "\n".join(outline_lines)
+    )
@@ -0,0 +1,38 @@
+"""
+Clients that are created on first use.
+
+Importing the openai and pinecone packages and building their clients is most of what it costs to import api.py.
+A LazyClient stands in for the client and builds it (importing the package then) the first time an attribute is
+used, so processes and requests that never call an upstream never pay for it. core/warm_start.py touches the
+clients in each worker before it reports ready, so requests don't pay for it either.
+"""
+import threading
+from typing import Any, Callable
+
+
+class LazyClient:
+    def __init__(self, factory: Callable[[], Any], name: str):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return client
+
+    @property
+    def created(self) -> bool:
+        return self._client is not None
+
+    def __getattr__(self, attribute: str) -> Any:
+        # Only called for attributes LazyClient doesn't define itself
+        return getattr(self.get(), attribute)
+
+    def __repr__(self) -> str:
+        return f"<LazyClient {self._name}{'' if self.created else ' (not created)'}>"
@@ -0,0 +1,234 @@
+"""
+Non-blocking logging for the web process.
+
+setup_async_logging() moves the root logger's handlers behind a queue: request threads only enqueue
+the LogRecord, and a background listener thread formats and writes it. Records are enqueued unformatted,
+so expensive arguments (see LoggedMessages) are rendered on the listener thread, not in the request.
+A forked process (a gunicorn worker under --preload) inherits the handler but not the thread, so it starts its own.
+
+LoggedMessages renders chat messages for the log with every very long line (a full transcript, a metadata
+dump) written once to LOG_PAYLOAD_DIR/<sha256>.txt and replaced by a reference to that file, so the same
+transcript is stored once instead of being printed on every hybrid call. Payload files older than
+LOG_PAYLOAD_MAX_AGE_SECONDS, and the oldest ones past LOG_PAYLOAD_MAX_BYTES in total, are deleted as new ones are
+written; the set of hashes already written is an LRU of the most recent ones.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+ASYNC_LOGGING = os.getenv("ASYNC_LOGGING", "true").lower() == "true"
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "10000"))
+LOG_PAYLOAD_DIR = os.getenv("LOG_PAYLOAD_DIR", os.path.join(tempfile.gettempdir(), "gmfc101_log_payloads"))
+# Lines longer than this are written to LOG_PAYLOAD_DIR and logged as a reference
+LOG_PAYLOAD_INLINE_CHARS = int(os.getenv("LOG_PAYLOAD_INLINE_CHARS", "2000"))
+# Fraction of LLM message dumps that are logged at all
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+# Payload files are deleted once older than this, and oldest first once all of them take more than LOG_PAYLOAD_MAX_BYTES
+LOG_PAYLOAD_MAX_AGE_SECONDS = int(os.getenv("LOG_PAYLOAD_MAX_AGE_SECONDS", "86400"))
+LOG_PAYLOAD_MAX_BYTES = int(os.getenv("LOG_PAYLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+# The payload directory is cleaned up every this many new payload files
+LOG_PAYLOAD_CLEANUP_EVERY = 100
+# Hashes of the most recently written payloads, so repeated transcripts don't stat the file every time
+WRITTEN_PAYLOADS_MAXSIZE = 1000
+
+_written_payloads: "OrderedDict[str, None]" = OrderedDict()
+_written_payloads_lock = threading.Lock()
+_payloads_since_cleanup = 0
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _payload_reference(text: str) -> str:
+    """Writes text to the payload directory (once per distinct content) and returns a short reference to it."""
+    global _payloads_since_cleanup
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    with _written_payloads_lock:
+        already_written = digest in _written_payloads
+        _written_payloads[digest] = None
+        _written_payloads.move_to_end(digest)
+        while len(_written_payloads) > WRITTEN_PAYLOADS_MAXSIZE:
+            _written_payloads.popitem(last=False)
+
+    path = os.path.join(LOG_PAYLOAD_DIR, f"{digest}.txt")
+    if not already_written and not os.path.exists(path):
+        try:
+            os.makedirs(LOG_PAYLOAD_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        except OSError as e:
+            return f"<{len(text)} chars, sha256:{digest}, not written: {e}>"
+        with _written_payloads_lock:
+            _payloads_since_cleanup += 1
+            cleanup_due = _payloads_since_cleanup >= LOG_PAYLOAD_CLEANUP_EVERY
+            if cleanup_due:
+                _payloads_since_cleanup = 0
+        if cleanup_due:
+            cleanup_payload_dir()
+    return f"<{len(text)} chars, sha256:{digest}, see {path}>"
+
+
+def cleanup_payload_dir() -> None:
+    """Deletes payload files past LOG_PAYLOAD_MAX_AGE_SECONDS, then the oldest ones until LOG_PAYLOAD_MAX_BYTES fits."""
+    try:
+        entries = []
+        with os.scandir(LOG_PAYLOAD_DIR) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name[:-len(".txt")]))
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logger.error(f"Error listing log payloads: {e}")
+        return
+
+    entries.sort()
+    cutoff = time.time() - LOG_PAYLOAD_MAX_AGE_SECONDS
+    total_bytes = sum(size for _, size, _, _ in entries)
+    removed = []
+    for mtime, size, path, digest in entries:
+        if mtime >= cutoff and total_bytes <= LOG_PAYLOAD_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting log payload {path}: {e}")
+            continue
+        total_bytes -= size
+        removed.append(digest)
+
+    if removed:
+        with _written_payloads_lock:
+            for digest in removed:
+                _written_payloads.pop(digest, None)
+        logger.debug(f"Deleted {len(removed)} old log payloads")
+
+
+class LoggedMessages:
+    """
+    Log argument for a list of chat messages. Rendering (hashing, writing payload files and json.dumps)
+    happens in __str__, which with async logging runs on the listener thread.
+    """
+
+    def __init__(self, messages: List[Dict]):
+        # Shallow copy so later appends to the caller's list don't change what gets logged
+        self.messages = list(messages)
+
+    def __str__(self) -> str:
+        rendered = []
+        for message in self.messages:
+            content = message.get("content")
+            if isinstance(content, str) and len(content) > LOG_PAYLOAD_INLINE_CHARS:
+                content = "\n".join(
+                    _payload_reference(line) if len(line) > LOG_PAYLOAD_INLINE_CHARS else line
+                    for line in content.split("\n")
+                )
+            rendered.append({**message, "content": content})
+        return json.dumps(rendered, indent=2)
+
+
+def log_llm_messages(target_logger: logging.Logger, label: str, messages: List[Dict]) -> None:
+    """Logs the messages of an LLM request (sampled by LOG_PAYLOAD_SAMPLE_RATE) without rendering them in the caller."""
+    if not target_logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    target_logger.info("%s: %s", label, LoggedMessages(messages))
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+    The stock handler formats the message (and calls str() on every argument) before enqueueing.
+    Full queues drop the record instead of blocking the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks reference frames of the request thread, so render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_async_logging() -> None:
+    """
+    Moves the root logger's handlers onto a background listener thread. Safe to call more than once;
+    does nothing if ASYNC_LOGGING is false.
+    """
+    global _listener
+    if not ASYNC_LOGGING or _listener is not None:
+        return
+
+    root = logging.getLogger()
+    handlers = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handlers = [handler]
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_async_logging)
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+    logger.debug("ASYNC LOGGING ENABLED")
+
+
+def _restart_listener_after_fork() -> None:
+    """
+    Gives a forked child a new queue and listener thread. The inherited queue is replaced rather than reused,
+    since its lock may have been held by the parent's listener thread at the moment of the fork.
+    """
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, _DeferredQueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_async_logging() -> None:
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
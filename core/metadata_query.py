@@ -0,0 +1,376 @@
+"""
+Local answers to aggregate metadata questions.
+
+MetadataPath used to send every matching episode to gpt-4o as JSON and ask the model to count them, or to find the
+first or last one. answer_metadata_question() works these out locally, over a MetadataIndex that is built once per
+metadata.json (see get_metadata_index). It handles:
+
+- counts: "how many times has dwr been a guest?", "how many episodes of the hub are there?"
+- first/last and recency: "when was the first episode?", "what's the latest vibe check?"
+- date ranges: "in 2024", "in january 2025", "since march 2024", "before 2024", "this month", "past 30 days"
+- listings per host and per series: "which episodes was erica on?", "list the farcaster 101 episodes"
+
+The result is a MetadataFacts: a few lines of computed facts plus only the episodes they are about, which replace
+the full metadata in the prompt. When the question is a simple "how many ..." or "when was the first/last ..."
+question, it also carries a finished answer, and the LLM call can be skipped. Anything the templates can't render
+(who hosted or guested, what was mentioned where) keeps the computed facts but goes to the LLM. Questions that are
+not aggregate questions return None and take the existing path.
+"""
+import bisect
+import logging
+import os
+import re
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from core.data_store import is_retired_data_dir, register_cache_evictor
+from core.metadata_serializer import COLUMNS_BY_INTENT, serialize_metadata
+from core.name_matcher import get_name_matcher
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Metadata fields the LLM never needs
+CONTEXT_FIELDS_EXCLUDED = {'companion_blog', 'transcript_path'}
+
+# Most episodes sent to the LLM with the computed facts
+MAX_CONTEXT_EPISODES = 25
+
+COUNT, FIRST, LAST, LIST = "count", "first", "last", "list"
+
+MONTHS = {
+    'jan': 1, 'january': 1, 'feb': 2, 'february': 2, 'mar': 3, 'march': 3, 'apr': 4, 'april': 4, 'may': 5,
+    'jun': 6, 'june': 6, 'jul': 7, 'july': 7, 'aug': 8, 'august': 8, 'sep': 9, 'sept': 9, 'september': 9,
+    'oct': 10, 'october': 10, 'nov': 11, 'november': 11, 'dec': 12, 'december': 12,
+}
+MONTH_PATTERN = '|'.join(sorted(MONTHS, key=len, reverse=True))
+
+# "since march 2024", "in 2024", "before jan", "january 2025". A month on its own needs a preposition,
+# so "may" and "mar" in ordinary sentences are not read as dates.
+_PERIOD_RE = re.compile(
+    rf"\b(?:(since|after|from|before|until|in|during)\s+)?(?:({MONTH_PATTERN})\.?(?:\s*,?\s*(20\d{{2}}))?|(20\d{{2}}))\b"
+)
+_RELATIVE_RE = re.compile(r"\b(this|last|past|previous)\s+(week|month|year)\b")
+_RECENT_DAYS_RE = re.compile(r"\b(?:past|last)\s+(\d{1,3})\s+(day|week|month)s?\b")
+
+_COUNT_RE = re.compile(r"\b(how many|how often|number of|count)\b")
+_FIRST_RE = re.compile(r"\b(first|earliest|oldest)\b")
+_LAST_RE = re.compile(r"\b(last|latest|most recent|newest|recent|previous)\b")
+_LIST_RE = re.compile(r"\b(which|list|all)\b|\bwhat (episodes|shows)\b")
+_EPISODES_RE = re.compile(r"\b(episodes?|shows?|eps|streams?|videos?)\b")
+# Questions about one specific episode ("ep200", "module 3") are not aggregate questions
+_SPECIFIC_EPISODE_RE = re.compile(r"\b(ep|episode|module)\s*#?\d+\b")
+# Anything that asks for more than the computed facts, so the question has to go to the LLM
+_COMPOUND_RE = re.compile(
+    r"\b(and|also|plus|why|about|summar\w*|talk\w*|discuss\w*|said|say|says|explain\w*|recommend\w*|should)\b"
+)
+# The only question shapes with a templated answer: "how many ...", and "when was / what's the first/last ..."
+_GREETING_RE = re.compile(r"^(?:(?:@[\w.-]+|gm|hey|hi)\b[\s,!:.]*)+")
+_TEMPLATE_SHAPES = {
+    COUNT: re.compile(r"^(how many|how often|number of)\b"),
+    FIRST: re.compile(r"^(when|what|which)(?:'s|\s+(?:was|is|did|does))?\s+(?:the\s+)?(?:very\s+)?(first|earliest|oldest)\b"),
+    LAST: re.compile(
+        r"^(when|what|which)(?:'s|\s+(?:was|is|did|does))?\s+(?:the\s+)?(?:very\s+)?(last|latest|most recent|newest)\b"
+    ),
+}
+# What the templates can't render: people ("who hosted the first episode?", "how many guests ...") and what was said
+# or where ("the first episode where they mention frames")
+_NOT_TEMPLATED_RE = re.compile(r"\b(who|whom|whose|guests|hosts|people|mention\w*|where|topics?)\b")
+_NOT_TEMPLATED_EPISODE_RE = re.compile(r"\b(host\w*|guest\w*|featur\w*|cohost\w*|co-host\w*)\b")
+
+
+def find_mentioned_series(query: str) -> List[str]:
+    """Series named in the query (see core/name_matcher.py)."""
+    return get_name_matcher().find(query).series
+
+
+def strip_context_fields(episodes: List[Dict]) -> List[Dict]:
+    """Copies of the episodes without the fields the LLM never needs."""
+    return [{k: v for k, v in episode.items() if k not in CONTEXT_FIELDS_EXCLUDED} for episode in episodes]
+
+
+def parse_aired_date(value) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _format_date(value: date) -> str:
+    return f"{value:%B} {value.day}, {value.year}"
+
+
+class MetadataIndex:
+    """Episodes sorted by air date, with lookups by host and series. Built once per metadata.json."""
+
+    def __init__(self, metadata: List[Dict]):
+        self.metadata = metadata
+        dated = []
+        self.undated = []
+        for episode in metadata:
+            aired = parse_aired_date(episode.get('aired_date', ''))
+            if aired is None:
+                self.undated.append(episode)
+            else:
+                dated.append((aired, episode))
+        dated.sort(key=lambda item: item[0])
+        self.dates = [aired for aired, _ in dated]
+        self.episodes = [episode for _, episode in dated]
+
+        # Lowercased host / series -> ids of their episodes
+        self.by_host: Dict[str, set] = {}
+        self.by_series: Dict[str, set] = {}
+        for episode in metadata:
+            for host in episode.get('hosts', []):
+                self.by_host.setdefault(host.lower(), set()).add(id(episode))
+            if episode.get('series'):
+                self.by_series.setdefault(episode['series'].lower(), set()).add(id(episode))
+
+    def select(self, hosts: List[str], series: List[str], start: Optional[date], end: Optional[date]) -> List[Dict]:
+        """
+        Episodes with any of the hosts and in any of the series, aired in [start, end), oldest first.
+        Episodes without a valid aired_date are included at the start only when there is no date range.
+        """
+        lo = bisect.bisect_left(self.dates, start) if start else 0
+        hi = bisect.bisect_left(self.dates, end) if end else len(self.dates)
+        candidates = self.episodes[lo:hi]
+        if start is None and end is None:
+            candidates = self.undated + candidates
+
+        for names, lookup in ((hosts, self.by_host), (series, self.by_series)):
+            if names:
+                ids = set().union(*(lookup.get(name.lower(), set()) for name in names))
+                candidates = [episode for episode in candidates if id(episode) in ids]
+        return candidates
+
+
+# data_dir -> MetadataIndex of the metadata list load_metadata() returned for it
+_indexes: Dict[str, MetadataIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_metadata_index(data_dir: str, metadata: List[Dict]) -> MetadataIndex:
+    """The index of a data directory's metadata, rebuilt only when load_metadata() has returned a new list."""
+    index = _indexes.get(data_dir)
+    if index is not None and index.metadata is metadata:
+        return index
+    with _indexes_lock:
+        index = _indexes.get(data_dir)
+        if index is None or index.metadata is not metadata:
+            index = MetadataIndex(metadata)
+            if not is_retired_data_dir(data_dir):
+                _indexes[data_dir] = index
+    return index
+
+
+register_cache_evictor(lambda data_dir: _indexes.pop(data_dir, None))
+
+
+class MetadataFacts:
+    """What answer_metadata_question() worked out: facts and episodes for the prompt, and an answer if it has one."""
+
+    def __init__(self, intent: str, facts: List[str], episodes: List[Dict], answer: Optional[str] = None):
+        self.intent = intent
+        self.facts = facts
+        self.episodes = episodes
+        self.answer = answer
+
+    def to_context(self) -> str:
+        facts = "\n".join(f"- {fact}" for fact in self.facts)
+        return (
+            f"Computed facts (exact, use these rather than counting episodes yourself):\n{facts}\n"
+            f"Episodes:\n{serialize_metadata(self.episodes, COLUMNS_BY_INTENT.get(self.intent))}"
+        )
+
+    def reply(self, user_name: str) -> str:
+        return f"GM @{user_name}! {self.answer}"
+
+
+def parse_date_range(query: str, today: date) -> Tuple[Optional[date], Optional[date], str, str]:
+    """
+    Finds the first date range in a lowercased query.
+    Returns (start, end, label, query without it); start is inclusive, end exclusive, either may be None.
+    """
+    match = _RECENT_DAYS_RE.search(query)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        days = amount * {'day': 1, 'week': 7, 'month': 30}[unit]
+        start, end = today - timedelta(days=days - 1), today + timedelta(days=1)
+        label = f"in the past {amount} {unit}{'s' if amount != 1 else ''}"
+        return start, end, label, query[:match.start()] + query[match.end():]
+
+    match = _RELATIVE_RE.search(query)
+    if match:
+        which, unit = match.group(1), match.group(2)
+        previous = which != 'this'
+        if unit == 'week':
+            start = today - timedelta(days=today.weekday() + (7 if previous else 0))
+            end = start + timedelta(days=7)
+        elif unit == 'month':
+            start = today.replace(day=1)
+            if previous:
+                start = (start - timedelta(days=1)).replace(day=1)
+            end = (start + timedelta(days=32)).replace(day=1)
+        else:
+            start = date(today.year - (1 if previous else 0), 1, 1)
+            end = date(start.year + 1, 1, 1)
+        label = f"{'last' if previous else 'this'} {unit}"
+        return start, end, label, query[:match.start()] + query[match.end():]
+
+    for match in _PERIOD_RE.finditer(query):
+        preposition, month_name, month_year, year = match.groups()
+        if month_name:
+            if not preposition and not month_year:
+                continue
+            month = MONTHS[month_name]
+            # A month without a year is its most recent occurrence
+            period_year = int(month_year) if month_year else (today.year if month <= today.month else today.year - 1)
+            period_start = date(period_year, month, 1)
+            period_end = date(period_year + (month == 12), month % 12 + 1, 1)
+            period_label = f"{period_start:%B} {period_year}"
+        else:
+            period_start, period_end = date(int(year), 1, 1), date(int(year) + 1, 1, 1)
+            period_label = year
+
+        if preposition in ('since', 'from'):
+            start, end, label = period_start, None, f"since {period_label}"
+        elif preposition == 'after':
+            start, end, label = period_end, None, f"after {period_label}"
+        elif preposition == 'before':
+            start, end, label = None, period_start, f"before {period_label}"
+        elif preposition == 'until':
+            start, end, label = None, period_end, f"through {period_label}"
+        else:
+            start, end, label = period_start, period_end, f"in {period_label}"
+        return start, end, label, query[:match.start()] + query[match.end():]
+
+    return None, None, "", query
+
+
+def _describe_episode(episode: Dict) -> str:
+    aired = parse_aired_date(episode.get('aired_date', ''))
+    when = f", aired {_format_date(aired)}" if aired else ""
+    url = f": {episode['youtube_url']}" if episode.get('youtube_url') else ""
+    return f"\"{episode.get('title') or episode.get('episode')}\"{when}{url}"
+
+
+def _scope(hosts: List[str], series: List[str], label: str, count: int = 2) -> str:
+    """Human readable description of the filters, e.g. 'Vibe Check episodes with @dwr.eth in 2024'."""
+    noun = "episode" if count == 1 else "episodes"
+    parts = [f"{' or '.join(series)} {noun}" if series else noun]
+    if hosts:
+        parts.append("with " + " or ".join(f"@{host}" for host in hosts))
+    if label:
+        parts.append(label)
+    return " ".join(parts)
+
+
+def _is_templated_shape(intent: str, text: str) -> bool:
+    """Whether a question (lowercased, date range removed) has one of the shapes the templated answers render."""
+    text = _GREETING_RE.sub("", text.strip(" ,.!:")).strip(" ,.!:")
+    if not _TEMPLATE_SHAPES[intent].search(text) or _COMPOUND_RE.search(text) or _NOT_TEMPLATED_RE.search(text):
+        return False
+    # "who was the guest on the last episode" asks for a person, not the episode
+    return intent == COUNT or not _NOT_TEMPLATED_EPISODE_RE.search(text)
+
+
+def answer_metadata_question(
+    index: MetadataIndex,
+    query: str,
+    mentioned_hosts: List[str],
+    mentioned_series: Optional[List[str]] = None,
+    today: Optional[date] = None,
+) -> Optional[MetadataFacts]:
+    """
+    Answers count, first/last, date range and listing questions over the metadata index.
+
+    Args:
+        index (MetadataIndex): Index of the current metadata
+        query (str): The user's query
+        mentioned_hosts (List[str]): Hosts found in the query by the prefilter
+        mentioned_series (List[str]): Series named in the query (found with find_mentioned_series if None)
+        today (date): Date that relative ranges are resolved against (default: today)
+
+    Returns:
+        MetadataFacts, or None if the query is not an aggregate question
+    """
+    today = today or date.today()
+    series = find_mentioned_series(query) if mentioned_series is None else mentioned_series
+    text = query.lower()
+    if _SPECIFIC_EPISODE_RE.search(text):
+        return None
+    start, end, label, text = parse_date_range(text, today)
+
+    # Without a host, series or date to go on, only questions that are plainly about episodes are aggregate
+    # questions; "what's the first step to set up a wallet" is not
+    filtered = bool(mentioned_hosts or series or label)
+    if not filtered and not _EPISODES_RE.search(text):
+        return None
+
+    if _COUNT_RE.search(text):
+        intent = COUNT
+    elif _FIRST_RE.search(text):
+        intent = FIRST
+    elif _LAST_RE.search(text):
+        intent = LAST
+    elif filtered and (_LIST_RE.search(text) or label):
+        intent = LIST
+    else:
+        return None
+
+    episodes = index.select(mentioned_hosts, series, start, end)
+    dated = [episode for episode in episodes if parse_aired_date(episode.get('aired_date', ''))]
+    scope = _scope(mentioned_hosts, series, label)
+    facts = [f"Number of {scope}: {len(episodes)}"]
+    if dated:
+        facts.append(f"First of these: {_describe_episode(dated[0])}")
+        facts.append(f"Most recent of these: {_describe_episode(dated[-1])}")
+    facts.append(f"Today's date: {_format_date(today)}")
+
+    if intent == FIRST:
+        context_episodes = dated[:5]
+    elif intent == LAST:
+        context_episodes = dated[-5:]
+    elif intent == LIST:
+        context_episodes = episodes[-MAX_CONTEXT_EPISODES:]
+        if len(episodes) > MAX_CONTEXT_EPISODES:
+            facts.append(f"Only the {MAX_CONTEXT_EPISODES} most recent of these are listed below")
+    else:
+        context_episodes = dated[-10:]
+
+    answer = None
+    # Only simple, single questions about one host and one series are answered without the LLM
+    simple = (
+        intent in (COUNT, FIRST, LAST) and dated and len(mentioned_hosts) <= 1 and len(series) <= 1
+        and query.count('?') <= 1 and _is_templated_shape(intent, text)
+    )
+    if simple:
+        if intent == COUNT:
+            if mentioned_hosts:
+                subject = f"@{mentioned_hosts[0]} has been on {len(episodes)} {_scope([], series, label, len(episodes))}"
+            else:
+                # "There were 10 episodes last month", "There have been 53 The Hub episodes"
+                if end is not None and end <= today:
+                    verb = "was" if len(episodes) == 1 else "were"
+                else:
+                    verb = "has been" if len(episodes) == 1 else "have been"
+                subject = f"There {verb} {len(episodes)} {_scope(mentioned_hosts, series, label, len(episodes))}"
+            answer = f"{subject}. The most recent was {_describe_episode(dated[-1])}"
+        else:
+            which = "first" if intent == FIRST else "most recent"
+            episode = dated[0] if intent == FIRST else dated[-1]
+            if mentioned_hosts or series or label:
+                answer = f"The {which} of the {scope} is {_describe_episode(episode)}"
+            else:
+                answer = f"The {which} episode is {_describe_episode(episode)}"
+
+    logger.debug(f"METADATA QUERY: intent={intent}, hosts={mentioned_hosts}, series={series}, range='{label}', "
+                 f"{len(episodes)} episodes, answered locally={answer is not None}")
+    return MetadataFacts(intent, facts, context_episodes, answer)
@@ -0,0 +1,88 @@
+"""
+Compact metadata for prompts.
+
+json.dumps(episodes) repeats every key ("youtube_url", "hosts", "aired_date", ...) and its quoting for every
+episode, and the same host and series names appear hundreds of times. serialize_metadata() writes the episodes as
+a table instead: a header row, then one '|'-delimited row per episode. Series names and hosts that appear more than
+once are written once in a legend above the table and referred to by short codes (s1, h1) in the rows. The
+prompts that include the table explain the format to the model.
+
+Only the columns the prompt needs are written. Callers pick them per question type, e.g. episode identification
+doesn't need URLs. scripts/run_benchmarks.py reports the size of both formats.
+
+Example:
+    Series: s1=GM Farcaster
+    Hosts: h1=NounishProf, h2=adrienne
+    episode|title|aired_date|series|hosts|youtube_url
+    ep50|GM Farcaster ep50, Jan 22, 2024|2024-01-22|s1|h1,h2|https://youtu.be/Yg_6IBhLraw
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+DELIMITER = "|"
+
+# Columns written when the caller doesn't ask for specific ones
+DEFAULT_COLUMNS = ('episode', 'title', 'aired_date', 'series', 'hosts', 'youtube_url')
+# Episode identification only has to return episode ids
+IDENTIFICATION_COLUMNS = ('episode', 'title', 'aired_date', 'series', 'hosts')
+# Per core/metadata_query.py intent: counts don't quote titles, the others may link an episode
+COLUMNS_BY_INTENT = {
+    'count': ('episode', 'aired_date', 'series', 'hosts', 'youtube_url'),
+    'first': DEFAULT_COLUMNS,
+    'last': DEFAULT_COLUMNS,
+    'list': DEFAULT_COLUMNS,
+}
+
+
+def _cell(value) -> str:
+    # Keep every row on one line with the same number of columns
+    return str(value).replace(DELIMITER, "/").replace("\n", " ").strip()
+
+
+def _codes(values: Counter, prefix: str) -> Dict[str, str]:
+    """Codes for the values that appear more than once, most frequent first (so they get the shortest codes)."""
+    repeated = [value for value, uses in values.most_common() if uses > 1]
+    return {value: f"{prefix}{i}" for i, value in enumerate(repeated, start=1)}
+
+
+def serialize_metadata(episodes: List[Dict], columns: Optional[Sequence[str]] = None) -> str:
+    """
+    Writes episodes as a legend plus a '|'-delimited table, in the order given.
+
+    Args:
+        episodes (List[Dict]): Episode metadata entries
+        columns (Sequence[str]): Fields to write (default: DEFAULT_COLUMNS); missing fields are left empty
+
+    Returns:
+        str: The serialized table, or "(no episodes)" if there are none
+    """
+    if not episodes:
+        return "(no episodes)"
+    columns = tuple(columns or DEFAULT_COLUMNS)
+
+    series_codes = {}
+    host_codes = {}
+    if 'series' in columns:
+        series_codes = _codes(Counter(ep['series'] for ep in episodes if ep.get('series')), 's')
+    if 'hosts' in columns:
+        host_codes = _codes(Counter(host for ep in episodes for host in ep.get('hosts') or []), 'h')
+
+    lines = []
+    if series_codes:
+        lines.append("Series: " + ", ".join(f"{code}={_cell(name)}" for name, code in series_codes.items()))
+    if host_codes:
+        lines.append("Hosts: " + ", ".join(f"{code}={_cell(name)}" for name, code in host_codes.items()))
+    lines.append(DELIMITER.join(columns))
+
+    for episode in episodes:
+        cells = []
+        for column in columns:
+            value = episode.get(column)
+            if column == 'hosts':
+                cells.append(",".join(_cell(host_codes.get(host, host)).replace(",", " ") for host in value or []))
+            elif column == 'series' and value:
+                cells.append(series_codes.get(value) or _cell(value))
+            else:
+                cells.append("" if value is None else _cell(value))
+        lines.append(DELIMITER.join(cells))
+    return "\n".join(lines)
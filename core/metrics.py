@@ -0,0 +1,360 @@
+"""
+Counters and latency histograms, served in the Prometheus text format from the /metrics endpoint.
+
+Each process keeps its own values in memory and periodically writes them to
+METRICS_DIR/metrics_<pid>_<start time>.json. A scrape can land on any gunicorn worker, so the endpoint merges the
+files of every worker before rendering.
+
+Workers that have exited are folded into METRICS_DIR/metrics_archive.json (as prometheus_client's multiprocess
+mode does) and their files deleted, so counters never go backwards and the directory doesn't grow with every
+restart. A worker archives its own file when it exits cleanly; files of workers that died are archived by the
+next scrape. The start time in the file name keeps a reused pid from overwriting a dead worker's totals.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: dead workers' files are kept and summed, never archived
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "gmfc101_metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRIC_PREFIX = "gmfc101_"
+ARCHIVE_FILENAME = "metrics_archive.json"
+LOCK_FILENAME = ".metrics.lock"
+
+# Upper bounds in seconds; covers everything from an in-memory cache hit to a slow full-transcript completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "stage_duration_seconds": ("histogram", "Time spent in each webhook pipeline stage"),
+    "route_duration_seconds": ("histogram", "Total webhook handling time by route"),
+    "requests_total": ("counter", "Webhook events handled, by route"),
+    "cache_lookups_total": ("counter", "Cache lookups by cache and result"),
+    "errors_total": ("counter", "Errors caught while handling a webhook, by where they happened"),
+    "truncations_total": ("counter", "Replies cut to the cast byte limit, by where the cut happened"),
+    "depth_refusals_total": ("counter", "Replies skipped because the conversation depth limit was reached"),
+    "admission_decisions_total": ("counter", "Casts shed or deferred by admission control, by action and reason"),
+    "metadata_queries_total": ("counter", "Metadata path questions by the aggregate intent found (other when none)"),
+    "metadata_local_answers_total": ("counter", "Metadata path questions answered from a template without the LLM"),
+    "episode_resolutions_total": ("counter", "Hybrid path episodes resolved from the metadata (local) or by the LLM"),
+    "generation_first_token_seconds": ("histogram", "Time to the first token of a streamed completion, by route"),
+    "generation_total_seconds": ("histogram", "Total time of a streamed completion, by route"),
+    "usage_estimated_total": ("counter", "Streamed completions whose token usage was estimated (no usage chunk)"),
+    "llm_requests_total": ("counter", "Chat completions with recorded token usage, by route"),
+    "llm_prompt_tokens_total": ("counter", "Prompt tokens sent to OpenAI, by route"),
+    "llm_cached_prompt_tokens_total": ("counter", "Prompt tokens served from OpenAI's prompt cache, by route"),
+    "llm_completion_tokens_total": ("counter", "Completion tokens generated by OpenAI, by route"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    def __init__(self, metrics_dir: str, flush_seconds: float):
+        self.metrics_dir = metrics_dir
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = 0
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], list] = {}
+        self._dirty = False
+
+    def _ensure_process(self) -> None:
+        """
+        Resets the values and starts the flush thread the first time a process records anything.
+        A forked worker inherits its parent's values and no flush thread, so both are per pid.
+        Must be called under the lock.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._started = time.time_ns()
+        self._counters = {}
+        self._histograms = {}
+        thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        thread.start()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._ensure_process()
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._ensure_process()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                histogram = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            self._dirty = True
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.metrics_dir, f"metrics_{self._pid}_{self._started}.json")
+
+    def _write_json(self, path: str, data: dict) -> None:
+        """Writes atomically, so a scrape never reads half a file."""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.metrics_dir, prefix=".metrics_")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def flush(self) -> None:
+        """Writes this process's values to its snapshot file."""
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            snapshot = self._to_snapshot(self._counters, self._histograms)
+            path = self._snapshot_path()
+            self._dirty = False
+
+        try:
+            self._write_json(path, snapshot)
+        except OSError as e:
+            logger.error(f"Error writing metrics snapshot: {e}")
+
+    def close(self) -> None:
+        """Flushes this process's values and folds them into the archive. Runs at exit; later values are dropped."""
+        self.flush()
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            path = self._snapshot_path()
+            # Stops the flush thread and any further snapshot writes from this process
+            self._pid = None
+        if fcntl is not None and os.path.exists(path):
+            with self._dir_lock():
+                self._archive([path])
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    @contextlib.contextmanager
+    def _dir_lock(self):
+        """Exclusive lock over the archive and the deletion of archived snapshots, shared by every worker."""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        with open(os.path.join(self.metrics_dir, LOCK_FILENAME), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_snapshot(path: str) -> Optional[dict]:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics snapshot {os.path.basename(path)}: {e}")
+            return None
+
+    @staticmethod
+    def _add_snapshot(counters: dict, histograms: dict, snapshot: dict) -> None:
+        for name, labels, value in snapshot.get("counters", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot.get("histograms", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+
+    @staticmethod
+    def _to_snapshot(counters: dict, histograms: dict) -> dict:
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+            "histograms": [[name, list(labels), values] for (name, labels), values in histograms.items()],
+        }
+
+    def _snapshot_files(self) -> Dict[str, Tuple[int, int]]:
+        """Worker snapshot file name -> (pid, start time)."""
+        files = {}
+        try:
+            filenames = os.listdir(self.metrics_dir)
+        except FileNotFoundError:
+            return files
+        for filename in filenames:
+            if not (filename.startswith("metrics_") and filename.endswith(".json")) or filename == ARCHIVE_FILENAME:
+                continue
+            parts = filename[len("metrics_"):-len(".json")].split("_")
+            if len(parts) == 2 and all(part.isdigit() for part in parts):
+                files[filename] = (int(parts[0]), int(parts[1]))
+        return files
+
+    @staticmethod
+    def _is_running(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Running, under another user
+            return True
+        return True
+
+    def _dead_files(self, files: Dict[str, Tuple[int, int]]) -> list:
+        """Files of exited workers: their pid isn't running, or a newer file with the same pid exists."""
+        latest_start = {}
+        for pid, started in files.values():
+            latest_start[pid] = max(started, latest_start.get(pid, 0))
+        return [
+            filename for filename, (pid, started) in files.items()
+            if pid != os.getpid() and (started < latest_start[pid] or not self._is_running(pid))
+        ]
+
+    def _archive(self, paths: list) -> None:
+        """
+        Adds snapshot files to the archive and deletes them. Must be called under _dir_lock(). The archive lists
+        the files it contains, so a crash between writing it and deleting them can't count them twice.
+        """
+        archive_path = os.path.join(self.metrics_dir, ARCHIVE_FILENAME)
+        archive = self._read_snapshot(archive_path) or {}
+        archived = set(archive.get("archived_files", []))
+        counters: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], list] = {}
+        self._add_snapshot(counters, histograms, archive)
+
+        added = []
+        for path in paths:
+            filename = os.path.basename(path)
+            if filename in archived:
+                continue
+            snapshot = self._read_snapshot(path)
+            if snapshot is not None:
+                self._add_snapshot(counters, histograms, snapshot)
+                added.append(filename)
+
+        try:
+            if added:
+                existing = set(os.listdir(self.metrics_dir))
+                archive = self._to_snapshot(counters, histograms)
+                # Names are only needed until their file is gone
+                archive["archived_files"] = sorted((archived & existing) | set(added))
+                self._write_json(archive_path, archive)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            logger.error(f"Error archiving metrics snapshots: {e}")
+
+    def _merged(self):
+        """Sums the archive and the snapshot files of every running worker, archiving those of exited workers first."""
+        files = self._snapshot_files()
+        if fcntl is not None:
+            with self._dir_lock():
+                dead = self._dead_files(files)
+                if dead:
+                    logger.debug(f"Archiving metrics of {len(dead)} exited workers")
+                    self._archive([os.path.join(self.metrics_dir, filename) for filename in dead])
+                archive = self._read_snapshot(os.path.join(self.metrics_dir, ARCHIVE_FILENAME)) or {}
+                snapshots = [archive]
+                archived = set(archive.get("archived_files", []))
+                for filename in self._snapshot_files():
+                    if filename not in archived:
+                        snapshots.append(self._read_snapshot(os.path.join(self.metrics_dir, filename)) or {})
+        else:
+            snapshots = [self._read_snapshot(os.path.join(self.metrics_dir, filename)) or {} for filename in files]
+
+        counters: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], list] = {}
+        for snapshot in snapshots:
+            self._add_snapshot(counters, histograms, snapshot)
+        return counters, histograms
+
+    def render_prometheus(self) -> str:
+        """Flushes this process and renders the merged values of all workers in the Prometheus text format."""
+        self.flush()
+        counters, histograms = self._merged()
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_HELP.items():
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+
+            if metric_type == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', '+Inf'))} {int(values[-1])}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {int(values[-1])}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_SECONDS)
+atexit.register(metrics.close)
+
+
+def inc_counter(name: str, value: float = 1, **labels) -> None:
+    metrics.inc(name, value, **labels)
+
+
+def observe_seconds(name: str, seconds: float, **labels) -> None:
+    metrics.observe(name, seconds, **labels)
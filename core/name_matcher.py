@@ -0,0 +1,226 @@
+"""
+Finds the hosts, series and title words mentioned in a query.
+
+The prefilters in MetadataPath and HybridPath used to split the query on whitespace and look each known name up in
+the resulting word set. Multi-word names ('dan romero', 'fred wilson', 'proxy studio') never matched, and every
+variant and host was checked for every query. Series were substring matches, so "github" matched "hub".
+
+NameMatcher compiles every host name, name variation, series variation and title word into one Aho-Corasick
+automaton, so a single pass over the query finds all mentions, however many names there are. Matches must start and
+end on word boundaries. Hosts are also matched by their handle without ".eth" ("chaskin" for chaskin.eth). The query
+is tokenized the same way as before (split on whitespace, '.,?!/@' stripped from both ends of each word), so
+"@dwr.eth?" still matches dwr.eth.
+
+One matcher is built per metadata.json (get_name_matcher) and shared by both paths.
+"""
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Set
+from core.data_store import is_retired_data_dir, load_metadata, register_cache_evictor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Host name as it appears in the metadata -> the ways users refer to them
+NAME_VARIATIONS = {
+    'dwr.eth': {'dan', 'dwr', 'dwr.eth', 'dan romero'},
+    'heavygweit': {'erica', 'heavygweit'},
+    'v': {'varun', 'v'},
+    'afrochicks': {'afrochicks', 'naomi'},
+    'naomi': {'naomiii', 'naomi'},
+    'proxystudio.eth': {'proxy', 'proxystudio', 'proxy studio', 'proxystudio.eth'},
+    'ccarella': {'chris carella', 'ccarella'},
+    'meonbase': {'meonbase', 'ceej'},
+    'esteez.eth': {'esteez', 'emma'},
+    'vpabundance': {'james', 'vpabundance'},
+    's-mok-e': {'s-mok-e', 'smoke'},
+    'fredwilson.eth': {'fred wilson', 'fred'},
+}
+
+# Known series and the ways users refer to them
+SERIES_VARIATIONS = {
+    'Special Event': {'special event', 'special'},
+    'GM Farcaster': {'gmfarcaster', 'gm farcaster'},
+    'Vibe Check': {'vibe check', 'vibecheck'},
+    'The Hub': {'hub', 'the hub'},
+    'Here for the Art': {'here for the art'},
+    'Farcaster 101': {'farcaster 101'},
+}
+
+# Title words too common to say which episode a query is about
+TITLE_STOP_WORDS = {
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is',
+    'episode', 'farcaster', 'first', 'last', 'next', 'previous', 'guest', 'guests', 'what', 'you',
+    'your', 'yours', 'this', 'that', 'there', 'here', 'where', 'when', 'how', 'why', 'all', 'any', 'some',
+    'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+}
+
+HOST, SERIES, TITLE_WORD = "host", "series", "title_word"
+
+
+def normalize(text: str) -> str:
+    """Lowercased words with '.,?!/@' stripped from both ends, joined by single spaces."""
+    return " ".join(word for word in (word.strip('.,?!/@') for word in text.lower().split()) if word)
+
+
+class QueryMentions:
+    """What a query mentions, each list in order of first appearance."""
+
+    def __init__(self):
+        self.hosts: List[str] = []
+        self.series: List[str] = []
+        self.title_words: List[str] = []
+        # Host -> the variant the user wrote, for the name mappings given to the LLM
+        self.variants: Dict[str, str] = {}
+
+
+class NameMatcher:
+    def __init__(self, metadata: List[Dict]):
+        self.metadata = metadata
+        # Title word -> episode ids with that word in their title
+        self.title_episode_ids: Dict[str, Set[str]] = {}
+
+        patterns: Dict[str, List[tuple]] = {}
+
+        def add(pattern: str, payload: tuple) -> None:
+            pattern = normalize(pattern)
+            if pattern and payload not in patterns.setdefault(pattern, []):
+                patterns[pattern].append(payload)
+
+        # Later variations win when two hosts share one (e.g. 'naomi'), as in the old lookup table
+        variant_hosts = {}
+        for host, variations in NAME_VARIATIONS.items():
+            for variant in variations:
+                variant_hosts[normalize(variant)] = host
+        for variant, host in variant_hosts.items():
+            add(variant, (HOST, host))
+        for episode in metadata:
+            for host in episode.get('hosts', []):
+                add(host, (HOST, host.lower()))
+        # "chaskin" for chaskin.eth, unless it is some other host's name
+        for episode in metadata:
+            for host in episode.get('hosts', []):
+                handle = normalize(host)
+                if handle.endswith('.eth') and handle[:-len('.eth')] not in patterns:
+                    add(handle[:-len('.eth')], (HOST, host.lower()))
+        for series, variations in SERIES_VARIATIONS.items():
+            for variant in variations:
+                add(variant, (SERIES, series))
+                add(variant.replace(' ', ''), (SERIES, series))
+        for episode in metadata:
+            for word in normalize(episode.get('title') or '').split():
+                if word not in TITLE_STOP_WORDS:
+                    self.title_episode_ids.setdefault(word, set()).add(episode.get('episode'))
+                    add(word, (TITLE_WORD, word))
+
+        self._build(patterns)
+
+    def _build(self, patterns: Dict[str, List[tuple]]) -> None:
+        # Trie: per state, its transitions, its failure link and the (pattern length, payload) it outputs
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[tuple]] = [[]]
+        for pattern, payloads in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].extend((len(pattern), payload) for payload in payloads)
+
+        # Breadth-first, so a state's failure link is final before its children's are computed
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, query: str) -> QueryMentions:
+        """All hosts, series and title words mentioned in the query, in one pass over it."""
+        text = normalize(query)
+        mentions = QueryMentions()
+        seen = set()
+        variant_starts = {}
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if not self._out[state] or (end < len(text) and text[end] != ' '):
+                continue
+            for length, (kind, value) in self._out[state]:
+                start = end - length
+                if start > 0 and text[start - 1] != ' ':
+                    continue
+                # The first mention of a host, and the longest variant starting there ('dan romero' over 'dan')
+                if kind == HOST and (value not in variant_starts or variant_starts[value] == start):
+                    variant_starts[value] = start
+                    mentions.variants[value] = text[start:end]
+                if (kind, value) in seen:
+                    continue
+                seen.add((kind, value))
+                if kind == HOST:
+                    mentions.hosts.append(value)
+                elif kind == SERIES:
+                    mentions.series.append(value)
+                else:
+                    mentions.title_words.append(value)
+        return mentions
+
+
+# data_dir -> NameMatcher of the metadata list load_metadata() returned for it
+_matchers: Dict[str, NameMatcher] = {}
+_matchers_lock = threading.Lock()
+_empty_matcher: Optional[NameMatcher] = None
+
+
+def get_name_matcher(data_dir: Optional[str] = None) -> NameMatcher:
+    """
+    The matcher for a data directory's metadata, rebuilt only when load_metadata() returns a new list. Without a
+    data_dir, or if the metadata can't be loaded, a matcher for just the name and series variations.
+    """
+    global _empty_matcher
+    metadata = None
+    if data_dir is not None:
+        try:
+            metadata = load_metadata(data_dir)
+        except Exception as e:
+            logger.error(f"Error loading metadata for the name matcher: {e}")
+    if metadata is None:
+        if _empty_matcher is None:
+            _empty_matcher = NameMatcher([])
+        return _empty_matcher
+
+    matcher = _matchers.get(data_dir)
+    if matcher is not None and matcher.metadata is metadata:
+        return matcher
+    with _matchers_lock:
+        matcher = _matchers.get(data_dir)
+        if matcher is None or matcher.metadata is not metadata:
+            matcher = NameMatcher(metadata)
+            if not is_retired_data_dir(data_dir):
+                _matchers[data_dir] = matcher
+            logger.debug(f"Name matcher built: {len(matcher._goto)} states")
+    return matcher
+
+
+register_cache_evictor(lambda data_dir: _matchers.pop(data_dir, None))
@@ -0,0 +1,590 @@
+"""
+Shared layer for every outbound call (OpenAI, Pinecone, Neynar).
+
+Each dependency gets a policy with a timeout, a retry budget for idempotent calls (with jittered
+exponential backoff), optional request hedging for tail latency, and a circuit breaker that fails
+fast while an upstream is down so callers can switch to a degraded mode instead of hanging a worker.
+
+The *_async variants apply the same policies, breakers and counters to the asyncio clients used by asgi.py.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional
+import requests
+from core.rate_limiter import (
+    openai_rate_limiter,
+    estimate_chat_tokens,
+    estimate_embedding_tokens,
+    PRIORITY_IN_PIPELINE,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream when its circuit breaker is open."""
+    def __init__(self, dependency: str):
+        super().__init__(f"Circuit breaker open for {dependency}")
+        self.dependency = dependency
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a hedged call produced no result before the dependency's deadline."""
+
+
+class DependencyPolicy:
+    def __init__(self, name: str, timeout: float, retries: int, timeout_kwarg: str, hedge_after: Optional[float] = None):
+        """
+        Args:
+            name: Dependency name, used for env overrides, breaker and metrics
+            timeout: Per-attempt timeout in seconds
+            retries: Extra attempts allowed for idempotent calls
+            timeout_kwarg: Name of the keyword argument the client uses for its request timeout
+            hedge_after: If set, a duplicate request is fired when the first hasn't answered after this many seconds
+        """
+        prefix = f"OUTBOUND_{name.upper()}"
+        self.name = name
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT_SECONDS", timeout))
+        self.retries = int(os.getenv(f"{prefix}_RETRIES", retries))
+        self.timeout_kwarg = timeout_kwarg
+        hedge_env = os.getenv(f"{prefix}_HEDGE_AFTER_SECONDS")
+        self.hedge_after = float(hedge_env) if hedge_env else hedge_after
+
+
+class CircuitBreaker:
+    """
+    Classic three state breaker. After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast for `reset_timeout` seconds, then a single trial call is let through (half open).
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN and time.time() - self.opened_at < self.reset_timeout
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Ends a half-open trial call that failed for a reason unrelated to the upstream, without changing state."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+            }
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets (seconds), in the style of Prometheus."""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            buckets, cumulative = {}, 0
+            for bound, bucket_count in zip(self.BUCKETS, self.counts):
+                cumulative += bucket_count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self.count
+            return {"buckets": buckets, "sum": round(self.total, 6), "count": self.count}
+
+
+POLICIES: Dict[str, DependencyPolicy] = {
+    "openai_chat": DependencyPolicy("openai_chat", timeout=30, retries=1, timeout_kwarg="timeout"),
+    "openai_embedding": DependencyPolicy("openai_embedding", timeout=10, retries=2, timeout_kwarg="timeout"),
+    "pinecone": DependencyPolicy("pinecone", timeout=5, retries=2, timeout_kwarg="_request_timeout"),
+    "neynar_get": DependencyPolicy("neynar_get", timeout=5, retries=2, timeout_kwarg="timeout"),
+    "neynar_post": DependencyPolicy("neynar_post", timeout=10, retries=0, timeout_kwarg="timeout"),
+}
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("OUTBOUND_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OUTBOUND_BREAKER_RESET_SECONDS", "30"))
+RETRY_BACKOFF_BASE_SECONDS = 0.25
+RETRY_BACKOFF_MAX_SECONDS = 2.0
+
+_breakers = {name: CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS) for name in POLICIES}
+_histograms = {name: LatencyHistogram() for name in POLICIES}
+_counters_lock = threading.Lock()
+_counters = {name: {"calls": 0, "failures": 0, "retries": 0, "hedges": 0, "short_circuited": 0} for name in POLICIES}
+
+# Only used for hedged calls; everything else runs on the caller's thread
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="outbound-hedge")
+
+
+def _count(dependency: str, counter: str) -> None:
+    with _counters_lock:
+        _counters[dependency][counter] += 1
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """Extracts an HTTP status from OpenAI, requests or Pinecone exceptions, if there is one."""
+    for attr in ("status_code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+# Transport errors of the clients we don't import here (openai, httpx, urllib3 under pinecone), matched by class name
+# anywhere in the exception's MRO so those libraries are not loaded just to classify an error
+_TRANSPORT_ERROR_NAMES = {
+    "APITimeoutError", "APIConnectionError", "TimeoutException", "TransportError", "NetworkError",
+    "MaxRetryError", "NewConnectionError", "ProtocolError", "ReadTimeoutError", "ConnectTimeoutError",
+}
+
+
+def _is_transport_error(exc: Exception) -> bool:
+    """Timeouts and connection errors: the upstream didn't answer."""
+    if isinstance(exc, (TimeoutError, ConnectionError, requests.Timeout, requests.ConnectionError)):
+        return True
+    return any(cls.__name__ in _TRANSPORT_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """
+    Timeouts, connection errors, 429s and 5xxs are retryable and count against the breaker. Anything else is
+    either a bad request (other 4xxs) or an error in our own code (TypeError, KeyError, ...), which retrying
+    won't fix and which says nothing about the upstream's health.
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return _is_transport_error(exc)
+
+
+def _record_call_error(dependency: str, breaker: "CircuitBreaker", exc: Exception) -> bool:
+    """Updates the breaker and counters for a failed call. Returns True if the call may be retried."""
+    if _is_retryable(exc):
+        _count(dependency, "failures")
+        breaker.record_failure()
+        return True
+    if _status_code(exc) is not None:
+        # The upstream answered, the request was just bad; that says nothing about its health
+        breaker.record_success()
+    else:
+        # Our own error: leave the breaker alone, apart from freeing a half-open trial slot
+        breaker.release_trial()
+    return False
+
+
+def _backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _run_hedged(policy: DependencyPolicy, fn: Callable, kwargs: Dict):
+    """Runs fn, firing a duplicate request if the first is slow, and returns whichever succeeds first."""
+    deadline = time.time() + policy.timeout * 2
+    futures = [_hedge_executor.submit(fn, **kwargs)]
+
+    done, _ = wait(futures, timeout=policy.hedge_after)
+    if not done:
+        logger.debug(f"HEDGING {policy.name} REQUEST AFTER {policy.hedge_after}s")
+        _count(policy.name, "hedges")
+        futures.append(_hedge_executor.submit(fn, **kwargs))
+
+    pending = list(futures)
+    last_exc = None
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                return future.result()
+            last_exc = future.exception()
+
+    if last_exc is not None:
+        raise last_exc
+    raise DeadlineExceededError(f"{policy.name} did not respond within {policy.timeout * 2:.1f}s")
+
+
+def call(dependency: str, fn: Callable, idempotent: bool = True, **kwargs):
+    """
+    Calls fn(**kwargs) under the dependency's policy: the per-attempt timeout is injected into kwargs,
+    idempotent calls are retried with jittered backoff, slow idempotent calls may be hedged, and the
+    circuit breaker short-circuits calls while the dependency is failing.
+
+    Raises:
+        CircuitOpenError: if the dependency's breaker is open
+        Exception: the last error raised by fn once retries are exhausted
+    """
+    policy = POLICIES[dependency]
+    breaker = _breakers[dependency]
+    kwargs.setdefault(policy.timeout_kwarg, policy.timeout)
+    attempts = 1 + (policy.retries if idempotent else 0)
+
+    for attempt in range(attempts):
+        if not breaker.allow_request():
+            _count(dependency, "short_circuited")
+            logger.warning(f"CIRCUIT OPEN FOR {dependency}. FAILING FAST...")
+            raise CircuitOpenError(dependency)
+
+        _count(dependency, "calls")
+        start_time = time.time()
+        try:
+            if idempotent and policy.hedge_after:
+                result = _run_hedged(policy, fn, kwargs)
+            else:
+                result = fn(**kwargs)
+            _histograms[dependency].observe(time.time() - start_time)
+            breaker.record_success()
+            return result
+
+        except Exception as e:
+            _histograms[dependency].observe(time.time() - start_time)
+            if not _record_call_error(dependency, breaker, e) or attempt == attempts - 1:
+                raise
+
+            delay = _backoff_seconds(attempt)
+            _count(dependency, "retries")
+            logger.warning(f"{dependency} call failed ({type(e).__name__}: {e}). Retrying in {delay:.2f}s...")
+            time.sleep(delay)
+
+
+async def _run_hedged_async(policy: DependencyPolicy, fn: Callable, kwargs: Dict):
+    """asyncio version of _run_hedged."""
+    deadline = time.time() + policy.timeout * 2
+    tasks = [asyncio.ensure_future(fn(**kwargs))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=policy.hedge_after)
+        if not done:
+            logger.debug(f"HEDGING {policy.name} REQUEST AFTER {policy.hedge_after}s")
+            _count(policy.name, "hedges")
+            tasks.append(asyncio.ensure_future(fn(**kwargs)))
+
+        pending = set(tasks)
+        last_exc = None
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_exc = task.exception()
+
+        if last_exc is not None:
+            raise last_exc
+        raise DeadlineExceededError(f"{policy.name} did not respond within {policy.timeout * 2:.1f}s")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_async(dependency: str, fn: Callable, idempotent: bool = True, **kwargs):
+    """
+    asyncio version of call(): awaits fn(**kwargs) under the same policy, breaker and counters.
+    """
+    policy = POLICIES[dependency]
+    breaker = _breakers[dependency]
+    kwargs.setdefault(policy.timeout_kwarg, policy.timeout)
+    attempts = 1 + (policy.retries if idempotent else 0)
+
+    for attempt in range(attempts):
+        if not breaker.allow_request():
+            _count(dependency, "short_circuited")
+            logger.warning(f"CIRCUIT OPEN FOR {dependency}. FAILING FAST...")
+            raise CircuitOpenError(dependency)
+
+        _count(dependency, "calls")
+        start_time = time.time()
+        try:
+            if idempotent and policy.hedge_after:
+                result = await _run_hedged_async(policy, fn, kwargs)
+            else:
+                result = await fn(**kwargs)
+            _histograms[dependency].observe(time.time() - start_time)
+            breaker.record_success()
+            return result
+
+        except Exception as e:
+            _histograms[dependency].observe(time.time() - start_time)
+            if not _record_call_error(dependency, breaker, e) or attempt == attempts - 1:
+                raise
+
+            delay = _backoff_seconds(attempt)
+            _count(dependency, "retries")
+            logger.warning(f"{dependency} call failed ({type(e).__name__}: {e}). Retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
+
+class _AccountedStream:
+    """
+    A streamed response whose iteration errors count against the dependency like errors of the call itself.
+    Without it a stream that dies mid-answer would look like a success to the breaker and the counters.
+    It also settles the rate limiter estimate once the stream's usage is known (see settle()).
+    """
+
+    def __init__(self, dependency: str, stream, model: str = "", estimated_tokens: int = 0):
+        self._dependency = dependency
+        self._stream = stream
+        self._model = model
+        self._estimated_tokens = estimated_tokens
+        self._settled = False
+
+    def settle(self, usage) -> None:
+        """
+        Settles the rate limiter estimate with the stream's usage. Called on the final usage chunk, and by
+        core/streaming.py with an estimate when the stream ended before it. Only the first call counts.
+        """
+        if self._settled or usage is None:
+            return
+        self._settled = True
+        openai_rate_limiter.settle(self._model, self._estimated_tokens, getattr(usage, "total_tokens", None))
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self.settle(getattr(chunk, "usage", None))
+                yield chunk
+        except Exception as e:
+            _record_call_error(self._dependency, _breakers[self._dependency], e)
+            raise
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _AccountedAsyncStream(_AccountedStream):
+    """_AccountedStream for an async stream."""
+
+    def __iter__(self):
+        raise TypeError("Use 'async for' with an async stream")
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self.settle(getattr(chunk, "usage", None))
+                yield chunk
+        except Exception as e:
+            _record_call_error(self._dependency, _breakers[self._dependency], e)
+            raise
+
+    async def close(self) -> None:
+        await self._stream.close()
+
+
+def is_available(dependency: str) -> bool:
+    """False while the dependency's circuit breaker is open, so callers can pick a degraded mode up front."""
+    return not _breakers[dependency].is_open()
+
+
+def get_outbound_stats() -> Dict:
+    """Breaker state, call counters and latency histogram for every dependency."""
+    with _counters_lock:
+        counters = {name: dict(values) for name, values in _counters.items()}
+    return {
+        name: {
+            "breaker": _breakers[name].snapshot(),
+            "counters": counters[name],
+            "latency_seconds": _histograms[name].snapshot(),
+            "timeout_seconds": POLICIES[name].timeout,
+        }
+        for name in POLICIES
+    }
+
+
+"""
+Convenience wrappers for each dependency
+"""
+
+def openai_chat(openai_client, priority: int = PRIORITY_IN_PIPELINE, **kwargs):
+    """
+    chat.completions.create under the openai_chat policy. Works for streaming calls too.
+    Waits for room in the shared RPM/TPM budget first; pass priority=PRIORITY_NEW for calls that start a new pipeline.
+    """
+    model = kwargs.get("model", "")
+    estimated_tokens = estimate_chat_tokens(kwargs.get("messages"), kwargs.get("max_tokens"))
+    openai_rate_limiter.acquire(model, estimated_tokens, priority)
+
+    response = call("openai_chat", openai_client.chat.completions.create, **kwargs)
+    if kwargs.get("stream"):
+        return _AccountedStream("openai_chat", response, model, estimated_tokens)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        openai_rate_limiter.settle(model, estimated_tokens, getattr(usage, "total_tokens", None))
+    return response
+
+
+def openai_embedding(openai_client, priority: int = PRIORITY_IN_PIPELINE, **kwargs):
+    """embeddings.create under the openai_embedding policy, after waiting for room in the shared RPM/TPM budget."""
+    model = kwargs.get("model", "")
+    estimated_tokens = estimate_embedding_tokens(kwargs.get("input"))
+    openai_rate_limiter.acquire(model, estimated_tokens, priority)
+
+    response = call("openai_embedding", openai_client.embeddings.create, **kwargs)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        openai_rate_limiter.settle(model, estimated_tokens, getattr(usage, "total_tokens", None))
+    return response
+
+
+def pinecone_query(pinecone_index, **kwargs):
+    """Index.query under the pinecone policy."""
+    return call("pinecone", pinecone_index.query, **kwargs)
+
+
+def _neynar_request(method: str, url: str, timeout: float, **kwargs) -> requests.Response:
+    response = requests.request(method, url, timeout=timeout, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def neynar_get(url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> requests.Response:
+    """GET against the Neynar API. Raises requests.HTTPError on non-2xx responses."""
+    return call("neynar_get", _neynar_request, method="GET", url=url, params=params, headers=headers)
+
+
+def neynar_post(url: str, json: Optional[Dict] = None, headers: Optional[Dict] = None) -> requests.Response:
+    """POST against the Neynar API. Never retried, since posting a cast twice would create a duplicate reply."""
+    return call("neynar_post", _neynar_request, idempotent=False, method="POST", url=url, json=json, headers=headers)
+
+
+"""
+asyncio wrappers, used by the ASGI entry point (asgi.py)
+"""
+
+async def openai_chat_async(async_openai_client, priority: int = PRIORITY_IN_PIPELINE, **kwargs):
+    """openai_chat for an AsyncOpenAI client. Waits for rate limiter budget without blocking the event loop."""
+    model = kwargs.get("model", "")
+    estimated_tokens = estimate_chat_tokens(kwargs.get("messages"), kwargs.get("max_tokens"))
+    await openai_rate_limiter.acquire_async(model, estimated_tokens, priority)
+
+    response = await call_async("openai_chat", async_openai_client.chat.completions.create, **kwargs)
+    if kwargs.get("stream"):
+        return _AccountedAsyncStream("openai_chat", response, model, estimated_tokens)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        openai_rate_limiter.settle(model, estimated_tokens, getattr(usage, "total_tokens", None))
+    return response
+
+
+async def openai_embedding_async(async_openai_client, priority: int = PRIORITY_IN_PIPELINE, **kwargs):
+    """openai_embedding for an AsyncOpenAI client."""
+    model = kwargs.get("model", "")
+    estimated_tokens = estimate_embedding_tokens(kwargs.get("input"))
+    await openai_rate_limiter.acquire_async(model, estimated_tokens, priority)
+
+    response = await call_async("openai_embedding", async_openai_client.embeddings.create, **kwargs)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        openai_rate_limiter.settle(model, estimated_tokens, getattr(usage, "total_tokens", None))
+    return response
+
+
+async def _pinecone_query_in_thread(pinecone_index, **kwargs):
+    return await asyncio.to_thread(pinecone_index.query, **kwargs)
+
+
+async def pinecone_query_async(pinecone_index, **kwargs):
+    """
+    pinecone_query without blocking the event loop. The Pinecone client has no asyncio API,
+    so the (short, timeout-bounded) query runs on the default thread pool.
+    """
+    return await call_async("pinecone", _pinecone_query_in_thread, pinecone_index=pinecone_index, **kwargs)
+
+
+async def _neynar_request_async(http_client, method: str, url: str, timeout: float, **kwargs):
+    response = await http_client.request(method, url, timeout=timeout, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+async def neynar_get_async(http_client, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None):
+    """GET against the Neynar API with an httpx.AsyncClient. Raises httpx.HTTPStatusError on non-2xx responses."""
+    return await call_async(
+        "neynar_get", _neynar_request_async, http_client=http_client, method="GET", url=url, params=params, headers=headers
+    )
+
+
+async def neynar_post_async(http_client, url: str, json: Optional[Dict] = None, headers: Optional[Dict] = None):
+    """POST against the Neynar API with an httpx.AsyncClient. Never retried."""
+    return await call_async(
+        "neynar_post", _neynar_request_async, idempotent=False, http_client=http_client, method="POST", url=url, json=json, headers=headers
+    )
@@ -0,0 +1,277 @@
+"""
+Client-side requests-per-minute / tokens-per-minute limiter for OpenAI calls.
+
+Each model has a pair of token buckets (requests and tokens) refilled continuously at its per-minute limit.
+Bucket state lives in a small memory-mapped file guarded by an flock, so every gunicorn worker on the host
+draws from the same budget. Calls that don't fit wait in line instead of failing with a 429; calls that are
+already mid-pipeline may dip into a reserve that new requests (the routing call) are not allowed to use.
+
+The limiter is opt-in: only models listed in OPENAI_RATE_LIMITS are limited, and there are no built-in limits,
+since the right numbers depend on the account's usage tier. Calls to other models are sent straight away.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to a per-process limiter
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Priorities: the routing call starts a new pipeline; everything after it finishes work already paid for
+PRIORITY_NEW = 0
+PRIORITY_IN_PIPELINE = 1
+
+# Per-minute limits of the models to limit, e.g. OPENAI_RATE_LIMITS='{"gpt-4o": {"rpm": 5000, "tpm": 800000}}'
+RATE_LIMITS_ENV = "OPENAI_RATE_LIMITS"
+
+# Fraction of each bucket that only in-pipeline calls may use
+PRIORITY_RESERVE_FRACTION = float(os.getenv("OPENAI_RATE_LIMIT_RESERVE", "0.2"))
+# Give up waiting after this long and let the request through (OpenAI may still accept it)
+MAX_QUEUE_SECONDS = float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+DEFAULT_COMPLETION_TOKENS = 300
+
+# Slot layout in the shared file: model key hash, requests available, tokens available, last refill time
+_SLOT = struct.Struct("<Q3d")
+_MAX_SLOTS = 32
+
+
+def estimate_chat_tokens(messages: List[Dict], max_tokens: Optional[int]) -> int:
+    """
+    Estimates the TPM cost of a chat completion the same way OpenAI does for rate limiting:
+    roughly one token per four characters of prompt, plus the requested max_tokens.
+    """
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in messages or [])
+    return prompt_chars // 4 + 4 * len(messages or []) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def estimate_embedding_tokens(inputs) -> int:
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return sum(len(text) for text in inputs or []) // 4 + 1
+
+
+class SharedRateLimiter:
+    def __init__(self, state_path: str, limits: Dict[str, Dict[str, int]]):
+        self.state_path = state_path
+        self.limits = limits
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._mmap = None
+        self._local_slots: Dict[str, list] = {}
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _limit_for(self, model: str) -> Optional[Dict[str, int]]:
+        """The model's limits, or None if it isn't rate limited."""
+        return self.limits.get(model)
+
+    def _ensure_open(self) -> None:
+        """(Re)opens the shared file per process; flock locks are per open file, so forked workers need their own."""
+        if fcntl is None or self._pid == os.getpid():
+            return
+        self._file = open(self.state_path, "a+b")
+        size = _SLOT.size * _MAX_SLOTS
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._pid = os.getpid()
+
+    def _slot_offset(self, model: str) -> int:
+        """Finds (or claims) the slot for a model in the shared file. Must be called under the file lock."""
+        key = int.from_bytes(hashlib.sha1(model.encode("utf-8")).digest()[:8], "little") or 1
+        for index in range(_MAX_SLOTS):
+            offset = index * _SLOT.size
+            slot_key, _, _, _ = _SLOT.unpack_from(self._mmap, offset)
+            if slot_key == key:
+                return offset
+            if slot_key == 0:
+                limit = self._limit_for(model)
+                _SLOT.pack_into(self._mmap, offset, key, float(limit["rpm"]), float(limit["tpm"]), time.time())
+                return offset
+        raise RuntimeError("Rate limiter state file is full")
+
+    def _try_acquire(self, model: str, tokens: int, priority: int) -> float:
+        """Takes capacity from the buckets if possible. Returns 0 on success, otherwise seconds to wait."""
+        limit = self._limit_for(model)
+        if limit is None:
+            return 0.0
+        rpm, tpm = float(limit["rpm"]), float(limit["tpm"])
+        tokens = min(tokens, tpm)
+        reserve = 0.0 if priority >= PRIORITY_IN_PIPELINE else PRIORITY_RESERVE_FRACTION
+
+        with self._thread_lock:
+            self._ensure_open()
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                if fcntl is not None:
+                    offset = self._slot_offset(model)
+                    key, requests_available, tokens_available, last_refill = _SLOT.unpack_from(self._mmap, offset)
+                else:
+                    key, requests_available, tokens_available, last_refill = self._local_slots.setdefault(
+                        model, [0, rpm, tpm, now])
+
+                # Continuous refill at the per-minute rate
+                elapsed = max(0.0, now - last_refill)
+                requests_available = min(rpm, requests_available + elapsed * rpm / 60)
+                tokens_available = min(tpm, tokens_available + elapsed * tpm / 60)
+
+                requests_needed = 1 + reserve * rpm
+                tokens_needed = tokens + reserve * tpm
+                if requests_available >= requests_needed and tokens_available >= tokens_needed:
+                    requests_available -= 1
+                    tokens_available -= tokens
+                    wait_seconds = 0.0
+                else:
+                    wait_seconds = max(
+                        (requests_needed - requests_available) * 60 / rpm,
+                        (tokens_needed - tokens_available) * 60 / tpm,
+                        0.01
+                    )
+
+                if fcntl is not None:
+                    _SLOT.pack_into(self._mmap, offset, key, requests_available, tokens_available, now)
+                else:
+                    self._local_slots[model] = [key, requests_available, tokens_available, now]
+                return wait_seconds
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self, model: str, tokens: int, priority: int = PRIORITY_IN_PIPELINE) -> None:
+        """Blocks until the model has room for one request of `tokens` tokens (or the max wait is reached)."""
+        start_time = time.time()
+        while True:
+            wait_seconds = self._try_acquire(model, tokens, priority)
+            if wait_seconds == 0:
+                break
+            waited = time.time() - start_time
+            if waited >= MAX_QUEUE_SECONDS:
+                logger.warning(f"RATE LIMITER: GAVE UP WAITING FOR {model} AFTER {waited:.1f}s, SENDING ANYWAY")
+                break
+            time.sleep(min(wait_seconds, 0.5, MAX_QUEUE_SECONDS - waited))
+
+        waited = time.time() - start_time
+        if waited > 0.01:
+            self.waits += 1
+            self.wait_seconds += waited
+            logger.info(f"RATE LIMITER: QUEUED {model} CALL ({tokens} est. tokens, priority {priority}) FOR {waited:.2f}s")
+
+    async def acquire_async(self, model: str, tokens: int, priority: int = PRIORITY_IN_PIPELINE) -> None:
+        """acquire() for asyncio callers: waits with asyncio.sleep so the event loop keeps serving other requests."""
+        start_time = time.time()
+        while True:
+            wait_seconds = self._try_acquire(model, tokens, priority)
+            if wait_seconds == 0:
+                break
+            waited = time.time() - start_time
+            if waited >= MAX_QUEUE_SECONDS:
+                logger.warning(f"RATE LIMITER: GAVE UP WAITING FOR {model} AFTER {waited:.1f}s, SENDING ANYWAY")
+                break
+            await asyncio.sleep(min(wait_seconds, 0.5, MAX_QUEUE_SECONDS - waited))
+
+        waited = time.time() - start_time
+        if waited > 0.01:
+            self.waits += 1
+            self.wait_seconds += waited
+            logger.info(f"RATE LIMITER: QUEUED {model} CALL ({tokens} est. tokens, priority {priority}) FOR {waited:.2f}s")
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Refunds (or charges) the difference between the estimate and the usage OpenAI reported."""
+        if actual_tokens is None:
+            return
+        difference = estimated_tokens - actual_tokens
+        limit = self._limit_for(model)
+        if difference == 0 or limit is None:
+            return
+        tpm = float(limit["tpm"])
+
+        with self._thread_lock:
+            self._ensure_open()
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                if fcntl is not None:
+                    offset = self._slot_offset(model)
+                    key, requests_available, tokens_available, last_refill = _SLOT.unpack_from(self._mmap, offset)
+                    tokens_available = min(tpm, tokens_available + difference)
+                    _SLOT.pack_into(self._mmap, offset, key, requests_available, tokens_available, last_refill)
+                elif model in self._local_slots:
+                    self._local_slots[model][2] = min(tpm, self._local_slots[model][2] + difference)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def snapshot(self) -> Dict:
+        """Current bucket levels for each configured model (without refilling), plus queueing totals."""
+        models = {}
+        for model, limit in self.limits.items():
+            with self._thread_lock:
+                self._ensure_open()
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_SH)
+                try:
+                    if fcntl is not None:
+                        offset = self._slot_offset(model)
+                        _, requests_available, tokens_available, last_refill = _SLOT.unpack_from(self._mmap, offset)
+                    else:
+                        _, requests_available, tokens_available, last_refill = self._local_slots.get(
+                            model, [0, limit["rpm"], limit["tpm"], time.time()])
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            models[model] = {
+                "rpm_limit": limit["rpm"],
+                "tpm_limit": limit["tpm"],
+                "requests_available": round(requests_available, 2),
+                "tokens_available": round(tokens_available, 2),
+                "last_update": last_refill,
+            }
+        return {"models": models, "waits": self.waits, "wait_seconds": round(self.wait_seconds, 3)}
+
+
+def _load_limits() -> Dict[str, Dict[str, int]]:
+    """Limits from OPENAI_RATE_LIMITS; models need both rpm and tpm. Empty (nothing limited) if unset or invalid."""
+    configured = os.getenv(RATE_LIMITS_ENV)
+    if not configured:
+        return {}
+    limits = {}
+    try:
+        for model, limit in json.loads(configured).items():
+            if float(limit["rpm"]) > 0 and float(limit["tpm"]) > 0:
+                limits[model] = {"rpm": limit["rpm"], "tpm": limit["tpm"]}
+            else:
+                logger.error(f"Ignoring non-positive {RATE_LIMITS_ENV} limits for {model}")
+    except (ValueError, AttributeError, KeyError, TypeError) as e:
+        logger.error(f"Invalid {RATE_LIMITS_ENV} value, OpenAI calls are not rate limited: {e}")
+        return {}
+    if limits:
+        logger.info(f"OPENAI RATE LIMITS ENABLED FOR: {', '.join(limits)}")
+    return limits
+
+
+openai_rate_limiter = SharedRateLimiter(
+    state_path=os.getenv("OPENAI_RATE_LIMIT_STATE_PATH", os.path.join(tempfile.gettempdir(), "gmfc101_openai_ratelimit.bin")),
+    limits=_load_limits()
+)
@@ -0,0 +1,85 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from core.metrics import observe_seconds
+
+
+class RequestTrace:
+    """
+    Collects what happened while handling one webhook event: the route taken, the final answer,
+    the token usage of every LLM call and how long each pipeline stage took.
+    """
+
+    def __init__(self, cast_hash: Optional[str] = None):
+        self.cast_hash = cast_hash
+        self.route: Optional[str] = None
+        self.answer: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.usage: List[Dict] = []
+        self.start_time = time.time()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times a pipeline stage. Repeated stages (e.g. several expansions) accumulate."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.time() - start_time)
+
+    def record_usage(self, route: str, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int) -> None:
+        self.usage.append({
+            "route": route,
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens,
+            "completion_tokens": completion_tokens,
+        })
+
+    def to_dict(self) -> Dict:
+        return {
+            "cast_hash": self.cast_hash,
+            "route": self.route,
+            "answer": self.answer,
+            "usage": self.usage,
+            "total_tokens": {
+                "prompt_tokens": sum(u["prompt_tokens"] for u in self.usage),
+                "cached_prompt_tokens": sum(u["cached_prompt_tokens"] for u in self.usage),
+                "completion_tokens": sum(u["completion_tokens"] for u in self.usage),
+            },
+            "stage_seconds": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "total_seconds": round(time.time() - self.start_time, 4),
+        }
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_trace(cast_hash: Optional[str] = None) -> RequestTrace:
+    """Starts a trace for the current request (thread/task) and returns it."""
+    trace = RequestTrace(cast_hash)
+    _current_trace.set(trace)
+    return trace
+
+
+def get_current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def end_trace() -> None:
+    _current_trace.set(None)
+
+
+@contextmanager
+def trace_stage(name: str):
+    """Times a stage on the current trace (if any) and in the stage latency histogram."""
+    start_time = time.time()
+    trace = get_current_trace()
+    try:
+        if trace is None:
+            yield
+        else:
+            with trace.stage(name):
+                yield
+    finally:
+        observe_seconds("stage_duration_seconds", time.time() - start_time, stage=name)
@@ -1,24 +1,28 @@
 from flask import jsonify
-from pinecone import Pinecone
-from openai import OpenAI
 import time
-from cachetools import TTLCache
 import requests
-from collections import defaultdict
-from typing import Optional
 import logging
 from core.workflow_router import WorkflowRouter
 from core.workflow_metadatapath import MetadataPath
 from core.workflow_contextpath import ContextualPath
 from core.workflow_hybridpath import HybridPath
-from core.utils import get_required_env_var
+from core.utils import truncate_to_byte_limit
+from core.response_cache import ResponseCache
+from core.outbound import neynar_get, neynar_post, is_available
+from core.request_trace import start_trace, end_trace, get_current_trace, trace_stage
+from core.metrics import inc_counter, observe_seconds
+from core.dedupe_store import dedupe_store
+from core.thread_cache import thread_cache
+from core.data_store import pin_data_dir, unpin_data_dir
+from core.admission import admission_controller, ADMISSION_ENABLED, ADMISSION_RETRY_AFTER_SECONDS, DEFER
+import os
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)  # Set default level to INFO
 logger = logging.getLogger(__name__)
 
 # Set logging level based on environment variable
-VERBOSE_LOGGING = get_required_env_var("VERBOSE_LOGGING").lower() == 'true'
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
 if VERBOSE_LOGGING:
     logger.setLevel(logging.DEBUG)
 
@@ -28,11 +32,18 @@ current_level = logger.getEffectiveLevel()
 level_name = logging.getLevelName(current_level)
 logger.info(f"Current logging level: {level_name}")
 
-BOT_ACCOUNT_FID = get_required_env_var("BOT_ACCOUNT_FID")
+# Required by the web entry points (api.py, asgi.py), which check it at startup
+BOT_ACCOUNT_FID = os.getenv("BOT_ACCOUNT_FID", "")
 
 
-# Initialize cache for processed casts
-processed_casts = TTLCache(maxsize=1000, ttl=300)
+# Processed cast hashes are tracked in core/dedupe_store.py, shared by all workers on the host
+
+# Initialize exact-match cache for final answers to first-touch questions (bypassed for threaded conversations)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_MAXSIZE", "500")),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+)
 
 def format_timestamp(seconds: float) -> str:
     """Convert seconds to readable timestamp format (MM:SS or HH:MM:SS)"""
@@ -57,12 +68,11 @@ def get_conversation_summary(cast_hash, neynar_headers, dry_run):
     """
     try:
         NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
-        response = requests.get(
+        response = neynar_get(
             f"{NEYNAR_CAST_URL}/conversation/summary",
             params={"identifier": cast_hash, "type": "hash"},
             headers=neynar_headers
         )
-        response.raise_for_status()
         
         summary = response.json().get("summary", {}).get("text", "No summary available")       
         return summary
@@ -74,78 +84,81 @@ def get_conversation_summary(cast_hash, neynar_headers, dry_run):
 
 def get_conversation_history_recursive(cast_hash, author_fid, neynar_headers, dry_run=False) -> tuple[list, int]:
     """
-    Uses recursive approach to build complete chat between bot and user.
+    Builds the complete chat between bot and user by walking up the thread from the current cast.
     Returns the conversation as a formatted message array for the LLM, excluding the current query.
     Messages from the bot are marked as "assistant" and messages from the user are marked as "user".
     Only includes the direct conversation between the original author and the bot.
     Returns a tuple of (messages, depth)
     """
-    messages = []
-    last_author_fid = None
-    conversation_started = False
-    depth = 0
-    
     NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
     
     def fetch_cast(hash: str) -> dict:
-        response = requests.get(
-            f"{NEYNAR_CAST_URL}",
-            params={"identifier": hash, "type": "hash"},
-            headers=neynar_headers
-        )
-        response.raise_for_status()
-        return response.json()["cast"]
-    
-    def build_thread(current_hash: str):
-        nonlocal last_author_fid, conversation_started, depth
-        cast_data = fetch_cast(current_hash)
-        
-        current_author_fid = str(cast_data["author"]["fid"])
-        author_fid_str = str(author_fid)
-        bot_fid_str = str(BOT_ACCOUNT_FID)
-        
-        logger.debug(f"\nProcessing cast to buid conversation history: {current_hash} | Author FID: {author_fid} ")
-        
-        # Check if this message is from a valid participant
-        is_valid_participant = current_author_fid in [author_fid_str, bot_fid_str]
-        
-        # If we've started the conversation and hit an invalid participant, stop traversing
-        if conversation_started and not is_valid_participant:
-            logger.debug("❌ Breaking conversation chain - found message from another user")
-            return
-            
-        # If this is a valid participant, mark conversation as started
-        if is_valid_participant:
-            conversation_started = True
-            
-            # Only process parent if we're still in the valid conversation
-            if cast_data.get("parent_hash"):
-                # Increment depth when speaker changes
-                if last_author_fid is None or last_author_fid != current_author_fid:
-                    depth += 1
-                build_thread(cast_data["parent_hash"])
-            
-            # Check if it's a different speaker from last message
-            is_different_speaker = last_author_fid is None or last_author_fid != current_author_fid
-            
-            if is_different_speaker:
-                logger.debug(f"✅ Adding message to history: {cast_data['text'][:50]}...")
-                messages.append({
-                    "role": "user" if current_author_fid == author_fid_str else "assistant",
-                    "content": cast_data["text"]
-                })
-                last_author_fid = current_author_fid
+        cast_data = thread_cache.get_cast(hash)
+        if cast_data is None:
+            response = neynar_get(
+                f"{NEYNAR_CAST_URL}",
+                params={"identifier": hash, "type": "hash"},
+                headers=neynar_headers
+            )
+            cast_data = thread_cache.put_cast(hash, response.json()["cast"])
+        return cast_data
     
     try:
-        build_thread(cast_hash)
-        # Return tuple of (messages without current query, depth)
-        return messages[:-1] if messages else [], depth
+        chain = []
+        current_hash = cast_hash
+        while current_hash:
+            # Ancestors already walked on an earlier turn of this conversation (core/thread_cache.py)
+            cached_chain = thread_cache.get_chain(current_hash, author_fid)
+            if cached_chain is not None:
+                chain.extend(cached_chain)
+                break
+            cast_data = fetch_cast(current_hash)
+            logger.debug(f"\nProcessing cast to buid conversation history: {current_hash} | Author FID: {author_fid} ")
+            if not _is_conversation_participant(cast_data, author_fid):
+                logger.debug("❌ Breaking conversation chain - found message from another user")
+                break
+            chain.append(cast_data)
+            current_hash = cast_data.get("parent_hash")
+
+        thread_cache.put_chain(cast_hash, author_fid, chain)
+        return _history_from_chain(chain, author_fid)
         
     except Exception as e:
         logger.error(f"Error constructing conversation history: {e}")
         return [], 1 if dry_run else 999
 
 
+def _is_conversation_participant(cast_data: dict, author_fid) -> bool:
+    """True if the cast is from the user who tagged the bot or from the bot itself."""
+    return str(cast_data["author"]["fid"]) in [str(author_fid), str(BOT_ACCOUNT_FID)]
+
+
+def _history_from_chain(chain: list, author_fid) -> tuple[list, int]:
+    """
+    Turns the casts of a conversation (newest first, as walked up the thread) into LLM messages and a depth.
+    Depth counts every cast in the conversation that replies to another cast.
+    Consecutive casts by the same speaker keep only the earliest one, and the current query (the last message) is dropped.
+    """
+    author_fid_str = str(author_fid)
+    depth = sum(1 for cast_data in chain if cast_data.get("parent_hash"))
+
+    messages = []
+    last_author_fid = None
+    for cast_data in reversed(chain):
+        current_author_fid = str(cast_data["author"]["fid"])
+        # Check if it's a different speaker from last message
+        if last_author_fid is None or last_author_fid != current_author_fid:
+            logger.debug(f"✅ Adding message to history: {cast_data['text'][:50]}...")
+            messages.append({
+                "role": "user" if current_author_fid == author_fid_str else "assistant",
+                "content": cast_data["text"]
+            })
+            last_author_fid = current_author_fid
+
+    # Return tuple of (messages without current query, depth)
+    return messages[:-1] if messages else [], depth
+
+
         
         
         
@@ -197,33 +210,6 @@ def get_conversation_depth_DEPRECATED(cast_hash, neynar_headers, dry_run=False):
         logger.error(f"Error getting conversation depth: {e}")
         return 1 if dry_run else 999
 
-def truncate_to_byte_limit(text: str, limit: int = 1000) -> str:
-    """
-    Smartly truncate text to stay under byte limit while preserving complete sentences.
-    """
-    if len(text.encode('utf-8')) <= limit:
-        return text
-        
-    # Leave room for truncation notice
-    working_limit = limit - len(" [...response too long, truncating. cc: @adrienne]".encode('utf-8'))
-    
-    # Convert to bytes to handle UTF-8 characters correctly
-    encoded = text.encode('utf-8')
-    truncated = encoded[:working_limit].decode('utf-8', 'ignore')
-    
-    # Find the last complete sentence
-    last_sentence = max(
-        truncated.rfind('.'),
-        truncated.rfind('!'),
-        truncated.rfind('?')
-    )
-    
-    if last_sentence > 0:
-        truncated = truncated[:last_sentence + 1]
-    
-    logger.info(f"TRUNCATED RESPONSE: {truncated} [...response too long, truncating. cc: @adrienne]")
-    return truncated + " [...response too long, truncating. cc: @adrienne]"
-
 def post_reply_to_neynar(payload, neynar_headers, dry_run=False):
     """
     Accepts a payload containing the LLM response.
@@ -232,31 +218,22 @@ def post_reply_to_neynar(payload, neynar_headers, dry_run=False):
     Finally, uses Neynar to send the cast.
     """
     NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
-    TIMEOUT_SECONDS = 10
         
     try:
-        # Ensure text fits within Neynar's byte limit
-        logger.info(f"RAW LLM RESPONSE: {payload['text']}")
+        _fit_reply_to_byte_limit(payload)
 
-        payload['text'] = truncate_to_byte_limit(payload['text'])
-       
 
         if dry_run:
             logger.warning("DRY_RUN_SIMULATION: Reply will not be posted to Neynar")
             return
         
-        response = requests.post(
+        # Timeout and no-retry policy for the reply POST live in core/outbound.py
+        neynar_post(
             NEYNAR_CAST_URL, 
             json=payload, 
-            headers=neynar_headers,
-            timeout=TIMEOUT_SECONDS
+            headers=neynar_headers
         )
         
-        if response.status_code != 200:
-            logger.error(f"Neynar API error response: {response.text}")
-            logger.error(f"Status code: {response.status_code}")
-        
-        response.raise_for_status()
         logger.info(f"REPLY SUCCESSFULLY POSTED TO NEYNAR...")
     except requests.Timeout:
         logger.error("Timeout while posting reply to Neynar")
@@ -264,30 +241,86 @@ def post_reply_to_neynar(payload, neynar_headers, dry_run=False):
     except requests.RequestException as e:
         logger.error(f"Error posting reply to Neynar: {str(e)}")
         if hasattr(e, 'response') and e.response is not None:
+            logger.error(f"Status code: {e.response.status_code}")
             logger.error(f"Error response from Neynar: {e.response.text}")
         raise
 
 
+def _fit_reply_to_byte_limit(payload: dict) -> None:
+    """Truncates payload['text'] in place so it fits within Neynar's byte limit."""
+    logger.info(f"RAW LLM RESPONSE: {payload['text']}")
+
+    truncated_text = truncate_to_byte_limit(payload['text'])
+    if truncated_text != payload['text']:
+        inc_counter("truncations_total", where="post")
+    payload['text'] = truncated_text
+
+
+def offline_reply(author: str) -> str:
+    """The reply sent when the LLM is switched off or unavailable."""
+    return (
+        f"Hey @{author}! 👋 I'm a bot that will help with Farcaster questions but "
+        f"I'm still being developed and take frequent rests! I'm offline now but you can check back later."
+    )
+
+
 def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neynar_signer_uuid, use_llm=True, dry_run=False):
     """
     V2 of the webhook handler - now with workflow routing
     This is the MAIN function which is called from api.py which is called every time GMFC101 is tagged in Farcaster.
+    Every call is traced (route, answer, token usage and stage timings); callers such as the replay script can
+    start their own trace with core.request_trace.start_trace() beforehand to read it afterwards.
+    Under load, the admission controller sheds or defers low-value casts before any upstream call is made
+    (dry runs are always admitted).
     """
+    owns_trace = get_current_trace() is None
+    trace = start_trace() if owns_trace else get_current_trace()
+    start_time = time.time()
+    admitted = False
+    # Every file read while handling this cast comes from the data version published when it arrived
+    data_pin = pin_data_dir()
+    try:
+        if ADMISSION_ENABLED and not dry_run and data and data.get('type') == "cast.created":
+            with trace_stage("admission"):
+                decision = admission_controller.admit(data.get('data', {}))
+            if not decision.admitted:
+                trace.route = f"admission_{decision.action}"
+                if decision.action == DEFER:
+                    # Neynar redelivers on a non-2xx response; nothing has been claimed in the dedupe store yet
+                    return jsonify({"status": "deferred", "reasons": decision.reasons}), 503, {"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+                return jsonify({"status": "shed", "reasons": decision.reasons}), 200
+            admitted = True
+
+        return _handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neynar_signer_uuid, use_llm, dry_run)
+    finally:
+        if admitted:
+            admission_controller.release()
+        route = trace.route or "none"
+        inc_counter("requests_total", route=route)
+        observe_seconds("route_duration_seconds", time.time() - start_time, route=route)
+        unpin_data_dir(data_pin)
+        if owns_trace:
+            end_trace()
+
+
+def _handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neynar_signer_uuid, use_llm, dry_run):
+    trace = get_current_trace()
     try:
         logger.debug("ENTERED WEBHOOK HANDLER...")  
 
         """
         STEP 1: Validate incoming data and exit if any validation fails
         """
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
+        with trace_stage("validation"):
+            if not data:
+                return jsonify({"error": "No data provided"}), 400
+                
+            if 'type' not in data:
+                return jsonify({"error": "Missing event type"}), 400
             
-        if 'type' not in data:
-            return jsonify({"error": "Missing event type"}), 400
-        
-        event_type = data.get('type')
-        if event_type != "cast.created":            
-            return jsonify({"status": "Event type was not cast.created; ignoring request"}), 200
+            event_type = data.get('type')
+            if event_type != "cast.created":            
+                return jsonify({"status": "Event type was not cast.created; ignoring request"}), 200
 
         """
         STEP 2: Webhook Dedupe logic
@@ -296,14 +329,15 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
         
         cast_data = data.get('data', {})
         cast_hash = cast_data.get('hash')
+        trace.cast_hash = cast_hash
 
-        if cast_hash in processed_casts and not dry_run:
-            logger.warning(f"DUPLICATE EVENT DETECTED FOR CAST: {cast_hash}. IGNORING...")
-            return jsonify({"status": "ignored duplicate"}), 200
+        # Dry runs (test_webhook, replays) neither check nor claim, so they never block the real reply
+        with trace_stage("dedupe"):
+            if not dry_run and not dedupe_store.check_and_set(cast_hash):
+                logger.warning(f"DUPLICATE EVENT DETECTED FOR CAST: {cast_hash}. IGNORING...")
+                return jsonify({"status": "ignored duplicate"}), 200
 
-        # Mark this cast hash as processed  
-        processed_casts[cast_hash] = time.time()
-        logger.debug(f"CAST HASH DEEMED UNIQUE. CONTINUING...")      
+            logger.debug(f"CAST HASH DEEMED UNIQUE. CONTINUING...")      
         
         """
         STEP 3: Extract the cast text and author from the cast.
@@ -319,6 +353,12 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
             return jsonify({"status": "Bot tagged itself; ignoring and not replying..."}), 200
 
         try:
+            # Degraded mode: while the OpenAI circuit breaker is open, reply with the offline message
+            # instead of spending time on history and routing calls that are going to fail
+            if use_llm and not is_available("openai_chat"):
+                logger.warning("OPENAI CIRCUIT BREAKER OPEN. REPLYING WITH OFFLINE MESSAGE...")
+                use_llm = False
+
             if use_llm:
                 """
                 STEP 4: Get thread context and history to be passed into the LLM
@@ -326,18 +366,30 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                 Conversation history is the full conversation thread between the bot and the user.
                 Conversation depth is the depth of the conversation thread (number of replies, used to prevent infinite chats between 2 bots and/or control spam and cost).
                 """                
-                conversation_summary = get_conversation_summary(cast_hash, neynar_headers, dry_run)                
-                conversation_history, depth = get_conversation_history_recursive(cast_hash, author_fid, neynar_headers, dry_run)
+                with trace_stage("summary"):
+                    conversation_summary = get_conversation_summary(cast_hash, neynar_headers, dry_run)                
+                with trace_stage("history"):
+                    conversation_history, depth = get_conversation_history_recursive(cast_hash, author_fid, neynar_headers, dry_run)
                 
                 logger.debug(f"CONVERSATION HISTORY: {conversation_history}")
                 logger.debug(f"CONVERSATION SUMMARY: {conversation_summary}")        
                 logger.debug(f"CONVERSATION DEPTH: {depth}")
+                admission_controller.record_thread_depth(cast_data.get('thread_hash'), depth)
 
                 # Check if the conversation depth exceeds the limit
                 if depth > 8:
                     logger.warning(f"CONVERSATION DEPTH {depth} EXCEEDS LIMIT. NOT RESPONDING...")
+                    inc_counter("depth_refusals_total")
                     return jsonify({"status": "conversation depth limit reached"}), 200
 
+                # Only first-touch questions can share answers; in a thread the history changes the answer
+                query_response_cache = None
+                if RESPONSE_CACHE_ENABLED:
+                    if conversation_history:
+                        response_cache.record_bypass()
+                    else:
+                        query_response_cache = response_cache
+
                 """
                 STEP 5: Workflow Routing
                 Use an LLM to determine the best workflow to use for the query. Options are:
@@ -345,8 +397,10 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                 - Contextual: Use the LLM and RAG context
                 - Hybrid: Use a hybrid of the two
                 """                       
-                router = WorkflowRouter(openai_client)
-                route_result = router.route_query(cast_text)
+                with trace_stage("routing"):
+                    router = WorkflowRouter(openai_client)
+                    route_result = router.route_query(cast_text)
+                trace.route = route_result
                 logger.info(f"ROUTE DETERMINED: {route_result}")  
                 
                 
@@ -359,7 +413,8 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                         user_name=author,
                         conversation_history=conversation_history,
                         conversation_summary=conversation_summary,
-                        depth=depth
+                        depth=depth,
+                        response_cache=query_response_cache
                     )
                 elif route_result == "contextual":
                     # Handle contextual queries using ContextualPath
@@ -371,7 +426,8 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                         conversation_history=conversation_history,
                         conversation_summary=conversation_summary,
                         pinecone_index=pinecone_index,
-                        depth=depth
+                        depth=depth,
+                        response_cache=query_response_cache
                     )
                 elif route_result == "hybrid":
                     # Handle hybrid queries                    
@@ -381,7 +437,8 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                         user_name=author,
                         conversation_history=conversation_history,
                         conversation_summary=conversation_summary,                        
-                        depth=depth
+                        depth=depth,
+                        response_cache=query_response_cache
                     )
                 elif route_result == "ignore":
                     logger.warning(f"IGNORE QUERY DETECTED. NOT RESPONDING...")
@@ -395,13 +452,11 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
                         conversation_history=conversation_history,
                         conversation_summary=conversation_summary,
                         pinecone_index=pinecone_index,
-                        depth=depth
+                        depth=depth,
+                        response_cache=query_response_cache
                     )
             else:
-                llm_response = (
-                    f"Hey @{author}! 👋 I'm a bot that will help with Farcaster questions but "
-                    f"I'm still being developed and take frequent rests! I'm offline now but you can check back later."
-                )
+                llm_response = offline_reply(author)
             
             payload = {
                 "text": llm_response,
@@ -410,11 +465,14 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
             }
 
             
-            post_reply_to_neynar(payload, neynar_headers, dry_run)     
+            with trace_stage("post"):
+                post_reply_to_neynar(payload, neynar_headers, dry_run)     
+            trace.answer = payload["text"]
             
 
         except Exception as e:
             logger.error(f"Error posting reply: {e}")
+            inc_counter("errors_total", where="reply")
             return jsonify({"error": "Unknown error"}), 500
 
         logger.info("WEBHOOK PROCESSING COMPLETE... SENDING RESPONSE CODE 200 to NEYNAR")
@@ -422,6 +480,7 @@ def handle_webhook_v2(data, openai_client, pinecone_index, neynar_headers, neyna
 
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
+        inc_counter("errors_total", where="webhook")
         return jsonify({"error": "Internal server error"}), 500
 
 
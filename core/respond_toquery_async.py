@@ -0,0 +1,319 @@
+"""
+asyncio version of the webhook pipeline in core/respond_toquery.py, served by asgi.py.
+
+The steps, tracing, admission control, dedupe and metrics are the same as handle_webhook_v2; every upstream call
+is awaited on an AsyncOpenAI client and an httpx.AsyncClient instead, so one process can hold hundreds of mentions
+in flight while they wait on the network. Responses are returned as (body, status, headers) rather than Flask
+responses.
+"""
+import asyncio
+import logging
+import os
+import time
+import httpx
+from core.workflow_router import WorkflowRouter
+from core.workflow_metadatapath import MetadataPath
+from core.workflow_contextpath import ContextualPath
+from core.workflow_hybridpath import HybridPath
+from core.outbound import neynar_get_async, neynar_post_async, is_available
+from core.request_trace import start_trace, end_trace, get_current_trace, trace_stage
+from core.metrics import inc_counter, observe_seconds
+from core.dedupe_store import dedupe_store
+from core.thread_cache import thread_cache
+from core.data_store import pin_data_dir, unpin_data_dir
+from core.admission import admission_controller, ADMISSION_ENABLED, ADMISSION_RETRY_AFTER_SECONDS, DEFER
+from core.respond_toquery import (
+    BOT_ACCOUNT_FID,
+    RESPONSE_CACHE_ENABLED,
+    response_cache,
+    offline_reply,
+    _fit_reply_to_byte_limit,
+    _history_from_chain,
+    _is_conversation_participant,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
+
+
+async def get_conversation_summary_async(http_client, cast_hash, neynar_headers, dry_run):
+    """get_conversation_summary with an httpx.AsyncClient."""
+    try:
+        response = await neynar_get_async(
+            http_client,
+            f"{NEYNAR_CAST_URL}/conversation/summary",
+            params={"identifier": cast_hash, "type": "hash"},
+            headers=neynar_headers
+        )
+
+        return response.json().get("summary", {}).get("text", "No summary available")
+
+    except Exception as e:
+        logger.error(f"Error getting conversation summary: {e}")
+        return "No summary available right now."
+
+
+async def get_conversation_history_recursive_async(http_client, cast_hash, author_fid, neynar_headers, dry_run=False) -> tuple[list, int]:
+    """get_conversation_history_recursive with an httpx.AsyncClient. Returns a tuple of (messages, depth)."""
+
+    async def fetch_cast(hash: str) -> dict:
+        cast_data = thread_cache.get_cast(hash)
+        if cast_data is None:
+            response = await neynar_get_async(
+                http_client,
+                NEYNAR_CAST_URL,
+                params={"identifier": hash, "type": "hash"},
+                headers=neynar_headers
+            )
+            cast_data = thread_cache.put_cast(hash, response.json()["cast"])
+        return cast_data
+
+    try:
+        chain = []
+        current_hash = cast_hash
+        while current_hash:
+            # Ancestors already walked on an earlier turn of this conversation
+            cached_chain = thread_cache.get_chain(current_hash, author_fid)
+            if cached_chain is not None:
+                chain.extend(cached_chain)
+                break
+            cast_data = await fetch_cast(current_hash)
+            if not _is_conversation_participant(cast_data, author_fid):
+                logger.debug("❌ Breaking conversation chain - found message from another user")
+                break
+            chain.append(cast_data)
+            current_hash = cast_data.get("parent_hash")
+
+        thread_cache.put_chain(cast_hash, author_fid, chain)
+        return _history_from_chain(chain, author_fid)
+
+    except Exception as e:
+        logger.error(f"Error constructing conversation history: {e}")
+        return [], 1 if dry_run else 999
+
+
+async def post_reply_to_neynar_async(http_client, payload, neynar_headers, dry_run=False):
+    """post_reply_to_neynar with an httpx.AsyncClient."""
+    try:
+        _fit_reply_to_byte_limit(payload)
+
+        if dry_run:
+            logger.warning("DRY_RUN_SIMULATION: Reply will not be posted to Neynar")
+            return
+
+        await neynar_post_async(http_client, NEYNAR_CAST_URL, json=payload, headers=neynar_headers)
+
+        logger.info(f"REPLY SUCCESSFULLY POSTED TO NEYNAR...")
+    except httpx.TimeoutException:
+        logger.error("Timeout while posting reply to Neynar")
+        raise
+    except httpx.HTTPError as e:
+        logger.error(f"Error posting reply to Neynar: {str(e)}")
+        if isinstance(e, httpx.HTTPStatusError):
+            logger.error(f"Status code: {e.response.status_code}")
+            logger.error(f"Error response from Neynar: {e.response.text}")
+        raise
+
+
+async def handle_webhook_v2_async(data, async_openai_client, pinecone_index, http_client, neynar_headers, neynar_signer_uuid, use_llm=True, dry_run=False):
+    """
+    handle_webhook_v2 for the ASGI app.
+
+    Args:
+        async_openai_client: AsyncOpenAI client, shared by every request in the process
+        pinecone_index: Pinecone index; its blocking queries run on the default thread pool
+        http_client: httpx.AsyncClient used for every Neynar call
+
+    Returns:
+        tuple[dict, int, dict]: JSON body, HTTP status and extra response headers
+    """
+    owns_trace = get_current_trace() is None
+    trace = start_trace() if owns_trace else get_current_trace()
+    start_time = time.time()
+    admitted = False
+    # Every file read while handling this cast comes from the data version published when it arrived
+    data_pin = pin_data_dir()
+    try:
+        if ADMISSION_ENABLED and not dry_run and data and data.get('type') == "cast.created":
+            with trace_stage("admission"):
+                decision = admission_controller.admit(data.get('data', {}))
+            if not decision.admitted:
+                trace.route = f"admission_{decision.action}"
+                if decision.action == DEFER:
+                    return {"status": "deferred", "reasons": decision.reasons}, 503, {"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+                return {"status": "shed", "reasons": decision.reasons}, 200, {}
+            admitted = True
+
+        body, status = await _handle_webhook_v2_async(
+            data, async_openai_client, pinecone_index, http_client, neynar_headers, neynar_signer_uuid, use_llm, dry_run
+        )
+        return body, status, {}
+    finally:
+        if admitted:
+            admission_controller.release()
+        route = trace.route or "none"
+        inc_counter("requests_total", route=route)
+        observe_seconds("route_duration_seconds", time.time() - start_time, route=route)
+        unpin_data_dir(data_pin)
+        if owns_trace:
+            end_trace()
+
+
+async def _handle_webhook_v2_async(data, async_openai_client, pinecone_index, http_client, neynar_headers, neynar_signer_uuid, use_llm, dry_run):
+    trace = get_current_trace()
+    try:
+        logger.debug("ENTERED ASYNC WEBHOOK HANDLER...")
+
+        """
+        STEP 1: Validate incoming data and exit if any validation fails
+        """
+        with trace_stage("validation"):
+            if not data:
+                return {"error": "No data provided"}, 400
+
+            if 'type' not in data:
+                return {"error": "Missing event type"}, 400
+
+            if data.get('type') != "cast.created":
+                return {"status": "Event type was not cast.created; ignoring request"}, 200
+
+        """
+        STEP 2: Webhook Dedupe logic (a single short SQLite statement, so it runs on the event loop)
+        """
+        cast_data = data.get('data', {})
+        cast_hash = cast_data.get('hash')
+        trace.cast_hash = cast_hash
+
+        with trace_stage("dedupe"):
+            if not dry_run and not dedupe_store.check_and_set(cast_hash):
+                logger.warning(f"DUPLICATE EVENT DETECTED FOR CAST: {cast_hash}. IGNORING...")
+                return {"status": "ignored duplicate"}, 200
+
+        """
+        STEP 3: Extract the cast text and author from the cast; never reply to ourself
+        """
+        cast_text = cast_data.get('text', '')
+        author = cast_data.get('author', {}).get('username', 'Unknown')
+        author_fid = str(cast_data.get('author', {}).get('fid', '0'))
+
+        if author_fid == str(BOT_ACCOUNT_FID):
+            logger.warning("BOT MENTIONED ITSELF IN CAST. IGNORING...")
+            return {"status": "Bot tagged itself; ignoring and not replying..."}, 200
+
+        try:
+            if use_llm and not is_available("openai_chat"):
+                logger.warning("OPENAI CIRCUIT BREAKER OPEN. REPLYING WITH OFFLINE MESSAGE...")
+                use_llm = False
+
+            if use_llm:
+                """
+                STEP 4: Get thread context and history; the summary and the history walk are independent,
+                so they are fetched concurrently
+                """
+                async def timed_summary():
+                    with trace_stage("summary"):
+                        return await get_conversation_summary_async(http_client, cast_hash, neynar_headers, dry_run)
+
+                async def timed_history():
+                    with trace_stage("history"):
+                        return await get_conversation_history_recursive_async(http_client, cast_hash, author_fid, neynar_headers, dry_run)
+
+                conversation_summary, (conversation_history, depth) = await asyncio.gather(timed_summary(), timed_history())
+
+                logger.debug(f"CONVERSATION HISTORY: {conversation_history}")
+                logger.debug(f"CONVERSATION SUMMARY: {conversation_summary}")
+                logger.debug(f"CONVERSATION DEPTH: {depth}")
+                admission_controller.record_thread_depth(cast_data.get('thread_hash'), depth)
+
+                if depth > 8:
+                    logger.warning(f"CONVERSATION DEPTH {depth} EXCEEDS LIMIT. NOT RESPONDING...")
+                    inc_counter("depth_refusals_total")
+                    return {"status": "conversation depth limit reached"}, 200
+
+                query_response_cache = None
+                if RESPONSE_CACHE_ENABLED:
+                    if conversation_history:
+                        response_cache.record_bypass()
+                    else:
+                        query_response_cache = response_cache
+
+                """
+                STEP 5: Workflow Routing
+                """
+                # The router and path handlers read metadata.json when constructed, so build them off the event loop
+                with trace_stage("routing"):
+                    router = await asyncio.to_thread(WorkflowRouter, async_openai_client)
+                    route_result = await router.route_query_async(cast_text)
+                trace.route = route_result
+                logger.info(f"ROUTE DETERMINED: {route_result}")
+
+                if route_result == "ignore":
+                    logger.warning(f"IGNORE QUERY DETECTED. NOT RESPONDING...")
+                    return {"status": "ignore query detected"}, 200
+
+                if route_result == "metadata":
+                    metadata_handler = await asyncio.to_thread(MetadataPath, async_openai_client)
+                    llm_response = await metadata_handler.handle_query_async(
+                        query=cast_text,
+                        user_name=author,
+                        conversation_history=conversation_history,
+                        conversation_summary=conversation_summary,
+                        depth=depth,
+                        response_cache=query_response_cache
+                    )
+                elif route_result == "hybrid":
+                    hybrid_handler = await asyncio.to_thread(HybridPath, async_openai_client)
+                    llm_response = await hybrid_handler.handle_query_async(
+                        query=cast_text,
+                        user_name=author,
+                        conversation_history=conversation_history,
+                        conversation_summary=conversation_summary,
+                        depth=depth,
+                        response_cache=query_response_cache
+                    )
+                else:
+                    # "contextual" and any unexpected route
+                    contextual_handler = ContextualPath(async_openai_client)
+                    llm_response = await contextual_handler.handle_query_async(
+                        query=cast_text,
+                        user_name=author,
+                        conversation_history=conversation_history,
+                        conversation_summary=conversation_summary,
+                        pinecone_index=pinecone_index,
+                        depth=depth,
+                        response_cache=query_response_cache
+                    )
+            else:
+                llm_response = offline_reply(author)
+
+            payload = {
+                "text": llm_response,
+                "signer_uuid": neynar_signer_uuid,
+                "parent": cast_hash
+            }
+
+            with trace_stage("post"):
+                await post_reply_to_neynar_async(http_client, payload, neynar_headers, dry_run)
+            trace.answer = payload["text"]
+
+        except Exception as e:
+            logger.error(f"Error posting reply: {e}")
+            inc_counter("errors_total", where="reply")
+            return {"error": "Unknown error"}, 500
+
+        logger.info("WEBHOOK PROCESSING COMPLETE... SENDING RESPONSE CODE 200 to NEYNAR")
+        return {"message": "Webhook processed"}, 200
+
+    except Exception as e:
+        logger.error(f"Error processing webhook: {str(e)}")
+        inc_counter("errors_total", where="webhook")
+        return {"error": "Internal server error"}, 500
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from datetime import date
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
+from core.metrics import inc_counter
+from core.data_store import current_data_dir
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Placeholder stored in cached answers in place of the asking user's @username
+USERNAME_PLACEHOLDER = "\x00USERNAME\x00"
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases, collapses whitespace and strips trailing punctuation so trivially different casts share a key."""
+    normalized = " ".join((query or "").lower().split())
+    return normalized.rstrip(" .!?")
+
+
+def depth_bucket(depth) -> str:
+    """The conversation depth range the prompts give the same guidance for (none, wrap up soon, farewell)."""
+    depth = int(depth or 0)
+    if depth >= 7:
+        return "7+"
+    return "5-6" if depth >= 5 else "0-4"
+
+
+def get_data_version(data_dir: str) -> str:
+    """
+    Identifies the metadata/index snapshot an answer was generated from.
+    A new metadata.json or a different Pinecone index produces a different version, so stale answers are never served.
+    """
+    metadata_path = os.path.join(data_dir, 'metadata.json')
+    try:
+        stat = os.stat(metadata_path)
+        metadata_version = f"{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        metadata_version = "none"
+    return f"{metadata_version}:{os.getenv('PINECONE_INDEX_NAME', '')}"
+
+
+class ResponseCache:
+    """
+    Exact-match cache of final LLM answers.
+    Keys combine the normalized query, the route, a fingerprint of the retrieved context, the data version and the
+    depth bucket (the prompts add wrap-up guidance from depth 5, which a cast without history can still be at).
+    Answers are stored with the asker's @username replaced by a placeholder, and personalized again when served.
+    Only used for first-touch casts; threaded conversations bypass it because the history changes the answer.
+    """
+
+    def __init__(self, maxsize: int = 500, ttl: int = 3600, data_dir: Optional[str] = None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # None follows the published data version (core/data_store.py)
+        self.data_dir = data_dir
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypasses = 0
+
+    def make_key(self, route: str, query: str, context: str, depth: int = 0) -> Optional[str]:
+        """
+        Builds the cache key. Returns None when nothing was retrieved, so answers generated
+        without context (e.g. during an upstream outage) are never cached.
+        """
+        if not context or not context.strip():
+            return None
+
+        fingerprint = hashlib.sha256(context.encode('utf-8')).hexdigest()
+        raw_key = "|".join([
+            route, normalize_query(query), fingerprint, get_data_version(self.data_dir or current_data_dir()),
+            depth_bucket(depth)
+        ])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def lookup(self, route: str, query: str, context: str, user_name: str, depth: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns a tuple of (key, cached_response). cached_response is None on a miss;
+        key is None if the request is not cacheable.
+        """
+        key = self.make_key(route, query, context, depth)
+        if key is None:
+            self.record_bypass()
+            return None, None
+
+        with self._lock:
+            template = self._cache.get(key)
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        inc_counter("cache_lookups_total", cache="response", result="miss" if template is None else "hit")
+        if template is None:
+            logger.debug(f"RESPONSE CACHE MISS: route={route}")
+            return key, None
+
+        logger.info(f"RESPONSE CACHE HIT: route={route} | {self.stats()}")
+        return key, template.replace(USERNAME_PLACEHOLDER, f"@{user_name}")
+
+    def store(self, key: Optional[str], response: str, user_name: str) -> None:
+        """Stores an answer under key, with the user's @username swapped for a placeholder."""
+        if key is None or not response:
+            return
+
+        pattern = re.compile(rf"@{re.escape(user_name)}(?![\w.-])", re.IGNORECASE)
+        template = pattern.sub(USERNAME_PLACEHOLDER, response)
+
+        with self._lock:
+            self._cache[key] = template
+            self.stores += 1
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "bypasses": self.bypasses,
+            }
+
+
+class EpisodeIdentificationCache:
+    """
+    Cache of the episode ids HybridPath identified for a query.
+    Keys combine the normalized query, the day (relative dates like "yesterday" or "the latest episode" resolve
+    differently from one day to the next) and the data version, so a new metadata.json starts from an empty slate.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def make_key(self, query: str, data_dir: str, day: Optional[date] = None) -> str:
+        day = day or date.today()
+        raw_key = "|".join([normalize_query(query), day.isoformat(), data_dir, get_data_version(data_dir)])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str) -> Optional[List[str]]:
+        """Returns the cached episode ids, or None on a miss."""
+        with self._lock:
+            episode_ids = self._cache.get(key)
+            if episode_ids is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        inc_counter("cache_lookups_total", cache="episode_identification", result="miss" if episode_ids is None else "hit")
+        if episode_ids is not None:
+            logger.debug(f"EPISODE IDENTIFICATION CACHE HIT: {episode_ids}")
+            return list(episode_ids)
+        return None
+
+    def store(self, key: str, episode_ids: List[str]) -> None:
+        """Stores the episode ids identified for a key. Empty results (nothing found, or an error) are not cached."""
+        if not episode_ids:
+            return
+        with self._lock:
+            self._cache[key] = tuple(episode_ids)
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+            }
@@ -0,0 +1,179 @@
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from core.utils import REPLY_BYTE_LIMIT, truncate_to_byte_limit
+from core.usage_tracking import record_completion_usage, record_generation_timing
+from core.outbound import openai_chat, openai_chat_async
+from core.request_trace import trace_stage
+from core.metrics import inc_counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+def stream_chat_completion(openai_client, route: str, byte_limit: int = REPLY_BYTE_LIMIT, **create_kwargs) -> str:
+    """
+    Streams a chat completion and stops generating as soon as the answer can no longer fit in a cast.
+    The UTF-8 byte count is tracked as chunks arrive; once it passes byte_limit the stream is closed
+    and the text is cut back to the last complete sentence (same rules as truncate_to_byte_limit),
+    so we neither pay for nor wait on tokens that would be truncated before posting.
+
+    Args:
+        openai_client: OpenAI client instance
+        route: Route name used when recording latency and token usage (e.g. "contextual")
+        byte_limit: Maximum reply size in bytes
+        **create_kwargs: Arguments passed through to chat.completions.create (model, messages, ...)
+
+    Returns:
+        str: The generated (and if needed, truncated) response text
+    """
+    start_time = time.time()
+    first_token_latency = None
+    stopped_early = False
+    usage = None
+    parts = []
+    byte_count = 0
+
+    with trace_stage("generation"):
+        stream = openai_chat(
+            openai_client,
+            stream=True,
+            stream_options={"include_usage": True},
+            **create_kwargs
+        )
+
+        try:
+            for chunk in stream:
+                # The final chunk carries the token usage and no choices
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+
+                if first_token_latency is None:
+                    first_token_latency = time.time() - start_time
+
+                parts.append(delta)
+                byte_count += len(delta.encode('utf-8'))
+                if byte_count > byte_limit:
+                    stopped_early = True
+                    break
+        except Exception:
+            # The tokens generated before the error are still billed
+            _record_usage(route, stream, usage or _estimate_usage(create_kwargs.get("messages"), parts))
+            raise
+        finally:
+            # Also releases the HTTP connection if iterating the stream failed
+            stream.close()
+
+    return _finish_stream(
+        route, stream, parts, byte_count, byte_limit, stopped_early, usage, first_token_latency, start_time,
+        create_kwargs.get("messages")
+    )
+
+
+async def stream_chat_completion_async(async_openai_client, route: str, byte_limit: int = REPLY_BYTE_LIMIT, **create_kwargs) -> str:
+    """stream_chat_completion for an AsyncOpenAI client."""
+    start_time = time.time()
+    first_token_latency = None
+    stopped_early = False
+    usage = None
+    parts = []
+    byte_count = 0
+
+    with trace_stage("generation"):
+        stream = await openai_chat_async(
+            async_openai_client,
+            stream=True,
+            stream_options={"include_usage": True},
+            **create_kwargs
+        )
+
+        try:
+            async for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+
+                if first_token_latency is None:
+                    first_token_latency = time.time() - start_time
+
+                parts.append(delta)
+                byte_count += len(delta.encode('utf-8'))
+                if byte_count > byte_limit:
+                    stopped_early = True
+                    break
+        except Exception:
+            _record_usage(route, stream, usage or _estimate_usage(create_kwargs.get("messages"), parts))
+            raise
+        finally:
+            await stream.close()
+
+    return _finish_stream(
+        route, stream, parts, byte_count, byte_limit, stopped_early, usage, first_token_latency, start_time,
+        create_kwargs.get("messages")
+    )
+
+
+def _estimate_usage(messages: Optional[List[Dict]], parts: List[str]) -> SimpleNamespace:
+    """
+    Token usage of a stream that ended before its final usage chunk (closed early, or failed), estimated at about
+    four characters per token from the prompt and the text received. OpenAI still bills the tokens it generated.
+    """
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages or []) // 4 + 4 * len(messages or [])
+    completion_tokens = sum(len(part) for part in parts) // 4
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=None,
+    )
+
+
+def _record_usage(route: str, stream, usage) -> None:
+    """Records a stream's usage and settles the rate limiter's estimate with it (core/outbound.py streams)."""
+    record_completion_usage(route, usage)
+    settle = getattr(stream, "settle", None)
+    if settle is not None:
+        settle(usage)
+
+
+def _finish_stream(route, stream, parts, byte_count, byte_limit, stopped_early, usage, first_token_latency, start_time, messages=None) -> str:
+    """Joins the streamed text, truncates it if the stream was cut short, and records usage and timing."""
+    total_latency = time.time() - start_time
+    text = "".join(parts).strip()
+
+    if stopped_early:
+        logger.info(f"STREAM STOPPED EARLY AT {byte_count} BYTES (LIMIT {byte_limit}) ON ROUTE {route}")
+        text = truncate_to_byte_limit(text, byte_limit)
+        inc_counter("truncations_total", where="stream")
+
+    if usage is None:
+        # Closing the stream early means the final usage chunk never arrives
+        usage = _estimate_usage(messages, parts)
+        inc_counter("usage_estimated_total", route=route)
+    _record_usage(route, stream, usage)
+    record_generation_timing(route, first_token_latency, total_latency)
+    logger.debug(
+        f"STREAMED RESPONSE [{route}]: first token {first_token_latency if first_token_latency is not None else -1:.2f}s, "
+        f"total {total_latency:.2f}s, {byte_count} bytes"
+    )
+
+    return text
@@ -0,0 +1,110 @@
+"""
+Conversation history cache for threaded replies.
+
+get_conversation_history_recursive (and its async twin) walk up a thread one Neynar call per cast, so every reply in
+a conversation re-fetched every ancestor the previous turn had just fetched. Casts don't change once posted, and
+neither does the conversation chain above a cast, so both are cached here:
+
+- casts by hash, slimmed down to the fields the history uses
+- the conversation chain (the participant casts from a cast up to where the walk stopped) by its tip cast and the
+  user it was built for
+
+A new reply's walk stops at the first ancestor whose chain is cached, usually the user's previous cast, so a turn
+costs the new user cast and the bot reply above it instead of the whole thread. The cache is per process: a reply
+that lands on another worker walks the thread once there.
+"""
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+from cachetools import TTLCache
+from core.metrics import inc_counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+THREAD_CACHE_ENABLED = os.getenv("THREAD_CACHE_ENABLED", "true").lower() == "true"
+THREAD_CACHE_MAXSIZE = int(os.getenv("THREAD_CACHE_MAXSIZE", "5000"))
+THREAD_CACHE_TTL_SECONDS = int(os.getenv("THREAD_CACHE_TTL_SECONDS", "86400"))
+
+
+def slim_cast(cast_data: dict) -> dict:
+    """The immutable fields of a Neynar cast that the conversation history uses (reactions and replies change)."""
+    return {
+        "hash": cast_data.get("hash"),
+        "parent_hash": cast_data.get("parent_hash"),
+        "text": cast_data.get("text", ""),
+        "author": {"fid": cast_data["author"]["fid"]},
+    }
+
+
+class ThreadCache:
+    """Casts by hash and conversation chains by (tip hash, author fid), both bounded and expiring."""
+
+    def __init__(self, maxsize: int = 5000, ttl: int = 86400, enabled: bool = True):
+        self.enabled = enabled
+        self._casts = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._chains = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.cast_hits = 0
+        self.chain_hits = 0
+        self.fetches = 0
+
+    def get_cast(self, cast_hash: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            cast_data = self._casts.get(cast_hash)
+            if cast_data is not None:
+                self.cast_hits += 1
+        inc_counter("cache_lookups_total", cache="thread_cast", result="miss" if cast_data is None else "hit")
+        return cast_data
+
+    def put_cast(self, cast_hash: str, cast_data: dict) -> dict:
+        """Caches a fetched cast and returns the slimmed copy that was cached."""
+        cast_data = slim_cast(cast_data)
+        with self._lock:
+            self.fetches += 1
+            if self.enabled:
+                self._casts[cast_hash] = cast_data
+        return cast_data
+
+    def get_chain(self, tip_hash: str, author_fid) -> Optional[List[dict]]:
+        """The cached chain starting at tip_hash (newest first), or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            chain = self._chains.get((tip_hash, str(author_fid)))
+            if chain is not None:
+                self.chain_hits += 1
+        inc_counter("cache_lookups_total", cache="thread_chain", result="miss" if chain is None else "hit")
+        return list(chain) if chain is not None else None
+
+    def put_chain(self, tip_hash: str, author_fid, chain: List[dict]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._chains[(tip_hash, str(author_fid))] = tuple(chain)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "casts": len(self._casts),
+                "chains": len(self._chains),
+                "maxsize": self._casts.maxsize,
+                "ttl": self._casts.ttl,
+                "cast_hits": self.cast_hits,
+                "chain_hits": self.chain_hits,
+                "fetches": self.fetches,
+            }
+
+
+thread_cache = ThreadCache(maxsize=THREAD_CACHE_MAXSIZE, ttl=THREAD_CACHE_TTL_SECONDS, enabled=THREAD_CACHE_ENABLED)
@@ -0,0 +1,194 @@
+"""
+Checksum manifest for the transcripts of a data version.
+
+verify_transcript_dir() records the sha256, size and mtime of every transcript in <data dir>/.transcript_manifest.json.
+On later runs a file whose size and mtime match the manifest is trusted without being read, a file whose sha256
+still matches is not parsed again, and only new or changed files are fully parsed and schema-checked. Hashing and
+parsing run across a process pool.
+
+Deepgram transcripts carry metadata.sha256, the hash of the audio they were generated from. It is recorded as
+source_sha256 and cross-checked: two files with the same source audio, or a changed file that now transcribes
+different audio than before, are logged as warnings, since both usually mean the wrong file was uploaded under a name.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+MANIFEST_FILENAME = ".transcript_manifest.json"
+# Below this many files to check, a process pool costs more to start than it saves
+POOL_MIN_FILES = 8
+
+
+def is_transcript_file(filename: str) -> bool:
+    return filename.startswith('transcript_') and filename.endswith('.json')
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def check_transcript_schema(transcript_data) -> Optional[str]:
+    """Returns a description of the first problem with a Deepgram transcript's structure, or None if it is usable."""
+    if not isinstance(transcript_data, dict):
+        return "top level is not an object"
+    try:
+        alternative = transcript_data['results']['channels'][0]['alternatives'][0]
+    except (KeyError, IndexError, TypeError):
+        return "missing results.channels[0].alternatives[0]"
+    if not isinstance(alternative.get('transcript'), str):
+        return "alternatives[0].transcript is not a string"
+    if not isinstance(alternative.get('words', []), list):
+        return "alternatives[0].words is not a list"
+    paragraphs = alternative.get('paragraphs')
+    if paragraphs is not None and not (isinstance(paragraphs, dict) and isinstance(paragraphs.get('paragraphs', []), list)):
+        return "alternatives[0].paragraphs.paragraphs is not a list"
+    metadata = transcript_data.get('metadata')
+    if metadata is not None and not isinstance(metadata, dict):
+        return "metadata is not an object"
+    return None
+
+
+def _check_file(task: Tuple[str, Optional[str]]) -> Dict:
+    """
+    Hashes one file and, unless its sha256 equals known_sha256, parses and schema-checks it.
+    Runs in a pool worker, so it takes and returns plain picklable values.
+    """
+    path, known_sha256 = task
+    result = {'file': os.path.basename(path), 'error': None, 'parsed': False}
+    try:
+        stat = os.stat(path)
+        result['size'] = stat.st_size
+        result['mtime_ns'] = stat.st_mtime_ns
+        result['sha256'] = file_sha256(path)
+        if result['sha256'] == known_sha256:
+            return result
+
+        with open(path, 'r') as f:
+            transcript_data = json.load(f)
+        result['parsed'] = True
+        result['error'] = check_transcript_schema(transcript_data)
+        source_sha256 = (transcript_data.get('metadata') or {}).get('sha256') if isinstance(transcript_data, dict) else None
+        result['source_sha256'] = source_sha256 if isinstance(source_sha256, str) else None
+    except json.JSONDecodeError as e:
+        result['error'] = f"invalid JSON: {e}"
+    except OSError as e:
+        result['error'] = f"unreadable: {e}"
+    return result
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict]:
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring unreadable transcript manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_manifest(manifest_path: str, files: Dict[str, Dict]) -> None:
+    tmp_path = f"{manifest_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump({'files': files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def verify_transcript_dir(data_dir: str, workers: Optional[int] = None, rehash: bool = False) -> Tuple[bool, List[str]]:
+    """
+    Verifies <data_dir>/transcripts against <data_dir>/.transcript_manifest.json and updates the manifest.
+
+    Args:
+        data_dir: A data version directory (or a staging directory for one)
+        workers: Pool size (default: os.cpu_count())
+        rehash: Hash every file, even those whose size and mtime match the manifest
+
+    Returns:
+        tuple[bool, List[str]]: Whether every transcript is valid, and a description of each problem found
+    """
+    start_time = time.time()
+    transcript_dir = os.path.join(data_dir, 'transcripts')
+    manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
+    if not os.path.isdir(transcript_dir):
+        return False, [f"transcript directory {transcript_dir} does not exist"]
+
+    manifest = load_manifest(manifest_path)
+    filenames = sorted(f for f in os.listdir(transcript_dir) if is_transcript_file(f))
+    if not filenames:
+        return False, ["no transcript files found"]
+
+    entries = {}
+    tasks = []
+    for filename in filenames:
+        known = manifest.get(filename)
+        path = os.path.join(transcript_dir, filename)
+        stat = os.stat(path)
+        if known and not rehash and known.get('size') == stat.st_size and known.get('mtime_ns') == stat.st_mtime_ns:
+            entries[filename] = known
+            continue
+        tasks.append((path, known.get('sha256') if known else None))
+
+    if len(tasks) >= POOL_MIN_FILES and (workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+            results = list(executor.map(_check_file, tasks, chunksize=chunksize))
+    else:
+        results = [_check_file(task) for task in tasks]
+
+    problems = []
+    parsed = 0
+    for result in results:
+        filename = result['file']
+        if result['error']:
+            problems.append(f"{filename}: {result['error']}")
+            continue
+        known = manifest.get(filename, {})
+        if result['parsed']:
+            parsed += 1
+            if known.get('source_sha256') and result['source_sha256'] and known['source_sha256'] != result['source_sha256']:
+                logger.warning(f"{filename} now transcribes different source audio than before "
+                               f"({known['source_sha256'][:12]} -> {result['source_sha256'][:12]})")
+        else:
+            result['source_sha256'] = known.get('source_sha256')
+        entries[filename] = {
+            'sha256': result['sha256'],
+            'size': result['size'],
+            'mtime_ns': result['mtime_ns'],
+            'source_sha256': result['source_sha256'],
+        }
+
+    # Two transcripts of the same recording usually mean a file was uploaded under the wrong name.
+    # Reported rather than failed, since an episode can legitimately be re-published from the same recording.
+    by_source = {}
+    for filename, entry in entries.items():
+        if entry.get('source_sha256'):
+            by_source.setdefault(entry['source_sha256'], []).append(filename)
+    for source_sha256, duplicates in by_source.items():
+        if len(duplicates) > 1:
+            logger.warning(f"Transcripts {', '.join(sorted(duplicates))} share Deepgram source sha256 {source_sha256[:12]}")
+
+    save_manifest(manifest_path, entries)
+    logger.info(
+        f"Verified {len(filenames)} transcript files in {time.time() - start_time:.2f} seconds: "
+        f"{len(filenames) - len(tasks)} unchanged, {len(tasks) - parsed - len(problems)} rehashed, {parsed} parsed, "
+        f"{len(problems)} problems"
+    )
+    return not problems, problems
@@ -0,0 +1,262 @@
+"""
+Compact transcripts.
+
+The raw Deepgram JSON stores word, confidence, speaker and speaker_confidence for every word, plus model info,
+but the bot only ever reads punctuated_word/start/end, sentence texts and times, paragraph speakers and times and
+the flat transcript string. At ingest, compact_transcript_dir() writes transcript_<x>.compact.json.gz next to each
+transcript_<x>.json with just those fields, in the same nested layout, so code reading a loaded transcript does not
+change.
+
+load_transcript() reads the compact file when it is current and falls back to the original JSON otherwise.
+A compact file is current when its mtime equals the original's: it is stamped with the original's mtime when
+written, and replacing the original (a sync or an update) changes it.
+
+preload_transcripts() loads transcripts into memory ahead of time (before gunicorn forks, see core/warm_start.py),
+after which load_transcript() returns the shared in-memory copy for as long as the file on disk is unchanged.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from core.data_store import is_retired_data_dir, register_cache_evictor
+from core.transcript_manifest import is_transcript_file, POOL_MIN_FILES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+COMPACT_SUFFIX = ".compact.json.gz"
+
+# Full transcript path -> (mtime_ns of the file it was loaded for, transcript), filled by preload_transcripts()
+_preloaded: Dict[str, Tuple[int, Dict]] = {}
+
+
+def _evict_preloaded(data_dir: str) -> None:
+    prefix = os.path.join(data_dir, 'transcripts') + os.sep
+    for path in [path for path in _preloaded if path.startswith(prefix)]:
+        _preloaded.pop(path, None)
+
+
+register_cache_evictor(_evict_preloaded)
+
+
+def compact_path_for(transcript_path: str) -> str:
+    """transcripts/transcript_ep50.json -> transcripts/transcript_ep50.compact.json.gz"""
+    return transcript_path[:-len('.json')] + COMPACT_SUFFIX
+
+
+def compact_transcript(transcript_data: Dict) -> Dict:
+    """Strips a Deepgram transcript down to the fields the bot reads, keeping the results.channels[0].alternatives[0] layout."""
+    alternative = transcript_data['results']['channels'][0]['alternatives'][0]
+    paragraphs = (alternative.get('paragraphs') or {}).get('paragraphs', [])
+
+    compact_alternative = {
+        'transcript': alternative.get('transcript', ''),
+        'words': [
+            {'punctuated_word': w.get('punctuated_word', w.get('word', '')), 'start': w['start'], 'end': w['end']}
+            for w in alternative.get('words', [])
+        ],
+        'paragraphs': {
+            'paragraphs': [
+                {
+                    'speaker': para.get('speaker'),
+                    'start': para.get('start'),
+                    'end': para.get('end'),
+                    'sentences': [
+                        {'text': s['text'], 'start': s['start'], 'end': s['end']}
+                        for s in para.get('sentences', [])
+                    ],
+                }
+                for para in paragraphs
+            ]
+        },
+    }
+    compact = {'results': {'channels': [{'alternatives': [compact_alternative]}]}}
+    # Kept for the source audio cross-check in core/transcript_manifest.py
+    source_sha256 = (transcript_data.get('metadata') or {}).get('sha256')
+    if source_sha256:
+        compact['metadata'] = {'sha256': source_sha256}
+    return compact
+
+
+def is_compact_current(transcript_path: str, compact_path: str) -> bool:
+    try:
+        return os.stat(compact_path).st_mtime_ns == os.stat(transcript_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _timed_load(load, path: str) -> float:
+    start_time = time.perf_counter()
+    load(path)
+    return time.perf_counter() - start_time
+
+
+def _load_json(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _load_compact(path: str) -> Dict:
+    # gzip decompresses as json reads, so the compressed bytes are never held in memory alongside the text
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_compact_transcript(transcript_path: str) -> Dict:
+    """
+    Writes the compact version of one transcript. Runs in a pool worker, so it returns plain values:
+    the sizes of both files and the time to load each.
+    """
+    result = {'file': os.path.basename(transcript_path), 'error': None}
+    compact_path = compact_path_for(transcript_path)
+    tmp_path = f"{compact_path}.tmp-{os.getpid()}"
+    try:
+        stat = os.stat(transcript_path)
+        start_time = time.perf_counter()
+        transcript_data = _load_json(transcript_path)
+        result['original_load_seconds'] = time.perf_counter() - start_time
+
+        payload = json.dumps(compact_transcript(transcript_data), separators=(',', ':')).encode('utf-8')
+        # mtime=0 keeps the gzip header, and so the file, identical for identical transcripts
+        with open(tmp_path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(payload)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, compact_path)
+
+        result['original_size'] = stat.st_size
+        result['compact_size'] = os.path.getsize(compact_path)
+        result['compact_load_seconds'] = _timed_load(_load_compact, compact_path)
+    except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+        result['error'] = str(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return result
+
+
+def compact_transcript_dir(data_dir: str, workers: Optional[int] = None) -> Tuple[bool, int]:
+    """
+    Writes compact versions of the transcripts in <data_dir>/transcripts that don't have a current one, across a
+    process pool, and removes compact files whose original is gone. Logs the size and load-time reduction per file
+    and in total.
+
+    Returns:
+        tuple[bool, int]: Whether every transcript was compacted, and how many were written
+    """
+    start_time = time.time()
+    transcript_dir = os.path.join(data_dir, 'transcripts')
+    if not os.path.isdir(transcript_dir):
+        return False, 0
+
+    filenames = os.listdir(transcript_dir)
+    transcripts = {f for f in filenames if is_transcript_file(f)}
+    for filename in filenames:
+        if filename.endswith(COMPACT_SUFFIX) and filename[:-len(COMPACT_SUFFIX)] + '.json' not in transcripts:
+            os.remove(os.path.join(transcript_dir, filename))
+
+    tasks = [
+        os.path.join(transcript_dir, f) for f in sorted(transcripts)
+        if not is_compact_current(os.path.join(transcript_dir, f), compact_path_for(os.path.join(transcript_dir, f)))
+    ]
+    if len(tasks) >= POOL_MIN_FILES and (workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+            results = list(executor.map(write_compact_transcript, tasks, chunksize=chunksize))
+    else:
+        results = [write_compact_transcript(task) for task in tasks]
+
+    totals = {'original_size': 0, 'compact_size': 0, 'original_load_seconds': 0.0, 'compact_load_seconds': 0.0}
+    failed = 0
+    for result in results:
+        if result['error']:
+            logger.error(f"Error compacting {result['file']}: {result['error']}")
+            failed += 1
+            continue
+        for key in totals:
+            totals[key] += result[key]
+        logger.info(
+            f"Compacted {result['file']}: {_format_reduction(result['original_size'], result['compact_size'], 'size')}, "
+            f"{_format_reduction(result['original_load_seconds'], result['compact_load_seconds'], 'load')}"
+        )
+
+    compacted = len(results) - failed
+    if compacted:
+        logger.info(
+            f"Compacted {compacted} transcripts in {time.time() - start_time:.2f} seconds "
+            f"({len(transcripts) - len(tasks)} already current): "
+            f"{totals['original_size'] / 1e6:.2f} MB -> {totals['compact_size'] / 1e6:.2f} MB, "
+            f"load {totals['original_load_seconds']:.2f}s -> {totals['compact_load_seconds']:.2f}s"
+        )
+    else:
+        logger.info(f"All {len(transcripts) - len(tasks)} compact transcripts already current")
+    return failed == 0, compacted
+
+
+def _format_reduction(before: float, after: float, label: str) -> str:
+    if label == 'size':
+        values = f"{before / 1e3:.1f} KB -> {after / 1e3:.1f} KB"
+    else:
+        values = f"{before * 1e3:.1f} ms -> {after * 1e3:.1f} ms"
+    reduction = (1 - after / before) * 100 if before else 0.0
+    return f"{label} {values} ({reduction:.0f}% less)"
+
+
+def _source_mtime_ns(full_transcript_path: str) -> Optional[int]:
+    """mtime of the original, or of the compact file when only that exists; a compact file carries its original's mtime."""
+    for path in (full_transcript_path, compact_path_for(full_transcript_path)):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def preload_transcripts(data_dir: str, transcript_paths: List[str]) -> int:
+    """Loads the given transcripts into memory for load_transcript(). Returns how many were loaded."""
+    loaded = 0
+    for transcript_path in transcript_paths:
+        full_transcript_path = os.path.join(data_dir, 'transcripts', transcript_path)
+        mtime_ns = _source_mtime_ns(full_transcript_path)
+        if mtime_ns is None:
+            continue
+        if is_retired_data_dir(data_dir):
+            break
+        try:
+            _preloaded[full_transcript_path] = (mtime_ns, _load_from_disk(full_transcript_path))
+            loaded += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not preload {transcript_path}: {e}")
+    return loaded
+
+
+def load_transcript(data_dir: str, transcript_path: str) -> Dict:
+    """
+    Loads transcripts/<transcript_path> from data_dir: the preloaded copy if it is still current, otherwise from
+    the compact version when that is current, otherwise from the original. Preloaded transcripts are shared by every
+    request in the process, so callers must not modify the result. Raises FileNotFoundError if no file exists.
+    """
+    full_transcript_path = os.path.join(data_dir, 'transcripts', transcript_path)
+    preloaded = _preloaded.get(full_transcript_path)
+    if preloaded is not None and preloaded[0] == _source_mtime_ns(full_transcript_path):
+        return preloaded[1]
+    return _load_from_disk(full_transcript_path)
+
+
+def _load_from_disk(full_transcript_path: str) -> Dict:
+    compact_path = compact_path_for(full_transcript_path)
+    if is_compact_current(full_transcript_path, compact_path) or (
+        not os.path.exists(full_transcript_path) and os.path.exists(compact_path)
+    ):
+        return _load_compact(compact_path)
+    logger.debug(f"No current compact transcript for {os.path.basename(full_transcript_path)}, loading the original")
+    return _load_json(full_transcript_path)
@@ -0,0 +1,78 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+from core.metrics import inc_counter, observe_seconds
+from core.request_trace import get_current_trace
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+# Running per-route totals of token usage reported by the OpenAI API
+_usage_lock = threading.Lock()
+_usage_by_route: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+    "requests": 0,
+    "prompt_tokens": 0,
+    "cached_prompt_tokens": 0,
+    "completion_tokens": 0,
+})
+
+
+def record_completion_usage(route: str, usage) -> None:
+    """
+    Records the token usage of a chat completion under the given route.
+    `usage` is the `usage` object from an OpenAI response; cached_prompt_tokens is the part of the prompt
+    that was served from OpenAI's prompt cache (prompt_tokens_details.cached_tokens).
+    """
+    if usage is None:
+        return
+
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+
+    with _usage_lock:
+        totals = _usage_by_route[route]
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_prompt_tokens"] += cached_tokens
+        totals["completion_tokens"] += completion_tokens
+
+    # The same totals across workers, for the prompt cache hit rate per route (cached / prompt tokens)
+    inc_counter("llm_requests_total", route=route)
+    inc_counter("llm_prompt_tokens_total", prompt_tokens, route=route)
+    inc_counter("llm_cached_prompt_tokens_total", cached_tokens, route=route)
+    inc_counter("llm_completion_tokens_total", completion_tokens, route=route)
+
+    trace = get_current_trace()
+    if trace is not None:
+        trace.record_usage(route, prompt_tokens, cached_tokens, completion_tokens)
+
+    logger.debug(f"TOKEN USAGE [{route}]: prompt={prompt_tokens} cached={cached_tokens} completion={completion_tokens}")
+
+
+def record_generation_timing(route: str, first_token_seconds: Optional[float], total_seconds: float) -> None:
+    """Records the time to first token and total generation time of a streamed completion under the given route."""
+    if first_token_seconds is not None:
+        observe_seconds("generation_first_token_seconds", first_token_seconds, route=route)
+    observe_seconds("generation_total_seconds", total_seconds, route=route)
+
+
+def get_usage_stats() -> Dict[str, Dict[str, int]]:
+    """Returns a snapshot of the per-route token usage totals, including the cached prompt token ratio."""
+    with _usage_lock:
+        snapshot = {route: dict(totals) for route, totals in _usage_by_route.items()}
+
+    for totals in snapshot.values():
+        prompt_tokens = totals["prompt_tokens"]
+        totals["cached_prompt_ratio"] = round(totals["cached_prompt_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+    return snapshot
@@ -13,16 +13,8 @@ def get_required_env_var(name: str) -> str:
         raise ValueError(f"Missing required environment variable: {name}")
     return value
 
-NEYNAR_KEY = get_required_env_var("NEYNAR_API_KEY")
-
-# Initialize the Neynar client
-NEYNAR_CAST_URL = "https://api.neynar.com/v2/farcaster/cast"
-
-NEYNAR_HEADERS = {
-    "x-api-key": NEYNAR_KEY,
-    "accept": "application/json",
-    "content-type": "application/json"    
-}
+# Farcaster's cast length limit, in bytes
+REPLY_BYTE_LIMIT = 1000
 
 
 def format_timestamp(seconds: float) -> str:
@@ -37,6 +29,34 @@ def format_timestamp(seconds: float) -> str:
         return f"{minutes:02d}:{seconds:02d}"
 
 
+def truncate_to_byte_limit(text: str, limit: int = REPLY_BYTE_LIMIT) -> str:
+    """
+    Smartly truncate text to stay under byte limit while preserving complete sentences.
+    """
+    if len(text.encode('utf-8')) <= limit:
+        return text
+        
+    # Leave room for truncation notice
+    working_limit = limit - len(" [...response too long, truncating. cc: @adrienne]".encode('utf-8'))
+    
+    # Convert to bytes to handle UTF-8 characters correctly
+    encoded = text.encode('utf-8')
+    truncated = encoded[:working_limit].decode('utf-8', 'ignore')
+    
+    # Find the last complete sentence
+    last_sentence = max(
+        truncated.rfind('.'),
+        truncated.rfind('!'),
+        truncated.rfind('?')
+    )
+    
+    if last_sentence > 0:
+        truncated = truncated[:last_sentence + 1]
+    
+    logger.info(f"TRUNCATED RESPONSE: {truncated} [...response too long, truncating. cc: @adrienne]")
+    return truncated + " [...response too long, truncating. cc: @adrienne]"
+
+
 def get_conversation_history_DEPRECATED(first_cast_hash):
     """
     Fetches the conversation history for a given cast hash using a recursive approach to build complete thread history.    
@@ -0,0 +1,185 @@
+"""
+Warm start for the web process.
+
+preload() runs while api.py is imported. Under `gunicorn --preload` that happens once in the master, before the
+workers are forked, so the data it loads (metadata.json with its query index and name matcher, the compact
+transcripts of the most recent episodes, the tiktoken encoders) is shared by every worker copy-on-write instead of being loaded by each worker
+on its first requests. gc.freeze() then moves everything loaded so far out of the collector's reach, so collections
+in the workers don't write to (and copy) the shared pages.
+
+Upstream connections can't be shared across a fork, so each worker warms its own when /ready is first asked,
+on a background thread (no thread is started from a fork hook, where the child may still hold locks copied mid-use
+from the parent). That is also where api.py's lazily created clients (core/lazy_client.py) are first built.
+readiness() reports ready once both have finished. A failed metadata preload keeps the worker unready (readiness()
+retries it); a failed connection warm-up is logged and doesn't, since the circuit breakers handle a down upstream.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+from core.data_store import resolve_data_dir, load_metadata
+from core.metadata_query import get_metadata_index
+from core.name_matcher import get_name_matcher
+from core.transcript_store import preload_transcripts
+from prompts.farcaster_prompts import transcript_context_static_tokens
+from prompts.hybrid_prompts import full_transcript_context_static_tokens
+from prompts.metadata_prompts import metadata_context_static_tokens
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set logging level based on environment variable
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
+if VERBOSE_LOGGING:
+    logger.setLevel(logging.DEBUG)
+
+
+PRELOAD_TRANSCRIPTS = os.getenv("PRELOAD_TRANSCRIPTS", "true").lower() == "true"
+# Only preload the most recently aired episodes, the ones most asked about (0 = all); older ones are loaded from
+# disk when asked about. Every preloaded transcript stays in memory, in every worker, for the life of the process
+PRELOAD_TRANSCRIPTS_LIMIT = int(os.getenv("PRELOAD_TRANSCRIPTS_LIMIT", "20"))
+WARM_CONNECTIONS = os.getenv("WARM_CONNECTIONS", "true").lower() == "true"
+WARM_CONNECTIONS_TIMEOUT_SECONDS = 5.0
+
+# Models whose tiktoken encoders are used for token counting
+TOKENIZER_MODELS = ("gpt-4", "gpt-4o")
+
+_state = {
+    "data_ready": False,
+    # Why the metadata couldn't be preloaded, until it loads
+    "data_error": None,
+    "openai_client": None,
+    "pinecone_index": None,
+    # pid whose connections are warm, and pid that started warming them
+    "connections_pid": None,
+    "warming_pid": None,
+}
+_lock = threading.Lock()
+
+
+def preload(openai_client=None, pinecone_index=None) -> Dict:
+    """
+    Loads shared data into this process and remembers the clients whose connections each worker should warm.
+    Returns timings per step. Errors are logged; a failed step leaves that data to be loaded on demand.
+    """
+    _state["openai_client"] = openai_client
+    _state["pinecone_index"] = pinecone_index
+    start_time = time.time()
+    timings = {}
+
+    data_dir = resolve_data_dir()
+    step_start = time.time()
+    metadata = _preload_metadata(data_dir)
+    timings["metadata"] = time.time() - step_start
+
+    step_start = time.time()
+    transcripts_loaded = 0
+    if PRELOAD_TRANSCRIPTS:
+        episodes = sorted(metadata, key=lambda ep: ep.get('aired_date', ''), reverse=True)
+        if PRELOAD_TRANSCRIPTS_LIMIT > 0:
+            episodes = episodes[:PRELOAD_TRANSCRIPTS_LIMIT]
+        transcript_paths = [ep['transcript_path'] for ep in episodes if ep.get('transcript_path')]
+        transcripts_loaded = preload_transcripts(data_dir, transcript_paths)
+    timings["transcripts"] = time.time() - step_start
+
+    step_start = time.time()
+    try:
+        import tiktoken
+        for model in TOKENIZER_MODELS:
+            tiktoken.encoding_for_model(model)
+        _log_static_prompt_sizes()
+    except Exception as e:
+        logger.warning(f"Could not preload tiktoken encoders: {e}")
+    timings["tokenizers"] = time.time() - step_start
+
+    gc.collect()
+    gc.freeze()
+    _state["data_ready"] = _state["data_error"] is None
+    logger.info(
+        f"PRELOAD COMPLETE IN {time.time() - start_time:.2f}s | {len(metadata)} EPISODES, "
+        f"{transcripts_loaded} TRANSCRIPTS, {gc.get_freeze_count()} OBJECTS FROZEN"
+    )
+    return timings
+
+
+def _log_static_prompt_sizes() -> None:
+    # OpenAI only caches prompts of 1024 tokens or more, so a static prefix shorter than that is never cached
+    # on its own; it takes the context after it to reach the minimum
+    logger.info(
+        f"STATIC PROMPT PREFIX TOKENS: contextual={transcript_context_static_tokens()}, "
+        f"metadata={metadata_context_static_tokens()}, hybrid={full_transcript_context_static_tokens()}"
+    )
+
+
+def _preload_metadata(data_dir: str) -> List[Dict]:
+    """Loads and indexes metadata.json, recording the error when it can't be (returns [] then)."""
+    try:
+        metadata = load_metadata(data_dir)
+        get_metadata_index(data_dir, metadata)
+        get_name_matcher(data_dir)
+    except (OSError, ValueError) as e:
+        # readiness() retries on every probe, so the same error is only logged once
+        if _state["data_error"] != str(e):
+            logger.error(f"Error preloading metadata: {e}")
+        _state["data_error"] = str(e)
+        return []
+    _state["data_error"] = None
+    return metadata
+
+
+def _warm_connections() -> None:
+    pid = os.getpid()
+    start_time = time.time()
+    openai_client = _state["openai_client"]
+    pinecone_index = _state["pinecone_index"]
+    try:
+        if openai_client is not None:
+            openai_client.with_options(timeout=WARM_CONNECTIONS_TIMEOUT_SECONDS).models.list()
+        if pinecone_index is not None:
+            pinecone_index.describe_index_stats()
+        logger.info(f"UPSTREAM CONNECTIONS WARM IN {time.time() - start_time:.2f}s (PID {pid})")
+    except Exception as e:
+        logger.warning(f"Could not warm upstream connections (pid {pid}): {e}")
+    finally:
+        _state["connections_pid"] = pid
+
+
+def start_connection_warmup() -> None:
+    """Warms this process's upstream connections on a background thread, once per process."""
+    pid = os.getpid()
+    with _lock:
+        if _state["warming_pid"] == pid:
+            return
+        _state["warming_pid"] = pid
+    if not WARM_CONNECTIONS:
+        _state["connections_pid"] = pid
+        return
+    threading.Thread(target=_warm_connections, name="warm-connections", daemon=True).start()
+
+
+def readiness() -> Dict:
+    """
+    Whether shared data is loaded and this process's connections are warm; "ready" is true once both are.
+    Retries a failed metadata preload, and starts the connection warm-up if this process hasn't yet.
+    """
+    if _state["data_error"] is not None:
+        with _lock:
+            if _state["data_error"] is not None:
+                _preload_metadata(resolve_data_dir())
+                if _state["data_error"] is None:
+                    _state["data_ready"] = True
+                    logger.info("METADATA LOADED AFTER A FAILED PRELOAD")
+    if _state["data_ready"]:
+        start_connection_warmup()
+    connections_warm = _state["connections_pid"] == os.getpid()
+    state = {
+        "ready": _state["data_ready"] and connections_warm,
+        "data": _state["data_ready"],
+        "connections": connections_warm,
+    }
+    if _state["data_error"] is not None:
+        state["error"] = _state["data_error"]
+    return state
@@ -1,7 +1,17 @@
+import asyncio
 import logging
-from typing import Optional
+import threading
+from typing import List, Optional
 import json
+from cachetools import TTLCache
 from core.utils import format_timestamp
+from core.streaming import stream_chat_completion, stream_chat_completion_async
+from core.outbound import openai_embedding, pinecone_query, openai_embedding_async, pinecone_query_async
+from core.request_trace import trace_stage
+from core.metrics import inc_counter
+from core.logging_pipeline import log_llm_messages
+from core.data_store import current_data_dir, load_metadata
+from core.transcript_store import load_transcript
 from prompts.farcaster_prompts import get_farcaster_prompt_with_transcript_context
 import os
 # Configure logging
@@ -13,13 +23,78 @@ VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
 if VERBOSE_LOGGING:
     logger.setLevel(logging.DEBUG)  # Show everything including debug when verbose
 
+ERROR_RESPONSE = "Sorry, I couldn't process your request right now."
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Query embeddings created ahead of time (e.g. by the batch replay script) or by recent identical queries
+_query_embedding_cache = TTLCache(maxsize=2048, ttl=3600)
+_query_embedding_lock = threading.Lock()
+
+
+def prime_query_embeddings(openai_client, texts: List[str], batch_size: int = 100) -> int:
+    """
+    Creates embeddings for many query texts with one API call per batch and caches them,
+    so later searches for those texts skip their own embedding request.
+
+    Returns:
+        int: Number of new embeddings created
+    """
+    with _query_embedding_lock:
+        pending = list(dict.fromkeys(t for t in texts if t and t not in _query_embedding_cache))
+
+    created = 0
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        response = openai_embedding(openai_client, model=EMBEDDING_MODEL, input=batch)
+        with _query_embedding_lock:
+            for item in response.data:
+                _query_embedding_cache[batch[item.index]] = item.embedding
+        created += len(batch)
+
+    logger.debug(f"PRIMED {created} QUERY EMBEDDINGS IN {(len(pending) + batch_size - 1) // batch_size} BATCHES")
+    return created
+
+
+def _cached_query_embedding(query_text: str) -> Optional[List[float]]:
+    with _query_embedding_lock:
+        cached = _query_embedding_cache.get(query_text)
+    inc_counter("cache_lookups_total", cache="query_embedding", result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.debug("QUERY EMBEDDING CACHE HIT")
+    return cached
+
+
+def _cache_query_embedding(query_text: str, response) -> List[float]:
+    """Caches the embedding from an embeddings API response for one query and returns it."""
+    embedding = response.data[0].embedding
+    with _query_embedding_lock:
+        _query_embedding_cache[query_text] = embedding
+    return embedding
+
+
+async def get_query_embedding_async(async_openai_client, query_text: str) -> List[float]:
+    """get_query_embedding for an AsyncOpenAI client; shares the same cache."""
+    cached = _cached_query_embedding(query_text)
+    if cached is not None:
+        return cached
+    response = await openai_embedding_async(async_openai_client, model=EMBEDDING_MODEL, input=[query_text])
+    return _cache_query_embedding(query_text, response)
+
+
+def get_query_embedding(openai_client, query_text: str) -> List[float]:
+    """Returns the embedding for a query, from the cache when it was primed or seen recently."""
+    cached = _cached_query_embedding(query_text)
+    if cached is not None:
+        return cached
+    response = openai_embedding(openai_client, model=EMBEDDING_MODEL, input=[query_text])
+    return _cache_query_embedding(query_text, response)
 
 
 class ContextualPath:
     def __init__(self, openai_client):
         self.openai_client = openai_client
-        self.data_dir = os.getenv('DATA_DIR', './data')
+        self.data_dir = current_data_dir()
 
     def handle_query(
         self,
@@ -28,7 +103,8 @@ class ContextualPath:
         conversation_history: str,
         conversation_summary: str,
         pinecone_index,
-        depth: int
+        depth: int,
+        response_cache=None
     ) -> str:
         """
         Handles a query using the contextual path approach with semantic search.
@@ -40,6 +116,7 @@ class ContextualPath:
             conversation_history: Previous conversation context
             pinecone_index: The Pinecone index for semantic search
             depth: The current depth of the conversation
+            response_cache: Optional ResponseCache; only passed in for casts without conversation history
             
         Returns:
             str: The LLM response
@@ -47,59 +124,135 @@ class ContextualPath:
         try:
             # Search pinecone for relevant transcript snippets
             additional_context = self.get_additional_context(pinecone_index, query)
-            return self.get_llm_response(
+
+            # Serve an identical earlier answer if the same question retrieved the same snippets
+            cache_key, cached_response = self._lookup_response(response_cache, query, additional_context, user_name, depth)
+            if cached_response is not None:
+                return cached_response
+
+            llm_response = self.get_llm_response(
                 query, 
                 user_name, 
                 conversation_history, 
                 additional_context, 
                 depth
             )
+
+            self._store_response(response_cache, cache_key, llm_response, user_name)
+            return llm_response
+        except Exception as e:
+            return self._error_reply(e)
+
+    async def handle_query_async(
+        self,
+        query: str,
+        user_name: str,
+        conversation_history: str,
+        conversation_summary: str,
+        pinecone_index,
+        depth: int,
+        response_cache=None
+    ) -> str:
+        """handle_query for the ASGI app; self.openai_client must be an AsyncOpenAI client."""
+        try:
+            additional_context = await self.get_additional_context_async(pinecone_index, query)
+
+            cache_key, cached_response = self._lookup_response(response_cache, query, additional_context, user_name, depth)
+            if cached_response is not None:
+                return cached_response
+
+            llm_response = await self.get_llm_response_async(
+                query,
+                user_name,
+                conversation_history,
+                additional_context,
+                depth
+            )
+
+            self._store_response(response_cache, cache_key, llm_response, user_name)
+            return llm_response
         except Exception as e:
-            logger.error(f"Error in contextual path: {e}")
-            return "Sorry, I couldn't process your request right now."
+            return self._error_reply(e)
+
+    def _error_reply(self, e: Exception) -> str:
+        logger.error(f"Error in contextual path: {e}")
+        inc_counter("errors_total", where="contextual")
+        return ERROR_RESPONSE
+
+    def _lookup_response(self, response_cache, query: str, additional_context: str, user_name: str, depth: int) -> tuple:
+        """(cache key, cached answer or None); (None, None) without a response cache or when retrieval failed."""
+        if response_cache is None or additional_context == ERROR_RESPONSE:
+            return None, None
+        return response_cache.lookup("contextual", query, additional_context, user_name, depth)
+
+    def _store_response(self, response_cache, cache_key, llm_response: str, user_name: str) -> None:
+        if response_cache is not None and llm_response != ERROR_RESPONSE:
+            response_cache.store(cache_key, llm_response, user_name)
 
     def get_llm_response(self, user_query, user_name, conversation_history, additional_context, depth):
         """
         Generates a response using the OpenAI LLM based on user input and context.
         """
         try:         
+            request = self._response_request(user_query, user_name, conversation_history, additional_context, depth)
             
-            #We are no longer going to inject the conversation history into the prompt, it's now an array of messages that we'll pass to the LLM
-            #This is because we're using the OpenAI API's chat completion feature, which allows us to pass in an array of messages.
+            #stream the response so generation stops once the reply no longer fits in a cast
+            llm_response = stream_chat_completion(self.openai_client, **request)
+            logger.debug("GPT RESPONSE RECEIVED...")
 
-            llm_prompt = get_farcaster_prompt_with_transcript_context(
-                additional_context, 
-                user_query, 
-                conversation_history, 
-                user_name, 
-                depth
-            )
-               
-            
-            # Create messages array starting with conversation history            
-            messages = conversation_history.copy()            
-            # Add the system prompt as the final message, changing the role from user to developer (prev. system)
-            messages.append({"role": "developer", "content": llm_prompt})
-            #Instead of injecting the user's query into the developer prompt which we had done earlier, inject it at the end as the user's query.
-            messages.append({"role": "user", "content": user_query})
+            return llm_response        
 
+        except Exception as e:
+            logger.error(f"Error querying LLM API: {e}")
+            return ERROR_RESPONSE
 
-            logger.info("Messages being sent to OpenAI: %s", json.dumps(messages, indent=2))
-            
-            #change model to gpt-4o (april 24, 2025)
-            llm_response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7
-            )
+    async def get_llm_response_async(self, user_query, user_name, conversation_history, additional_context, depth):
+        """get_llm_response for an AsyncOpenAI client."""
+        try:
+            request = self._response_request(user_query, user_name, conversation_history, additional_context, depth)
+            llm_response = await stream_chat_completion_async(self.openai_client, **request)
             logger.debug("GPT RESPONSE RECEIVED...")
 
-            return llm_response.choices[0].message.content        
+            return llm_response
 
         except Exception as e:
             logger.error(f"Error querying LLM API: {e}")
-            return "Sorry, I couldn't process your request right now."
+            return ERROR_RESPONSE
+
+    def _response_request(self, user_query, user_name, conversation_history, additional_context, depth) -> dict:
+        """The chat completion arguments for the answer, the same for both clients."""
+        #change model to gpt-4o (april 24, 2025)
+        return {
+            "route": "contextual",
+            "model": "gpt-4o",
+            "messages": self._build_messages(user_query, user_name, conversation_history, additional_context, depth),
+            "max_tokens": 300,
+            "temperature": 0.7
+        }
+
+    def _build_messages(self, user_query, user_name, conversation_history, additional_context, depth) -> list:
+        #We are no longer going to inject the conversation history into the prompt, it's now an array of messages that we'll pass to the LLM
+        #This is because we're using the OpenAI API's chat completion feature, which allows us to pass in an array of messages.
+
+        llm_prompt = get_farcaster_prompt_with_transcript_context(
+            additional_context, 
+            user_query, 
+            conversation_history, 
+            user_name, 
+            depth
+        )
+           
+        
+        # Put the developer prompt first so its static prefix is shared across requests (OpenAI prompt caching),
+        # followed by the conversation history
+        messages = [{"role": "developer", "content": llm_prompt}]
+        messages.extend(conversation_history)
+        #Instead of injecting the user's query into the developer prompt which we had done earlier, inject it at the end as the user's query.
+        messages.append({"role": "user", "content": user_query})
+
+
+        log_llm_messages(logger, "Messages being sent to OpenAI", messages)
+        return messages
 
     def get_additional_context(self, pinecone_index, user_query):
         """
@@ -107,59 +260,93 @@ class ContextualPath:
         """
         try:
             # Will use semantic search to get small chunks of context from the transcripts that are relevant to the user query
-            matches = self.search_transcripts_for_similar_content(pinecone_index, user_query)
-            
-            rich_contexts = []        
-            for match in matches:
-                           # Skip if no transcript path available
-                if not match['transcript_path']:
-                    logger.warning(f"Skipping match for episode {match['episode']} - no transcript path available")
-                    continue
-
-
-                expanded = self.find_expanded_context(
-                    transcript_path=match['transcript_path'],
-                    search_text=match['text'],
-                    context_sentences=15
+            with trace_stage("retrieval"):
+                matches = self._expandable_matches(self.search_transcripts_for_similar_content(pinecone_index, user_query))
+
+            with trace_stage("expansion"):
+                expansions = [self._expand_match(match) for match in matches]
+
+            return self._join_context_entries(matches, expansions)
+
+        except Exception as e:
+            logger.error(f"Error creating embedding: {e}")
+            return ERROR_RESPONSE
+
+    async def get_additional_context_async(self, pinecone_index, user_query):
+        """
+        get_additional_context for the ASGI app. The matches are expanded concurrently, each on a worker thread,
+        since loading a transcript file is blocking work.
+        """
+        try:
+            with trace_stage("retrieval"):
+                matches = self._expandable_matches(
+                    await self.search_transcripts_for_similar_content_async(pinecone_index, user_query)
                 )
-                
-                if expanded:
-                    # Convert timestamp to seconds and ensure it's an integer
-                    timestamp_seconds = int(expanded['start_time'])
-                    
-                    # Extract base URL and add timestamp
-                    base_url = match['youtube_url'].split('?')[0]  # Remove any existing parameters
-                    youtube_url = f"{base_url}?t={timestamp_seconds}"
-                    
-                    # Fix hosts formatting
-                    hosts = match['hosts']
-                    if isinstance(hosts, list):
-                        hosts_str = ', '.join(hosts)
-                    else:
-                        hosts_str = str(hosts)  # Handle case where hosts is a string
-                    
-                    context_entry = (
-                        f"<episode>\n"
-                        f"  <title>GM Farcaster, {match['episode']}</title>\n"
-                        f"  <metadata>\n"
-                        f"    Aired Date: {match['aired_date']}\n"
-                        f"    Hosts: {hosts_str}\n"
-                        f"    Timestamp: {format_timestamp(expanded['start_time'])}\n"
-                        f"    YouTube: {youtube_url}\n"
-                        f"  </metadata>\n"
-                        f"  <transcript>\n"
-                        f"    {expanded['context']}\n"
-                        f"  </transcript>\n"
-                        f"</episode>\n"
-                    )
-                    rich_contexts.append(context_entry)
-
-            full_context = "\n\n".join(rich_contexts)
-            return full_context
+
+            with trace_stage("expansion"):
+                expansions = await asyncio.gather(*(asyncio.to_thread(self._expand_match, match) for match in matches))
+
+            return self._join_context_entries(matches, expansions)
 
         except Exception as e:
             logger.error(f"Error creating embedding: {e}")
-            return "Sorry, I couldn't process your request right now."
+            return ERROR_RESPONSE
+
+    def _expandable_matches(self, matches: list) -> list:
+        """The matches whose transcript can be loaded to expand the matched snippet."""
+        expandable = []
+        for match in matches:
+            # Skip if no transcript path available
+            if not match['transcript_path']:
+                logger.warning(f"Skipping match for episode {match['episode']} - no transcript path available")
+                continue
+            expandable.append(match)
+        return expandable
+
+    def _expand_match(self, match: dict) -> Optional[dict]:
+        return self.find_expanded_context(
+            transcript_path=match['transcript_path'],
+            search_text=match['text'],
+            context_sentences=15
+        )
+
+    def _join_context_entries(self, matches: list, expansions: list) -> str:
+        rich_contexts = [
+            self._format_context_entry(match, expanded)
+            for match, expanded in zip(matches, expansions)
+            if expanded
+        ]
+        return "\n\n".join(rich_contexts)
+
+    def _format_context_entry(self, match: dict, expanded: dict) -> str:
+        # Convert timestamp to seconds and ensure it's an integer
+        timestamp_seconds = int(expanded['start_time'])
+        
+        # Extract base URL and add timestamp
+        base_url = match['youtube_url'].split('?')[0]  # Remove any existing parameters
+        youtube_url = f"{base_url}?t={timestamp_seconds}"
+        
+        # Fix hosts formatting
+        hosts = match['hosts']
+        if isinstance(hosts, list):
+            hosts_str = ', '.join(hosts)
+        else:
+            hosts_str = str(hosts)  # Handle case where hosts is a string
+        
+        return (
+            f"<episode>\n"
+            f"  <title>GM Farcaster, {match['episode']}</title>\n"
+            f"  <metadata>\n"
+            f"    Aired Date: {match['aired_date']}\n"
+            f"    Hosts: {hosts_str}\n"
+            f"    Timestamp: {format_timestamp(expanded['start_time'])}\n"
+            f"    YouTube: {youtube_url}\n"
+            f"  </metadata>\n"
+            f"  <transcript>\n"
+            f"    {expanded['context']}\n"
+            f"  </transcript>\n"
+            f"</episode>\n"
+        )
 
     def find_expanded_context(self, transcript_path: str, search_text: str, context_sentences: int = 10) -> Optional[dict]:
         """
@@ -181,12 +368,8 @@ class ContextualPath:
             Returns None if no match is found or if there's an error.
         """
         try:
-            # Construct full transcript path using DATA_DIR and transcripts subdirectory
-            full_transcript_path = os.path.join(self.data_dir, 'transcripts', transcript_path)
-            
-            # Load transcript
-            with open(full_transcript_path, 'r') as f:
-                transcript = json.load(f)
+            # Load transcript (the compact version written at ingest, when there is one)
+            transcript = load_transcript(self.data_dir, transcript_path)
                 
             # Get first 10 words from search text for matching
             search_words = search_text.lower().split()[:10]        
@@ -253,57 +436,75 @@ class ContextualPath:
         Returns matches with metadata including transcript file paths from metadata.json.
         """
         try:
-            # Load metadata.json
-            metadata_path = os.path.join(self.data_dir, 'metadata.json')
-            with open(metadata_path, 'r') as f:
-                episodes_metadata = json.load(f)
-            
             logger.debug(f"CREATING EMBEDDING FROM USER QUERY: {query_text[:100]}...")
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=[query_text]
-            )
-            query_embedding = response.data[0].embedding
+            query_embedding = get_query_embedding(self.openai_client, query_text)
             logger.debug(f"EMBEDDING CREATED, LENGTH: {len(query_embedding)}")
             
             logger.debug("QUERYING PINECONE...")
-            search_results = pinecone_index.query(
-                vector=query_embedding,
-                top_k=3,
-                include_metadata=True
-            )        
-
-            logger.debug("PROCESSING MATCHES...")
-            matches = []
-            for match in search_results["matches"]:
-                episode = match.get("metadata", {}).get("episode", "No episode")
-                # Look up transcript path from metadata.json
-                transcript_path = next(
-                    (item["transcript_path"] for item in episodes_metadata if item["episode"] == episode),
-                    None
-                )
-                
-                matches.append({
-                    "text": match.get("metadata", {}).get("transcript", "No text found"),
-                    "score": match.get("score", 0.0),
-                    "title": match.get("metadata", {}).get("title", "No title"),
-                    "episode": episode,
-                    "series": match.get("metadata", {}).get("series", "No series"),
-                    "companion_blog": match.get("metadata", {}).get("companion_blog", "No companion blog"),
-                    "hosts": match.get("metadata", {}).get("hosts", "No hosts"),
-                    "aired_date": match.get("metadata", {}).get("aired_date", "Aired date not available"),
-                    "youtube_url": match.get("metadata", {}).get("youtube_url", "No youtube url"),
-                    "transcript_path": transcript_path
-                })
-            
-            logger.debug("MATCHES FOUND:")
-            for match in matches:
-                logger.debug(f"\nMatch Details:")
-                logger.debug(f"Score: {match['score']}")
-                logger.debug(f"Series: {match['series']}")
-                logger.debug(f"Episode: {match['episode']} - {match['title']}")                                                
-            return matches
+            search_results = pinecone_query(pinecone_index, **self._search_request(query_embedding))
+
+            return self._matches_from_search_results(search_results)
 
         except Exception as e:
             logger.error(f"Error in transcript search: {e}")
             return []
+
+    async def search_transcripts_for_similar_content_async(self, pinecone_index, query_text: str):
+        """search_transcripts_for_similar_content for an AsyncOpenAI client."""
+        try:
+            logger.debug(f"CREATING EMBEDDING FROM USER QUERY: {query_text[:100]}...")
+            query_embedding = await get_query_embedding_async(self.openai_client, query_text)
+
+            logger.debug("QUERYING PINECONE...")
+            search_results = await pinecone_query_async(pinecone_index, **self._search_request(query_embedding))
+
+            # Reads metadata.json, so keep it off the event loop
+            return await asyncio.to_thread(self._matches_from_search_results, search_results)
+
+        except Exception as e:
+            logger.error(f"Error in transcript search: {e}")
+            return []
+
+    def _search_request(self, query_embedding: List[float]) -> dict:
+        """The Pinecone query arguments, the same for both clients."""
+        return {
+            "vector": query_embedding,
+            "top_k": 3,
+            "include_metadata": True
+        }
+
+    def _matches_from_search_results(self, search_results) -> list:
+        """Turns Pinecone matches into dicts, adding each episode's transcript file path from metadata.json."""
+        episodes_metadata = load_metadata(self.data_dir)
+
+        logger.debug("PROCESSING MATCHES...")
+        matches = []
+        for match in search_results["matches"]:
+            episode = match.get("metadata", {}).get("episode", "No episode")
+            # Look up transcript path from metadata.json
+            transcript_path = next(
+                (item["transcript_path"] for item in episodes_metadata if item["episode"] == episode),
+                None
+            )
+            
+            matches.append({
+                "text": match.get("metadata", {}).get("transcript", "No text found"),
+                "score": match.get("score", 0.0),
+                "title": match.get("metadata", {}).get("title", "No title"),
+                "episode": episode,
+                "series": match.get("metadata", {}).get("series", "No series"),
+                "companion_blog": match.get("metadata", {}).get("companion_blog", "No companion blog"),
+                "hosts": match.get("metadata", {}).get("hosts", "No hosts"),
+                "aired_date": match.get("metadata", {}).get("aired_date", "Aired date not available"),
+                "youtube_url": match.get("metadata", {}).get("youtube_url", "No youtube url"),
+                "transcript_path": transcript_path
+            })
+        
+        logger.debug("MATCHES FOUND:")
+        for match in matches:
+            logger.debug(f"\nMatch Details:")
+            logger.debug(f"Score: {match['score']}")
+            logger.debug(f"Series: {match['series']}")
+            logger.debug(f"Episode: {match['episode']} - {match['title']}")                                                
+        return matches
+
@@ -1,9 +1,23 @@
+import asyncio
 import logging
 from typing import Optional, List, Dict
 import json
 import os
-import tiktoken
 from core.utils import format_timestamp
+from core.usage_tracking import record_completion_usage
+from core.streaming import stream_chat_completion, stream_chat_completion_async
+from core.outbound import openai_chat, openai_chat_async
+from core.request_trace import trace_stage
+from core.metrics import inc_counter
+from core.response_cache import EpisodeIdentificationCache
+from core.logging_pipeline import log_llm_messages
+from core.data_store import current_data_dir, load_metadata
+from core.name_matcher import NAME_VARIATIONS, QueryMentions, get_name_matcher
+from core.metadata_serializer import serialize_metadata, IDENTIFICATION_COLUMNS
+from core.metadata_query import MetadataIndex, get_metadata_index
+from core.episode_resolver import resolve_episode
+from core.transcript_store import load_transcript
+from core.episode_summaries import is_summary_query, load_episode_summary, format_summary_context
 from prompts.hybrid_prompts import EPISODE_IDENTIFICATION_PROMPT
 from prompts.hybrid_prompts import get_farcaster_prompt_with_full_transcript_context
 
@@ -17,6 +31,18 @@ VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
 if VERBOSE_LOGGING:
     logger.setLevel(logging.DEBUG)
 
+ERROR_RESPONSE = "I apologize, but I encountered an error while processing your request. Please try again."
+
+# Episodes resolved from the metadata with at least this confidence skip the identification LLM call
+EPISODE_RESOLVER_MIN_CONFIDENCE = float(os.getenv("EPISODE_RESOLVER_MIN_CONFIDENCE", "0.8"))
+
+# Episodes identified per query, shared by every HybridPath in the process (many users ask about the same episode)
+EPISODE_CACHE_ENABLED = os.getenv("EPISODE_CACHE_ENABLED", "true").lower() == "true"
+episode_cache = EpisodeIdentificationCache(
+    maxsize=int(os.getenv("EPISODE_CACHE_MAXSIZE", "1000")),
+    ttl=int(os.getenv("EPISODE_CACHE_TTL_SECONDS", "3600"))
+)
+
 class HybridPath:
     def __init__(self, openai_client):
         """
@@ -26,25 +52,17 @@ class HybridPath:
             openai_client: OpenAI client instance for API calls
         """
         self.openai_client = openai_client
-        self.data_dir = os.getenv('DATA_DIR', './data')
+        self.data_dir = current_data_dir()
         self.metadata = self._load_metadata()
         
         # Define name mappings as a class attribute
-        # TODO: Move this to a separate file and load it from there, because it's used in metadata path as well. 
-        self.name_variations = {
-            'dwr.eth': {'dan', 'dwr', 'dwr.eth', 'dan romero'},
-            'heavygweit': {'erica', 'heavygweit'},
-            'v': {'varun', 'v'},
-            'afrochicks': {'afrochicks', 'naomi'},            
-            'naomi': {'naomiii', 'naomi'},
-            'proxystudio.eth': {'proxy', 'proxystudio', 'proxy studio', 'proxystudio.eth'},
-            'ccarella': {'chris carella', 'ccarella'},
-            'meonbase': {'meonbase', 'ceej'},
-            'esteez.eth': {'esteez', 'emma'},
-            'vpabundance': {'james', 'vpabundance'},
-            's-mok-e': {'s-mok-e', 'smoke'},
-            'fredwilson.eth': {'fred wilson', 'fred'},
-        }
+        self.name_variations = NAME_VARIATIONS
+        self.name_matcher = get_name_matcher(self.data_dir)
+        try:
+            self.metadata_index = get_metadata_index(self.data_dir, load_metadata(self.data_dir))
+        except Exception as e:
+            logger.error(f"Error indexing metadata: {e}")
+            self.metadata_index = MetadataIndex([])
         
     def _load_metadata(self) -> List[Dict]:
         """
@@ -57,10 +75,8 @@ class HybridPath:
         try:
             logger.debug("Starting metadata loading process...")
             
-            metadata_path = os.path.join(self.data_dir, 'metadata.json')
-            with open(metadata_path, 'r') as f:
-                raw_metadata = json.load(f)
-                logger.debug(f"Successfully loaded raw metadata with {len(raw_metadata)} episodes")
+            raw_metadata = load_metadata(self.data_dir)
+            logger.debug(f"Successfully loaded raw metadata with {len(raw_metadata)} episodes")
                 
             
             # Fields to keep for episode identification
@@ -99,6 +115,8 @@ class HybridPath:
 
     def _check_token_count(self, data: str) -> int:
         """Check token count of data"""
+        # Imported here so tiktoken is only loaded once something is counted
+        import tiktoken
         enc = tiktoken.encoding_for_model("gpt-4")
         return len(enc.encode(data))
 
@@ -108,7 +126,8 @@ class HybridPath:
         user_name: str,
         conversation_history: str,
         conversation_summary: str,
-        depth: int
+        depth: int,
+        response_cache=None
     ) -> str:
         """
         Main handler for hybrid path queries. This method will:
@@ -122,37 +141,159 @@ class HybridPath:
             conversation_history: Previous conversation context
             conversation_summary: Summary of the conversation
             depth: The current depth of the conversation
+            response_cache: Optional ResponseCache; only passed in for casts without conversation history
             
         Returns:
             str: The LLM response
         """
         try:
+            # Identify the most relevant episode from the query (from the cache, the metadata or the LLM)
+            with trace_stage("episode_identification"):
+                relevant_episodes = self._identify_relevant_episodes(query=query)
 
-            # Identify the most relevant episode from the query by using the LLM
-            relevant_episodes = self._identify_relevant_episodes(query=query)
-            
-            # Get the full transcript for the identified episode(s)
-            transcript_context = self._get_transcript_context(relevant_episodes)
-            
-            # Log transcript context length and token count            
-            token_count = self._check_token_count(transcript_context)
-            logger.debug(f"Transcript context token count: {token_count} | length: {len(transcript_context)}")
-            
-            
-            return self._generate_llm_response(
+            context, context_label = self._get_context(query, relevant_episodes)
+            return self._cached_llm_response(
+                response_cache,
                 query,
                 user_name,
                 conversation_history,
-                transcript_context,
+                context,
                 depth,
-                name_mappings=""
+                context_label=context_label
             )
-            
+
+        except Exception as e:
+            return self._error_reply(e, user_name)
+
+    async def handle_query_async(
+        self,
+        query: str,
+        user_name: str,
+        conversation_history: str,
+        conversation_summary: str,
+        depth: int,
+        response_cache=None
+    ) -> str:
+        """
+        handle_query for the ASGI app; self.openai_client must be an AsyncOpenAI client.
+        Summaries and transcripts are read from disk on a worker thread so the event loop keeps serving other casts.
+        """
+        try:
+            with trace_stage("episode_identification"):
+                relevant_episodes = await self._identify_relevant_episodes_async(query=query)
+
+            context, context_label = await asyncio.to_thread(self._get_context, query, relevant_episodes)
+            return await self._cached_llm_response_async(
+                response_cache,
+                query,
+                user_name,
+                conversation_history,
+                context,
+                depth,
+                context_label=context_label
+            )
+
         except Exception as e:
-            logger.error(f"Error in hybrid path: {e}")
-            return f"Sorry @{user_name}, I encountered an error processing your query."
+            return self._error_reply(e, user_name)
+
+    def _error_reply(self, e: Exception, user_name: str) -> str:
+        logger.error(f"Error in hybrid path: {e}")
+        inc_counter("errors_total", where="hybrid")
+        return f"Sorry @{user_name}, I encountered an error processing your query."
+
+    def _get_context(self, query: str, episodes: List[str]) -> tuple[str, str]:
+        """
+        Returns the context to answer from and its heading in the prompt. Summary-type questions ("what did I miss
+        on Monday's show?") are answered from the precomputed episode summary instead of re-sending the full
+        transcript, when there is one.
+        """
+        if is_summary_query(query):
+            summary_context = self._get_summary_context(episodes)
+            if summary_context:
+                logger.info("SUMMARY QUERY DETECTED. USING PRECOMPUTED EPISODE SUMMARY AS CONTEXT...")
+                return summary_context, "Episode Summary and Outline"
+
+        # Get the full transcript for the identified episode(s)
+        with trace_stage("retrieval"):
+            transcript_context = self._get_transcript_context(episodes)
+
+        # Log transcript context length and token count (tokenizing a full transcript is only worth it when debugging)
+        if logger.isEnabledFor(logging.DEBUG):
+            token_count = self._check_token_count(transcript_context)
+            logger.debug(f"Transcript context token count: {token_count} | length: {len(transcript_context)}")
+
+        return transcript_context, "Full Episode Transcript"
 
-    def _prefilter_metadata(self, query: str) -> tuple[List[Dict], List[str]]:
+    def _cached_llm_response(
+        self,
+        response_cache,
+        query: str,
+        user_name: str,
+        conversation_history: str,
+        context: str,
+        depth: int,
+        context_label: str = "Full Episode Transcript"
+    ) -> str:
+        """
+        Wraps _generate_llm_response with the exact-match response cache.
+        Identical questions resolved to the same episode context reuse the earlier answer.
+        """
+        cache_key, cached_response = self._lookup_response(response_cache, query, context, user_name, depth)
+        if cached_response is not None:
+            return cached_response
+
+        llm_response = self._generate_llm_response(
+            query,
+            user_name,
+            conversation_history,
+            context,
+            depth,
+            name_mappings="",
+            context_label=context_label
+        )
+
+        self._store_response(response_cache, cache_key, llm_response, user_name)
+        return llm_response
+
+    async def _cached_llm_response_async(
+        self,
+        response_cache,
+        query: str,
+        user_name: str,
+        conversation_history: str,
+        context: str,
+        depth: int,
+        context_label: str = "Full Episode Transcript"
+    ) -> str:
+        """_cached_llm_response around _generate_llm_response_async."""
+        cache_key, cached_response = self._lookup_response(response_cache, query, context, user_name, depth)
+        if cached_response is not None:
+            return cached_response
+
+        llm_response = await self._generate_llm_response_async(
+            query,
+            user_name,
+            conversation_history,
+            context,
+            depth,
+            name_mappings="",
+            context_label=context_label
+        )
+
+        self._store_response(response_cache, cache_key, llm_response, user_name)
+        return llm_response
+
+    def _lookup_response(self, response_cache, query: str, context: str, user_name: str, depth: int) -> tuple:
+        """(cache key, cached answer or None); (None, None) without a response cache."""
+        if response_cache is None:
+            return None, None
+        return response_cache.lookup("hybrid", query, context, user_name, depth)
+
+    def _store_response(self, response_cache, cache_key, llm_response: str, user_name: str) -> None:
+        if response_cache is not None and llm_response != ERROR_RESPONSE:
+            response_cache.store(cache_key, llm_response, user_name)
+
+    def _prefilter_metadata(self, query: str, mentions: Optional[QueryMentions] = None) -> tuple[List[Dict], List[str]]:
         """
         Pre-filters metadata based on query content using advanced matching logic.
         
@@ -162,143 +303,67 @@ class HybridPath:
         Returns:
             tuple[List[Dict], List[str]]: Tuple containing filtered metadata and mentioned hosts
         """
-        # Convert query to lowercase for easier matching
-        query = query.lower()
-        # Split query into words and remove punctuation for exact word matching
-        # this way if someone mentions @heavygweit, or ends a sentence with heavygweit? it will still match
-        query_words = set(word.strip('.,?!/@') for word in query.split())
-        
+        # Find every host, series and title word mentioned in the query in one pass over it, unless the caller did
+        # (words are stripped of punctuation, so @heavygweit, or a sentence ending in heavygweit?, still matches)
+        if mentions is None:
+            mentions = self.name_matcher.find(query)
+
         # Start with empty filtered set
         filtered_metadata = []
-        mentioned_hosts = []
+        mentioned_hosts = mentions.hosts  # We'll return this along with filtered metadata
 
         """
         FIRST FILTER STEP:
         If any host that has been on our show is mentioned in the query, get all those episodes to return
         """
-        # Flatten name variations for lookup
-        name_lookup = {}
-        for metadata_name, variations in self.name_variations.items():
-            for variant in variations:
-                name_lookup[variant.lower()] = metadata_name
-        
-        # Get all unique hosts from metadata for names not in our variations
-        all_hosts = set()
-        for episode in self.metadata:
-            all_hosts.update(host.lower() for host in episode.get('hosts', []))
-        
-        # First, check if any variations appear in the query
-        for variant in name_lookup:
-            if variant in query_words:
-                metadata_name = name_lookup[variant]
-                if metadata_name not in mentioned_hosts:
-                    mentioned_hosts.append(metadata_name)
-        
-        # Then check actual host names from metadata
-        for host in all_hosts:
-            if host.lower() in query_words:
-                if host not in mentioned_hosts:
-                    mentioned_hosts.append(host)
-        
-        # If hosts are mentioned, add those episodes
         if mentioned_hosts:
+            host_set = set(mentioned_hosts)
             host_episodes = [
                 episode for episode in self.metadata
-                if any(host.lower() in [h.lower() for h in episode.get('hosts', [])]
-                      for host in mentioned_hosts)
+                if any(host.lower() in host_set for host in episode.get('hosts', []))
             ]
             filtered_metadata.extend(host_episodes)
             logger.debug(f"Step 1 (Hosts): Added {len(host_episodes)} episodes for hosts {mentioned_hosts}")
         else:
             logger.debug("Step 1 (Hosts): No host matches found")
-        
+
         """
         SECOND FILTER STEP:
         If any known series is mentioned in the query, add those episodes to our filtered set
         """
-        series_variations = {
-            'Special Event': {'special event', 'special'},
-            'GM Farcaster': {'gmfarcaster', 'gm farcaster'},
-            'Vibe Check': {'vibe check', 'vibecheck'},
-            'The Hub': {'hub', 'the hub'},
-            'Here for the Art': {'here for the art'},
-            'Farcaster 101': {'farcaster 101'},
-        }
-        
         # Create a set of episodes we already have from host filtering
         filtered_episode_ids = {episode.get('episode') for episode in filtered_metadata}
-        
-        series_count = 0
-        # Check for series mentions using the same word-based approach
-        found_series = False
-        for series_name, variations in series_variations.items():
-            # Split multi-word variations into a set of possible matches
-            all_variations = set()
-            for variant in variations:
-                all_variations.add(variant)
-                all_variations.add(variant.replace(' ', ''))
-            
-            if any(variant in query_words or variant in query.lower() for variant in all_variations):
-                found_series = True
-                series_episodes = [
-                    episode for episode in self.metadata
-                    if episode.get('series') == series_name
-                    and episode.get('episode') not in filtered_episode_ids
-                ]
-                filtered_metadata.extend(series_episodes)
-                series_count += len(series_episodes)
-        
+
+        found_series = bool(mentions.series)
         if found_series:
-            logger.debug(f"Step 2 (Series): Added {series_count} new episodes")
+            series_set = set(mentions.series)
+            series_episodes = [
+                episode for episode in self.metadata
+                if episode.get('series') in series_set
+                and episode.get('episode') not in filtered_episode_ids
+            ]
+            filtered_metadata.extend(series_episodes)
+            logger.debug(f"Step 2 (Series): Added {len(series_episodes)} new episodes for series {mentions.series}")
         else:
             logger.debug("Step 2 (Series): No series matches found")
-        
+
         """
         THIRD FILTER STEP:
         If any words from the query appear in episode titles, add those episodes to our filtered set
         """
-      
         # Create a set of episodes we already have from previous filtering
         filtered_episode_ids = {episode.get('episode') for episode in filtered_metadata}
-        
-        # Get all words from titles for matching
-        title_words = set()
-        for episode in self.metadata:
-            if episode.get('title'):
-                # Split title into words and remove punctuation
-                words = {word.strip('.,?!/').lower() for word in episode.get('title').split()}
-                title_words.update(words)
-        
-        # Remove common words that we don't want to match on
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is',
-                     'episode', 'farcaster', 'first', 'last', 'next', 'previous', 'guest', 'guests', 'what', 'you', 
-                     'your', 'yours', 'this', 'that', 'there', 'here', 'where', 'when', 'how', 'why', 'all', 'any', 'some', 
-                     'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'}
-        title_words = title_words - stop_words
-        
-        # Check for matches between query words and title words
-        matching_titles = []
-        found_title_match = False  # Initialize the flag
-
-        matching_words = []  # Track words that matched
-        for word in query_words:
-            if word in title_words and word not in stop_words:
-                matching_words.append(word)
-                # Find all episodes with this word in the title
-                title_episodes = [
-                    episode for episode in self.metadata
-                    if episode.get('title') 
-                    and word in {w.strip('.,?!/').lower() for w in episode.get('title').split()}
-                    and episode.get('episode') not in filtered_episode_ids
-                ]
-                matching_titles.extend(title_episodes)
-                filtered_episode_ids.update(episode.get('episode') for episode in title_episodes)
-                found_title_match = True  # Set the flag if we found matches
-        
+
+        found_title_match = bool(mentions.title_words)
+        title_episode_ids = set().union(
+            *(self.name_matcher.title_episode_ids[word] for word in mentions.title_words)
+        ) - filtered_episode_ids
+        matching_titles = [episode for episode in self.metadata if episode.get('episode') in title_episode_ids]
+
         if matching_titles:
             filtered_metadata.extend(matching_titles)
             logger.debug(f"Step 3 (Titles): Added {len(matching_titles)} new episodes")
-            logger.debug(f"Step 3 (Titles): Words that matched titles: {', '.join(matching_words)}")
+            logger.debug(f"Step 3 (Titles): Words that matched titles: {', '.join(mentions.title_words)}")
         else:
             logger.debug("Step 3 (Titles): No title matches found")
 
@@ -308,7 +373,8 @@ class HybridPath:
         
         # If no matches at all, return all metadata
         if not mentioned_hosts and not found_series and not found_title_match:
-            filtered_metadata = self.metadata
+            # A copy, since the list is sorted below
+            filtered_metadata = list(self.metadata)
             logger.debug("No matches found in any step - returning all metadata")
         
         # Final manipulation on the filtered metadata to be returned 
@@ -320,7 +386,8 @@ class HybridPath:
 
     def _identify_relevant_episodes(self, query: str) -> List[str]:
         """
-        Uses an LLM to identify the episode which is most relevant to the user's query.
+        Uses an LLM to identify the episode which is most relevant to the user's query,
+        unless the episode is cached or can be resolved from the metadata.
         
         Args:
             query: The user's query text
@@ -328,89 +395,177 @@ class HybridPath:
         Returns:
             List[str]: List of relevant episode IDs
         """
+        # Find the hosts and series mentioned in the query once, for both the local resolver and the prompt
+        mentions = self.name_matcher.find(query)
+        cache_key, episode_ids = self._known_episodes(query, mentions)
+        if episode_ids is not None:
+            return episode_ids
         try:
+            logger.debug("Sending request to OpenAI API...")
+            response = openai_chat(self.openai_client, **self._identification_request(query, mentions))
+            return self._episodes_from_response(cache_key, response)
+
+        except Exception as e:
+            logger.error(f"Error in episode identification: {e}")
+            return []
+
+    async def _identify_relevant_episodes_async(self, query: str) -> List[str]:
+        """_identify_relevant_episodes for an AsyncOpenAI client."""
+        mentions = self.name_matcher.find(query)
+        cache_key, episode_ids = self._known_episodes(query, mentions)
+        if episode_ids is not None:
+            return episode_ids
+        try:
+            logger.debug("Sending request to OpenAI API...")
+            response = await openai_chat_async(self.openai_client, **self._identification_request(query, mentions))
+            return self._episodes_from_response(cache_key, response)
+
+        except Exception as e:
+            logger.error(f"Error in episode identification: {e}")
+            return []
+
+    def _known_episodes(self, query: str, mentions: QueryMentions) -> tuple[Optional[str], Optional[List[str]]]:
+        """
+        The episodes for a query that don't need the LLM: cached ones, or ones resolved from the metadata
+        (which are cached in turn).
+        
+        Returns:
+            tuple: (episode cache key; episode IDs, or None if the LLM has to identify them)
+        """
+        cache_key, episode_ids = self._cached_episodes(query)
+        if episode_ids is None:
+            episode_ids = self._resolve_locally(query, mentions) or None
+            if episode_ids:
+                self._cache_episodes(cache_key, episode_ids)
+        return cache_key, episode_ids
+
+    def _episodes_from_response(self, cache_key: Optional[str], response) -> List[str]:
+        """Records the identification call's token usage, then parses and caches the episode IDs it returned."""
+        record_completion_usage("hybrid_identification", response.usage)
+        episode_ids = self._parse_identification_response(response.choices[0].message.content)
+        self._cache_episodes(cache_key, episode_ids)
+        return episode_ids
+
+    def _cached_episodes(self, query: str) -> tuple[Optional[str], Optional[List[str]]]:
+        """
+        Looks the query up in the episode identification cache.
+        
+        Returns:
+            tuple: (cache key, or None if the cache is disabled; cached episode IDs, or None on a miss)
+        """
+        if not EPISODE_CACHE_ENABLED:
+            return None, None
+        try:
+            cache_key = episode_cache.make_key(query, self.data_dir)
+        except Exception as e:
+            logger.error(f"Error building episode cache key: {e}")
+            return None, None
+        return cache_key, episode_cache.lookup(cache_key)
+
+    def _cache_episodes(self, cache_key: Optional[str], episode_ids: List[str]) -> None:
+        if cache_key is not None:
+            episode_cache.store(cache_key, episode_ids)
+
+    def _resolve_locally(self, query: str, mentions: QueryMentions) -> List[str]:
+        """
+        Resolves episode numbers, dates, weekdays, hosts and series in the query against the metadata index.
+        
+        Returns:
+            List[str]: The episode IDs, or [] if the query is ambiguous and the LLM should decide
+        """
+        try:
+            resolution = resolve_episode(self.metadata_index, query, mentions.hosts, mentions.series)
+        except Exception as e:
+            logger.error(f"Error resolving episode locally: {e}")
+            resolution = None
+        if resolution is None or resolution.confidence < EPISODE_RESOLVER_MIN_CONFIDENCE:
+            if resolution is not None:
+                logger.debug(f"EPISODE RESOLVER AMBIGUOUS: {resolution}")
+            inc_counter("episode_resolutions_total", source="llm")
+            return []
+        logger.info(f"EPISODE RESOLVED LOCALLY: {resolution.episode_ids} ({resolution.reason})")
+        inc_counter("episode_resolutions_total", source="local")
+        return resolution.episode_ids
+
+    def _identification_request(self, query: str, mentions: QueryMentions) -> Dict:
+        """
+        Prefilters the metadata for the query and builds the episode identification request.
+        
+        Returns:
+            Dict: The chat completion arguments (model, prompt and temperature), the same for both clients
+        """
+        # First, pre-filter the metadata based on the query and get the mentioned hosts
+        filtered_metadata, _ = self._prefilter_metadata(query, mentions)
+        logger.debug(f"Pre-filtered metadata contains {len(filtered_metadata)} episodes")
+                    
+        
+        metadata_context = serialize_metadata(filtered_metadata, IDENTIFICATION_COLUMNS)
+        
+        name_mappings = self._generate_name_mapping_string(mentions)
+        
+        # Check token count            
+        token_count = self._check_token_count(metadata_context)
+        logger.debug(f"METADATA TOKEN COUNT: {token_count}")
+        
+        # Select model based on token count
+        if token_count < 7000:  # Leave room for the rest of the prompt
+            model = "gpt-4"
+            logger.debug("GPT MODEL SELECTED: GPT-4 base for better accuracy")
+        else:
+            model = "gpt-4-turbo"
+            logger.debug("GPT MODEL SELECTED: GPT-4 Turbo due to large context size")
+        
+                   
+        try:
+            prompt = EPISODE_IDENTIFICATION_PROMPT.format(
+                query=query,
+                metadata=metadata_context,
+                name_mappings=name_mappings
+            )
+                           
+            log_llm_messages(logger, "EPISODE IDENTIFICATION PROMPT", [{"role": "system", "content": prompt}])
+        except Exception as e:
+            logger.error(f"Error formatting prompt: {e}")
             
-             # First, pre-filter the metadata based on the query and get the mentioned hosts
-            filtered_metadata, mentioned_hosts = self._prefilter_metadata(query)
-            logger.debug(f"Pre-filtered metadata contains {len(filtered_metadata)} episodes")
-                        
-            
-            metadata_context = json.dumps(filtered_metadata)           
-            
-            name_mappings = self._generate_name_mapping_string(query, mentioned_hosts)
+            raise
+
+        return {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": prompt}
+            ],
+            "temperature": 0
+        }
+
+    def _parse_identification_response(self, response_content: str) -> List[str]:
+        """Parses the episode IDs out of the identification LLM's JSON response; [] if it is malformed."""
+        # Get the raw response content
+        response_content = response_content.strip()
+        logger.debug("LLM RESPONSE: %s", response_content)
+        
+        # Parse the response
+        try:
             
-            # Check token count            
-            token_count = self._check_token_count(metadata_context)
-            logger.debug(f"METADATA TOKEN COUNT: {token_count}")
+            response_dict = json.loads(response_content)
             
-            # Select model based on token count
-            if token_count < 7000:  # Leave room for the rest of the prompt
-                model = "gpt-4"
-                logger.debug("GPT MODEL SELECTED: GPT-4 base for better accuracy")
-            else:
-                model = "gpt-4-turbo"
-                logger.debug("GPT MODEL SELECTED: GPT-4 Turbo due to large context size")
             
-                       
-            try:
-                prompt = EPISODE_IDENTIFICATION_PROMPT.format(
-                    query=query,
-                    metadata=metadata_context,
-                    name_mappings=name_mappings
-                )
-                               
-                logger.info(f"EPISODE IDENTIFICATION PROMPT: {prompt}")
-            except Exception as e:
-                logger.error(f"Error formatting prompt: {e}")
+            if not isinstance(response_dict, dict):
+                logger.error(f"Response is not a dictionary: {response_dict}")
+                return []
                 
-                raise
+            episode_ids = response_dict.get('episode_ids', [])
+            logger.debug(f"EXTRACTED EPISODE IDS: {episode_ids}")
             
-            # Get LLM response
-            logger.debug("Sending request to OpenAI API...")
-            try:
-                response = self.openai_client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": prompt}
-                    ],
-                    temperature=0
-                )
+            if not isinstance(episode_ids, list):
+                logger.error(f"episode_ids is not a list: {episode_ids}")
+                return []
                 
-            except Exception as e:
-                logger.error(f"Error calling OpenAI API: {e}")
-                raise
             
-            # Get the raw response content
-            response_content = response.choices[0].message.content.strip()
-            logger.debug(f"LLM RESPONSE: {response_content}")
+            return episode_ids
             
-            # Parse the response
-            try:
-                
-                response_dict = json.loads(response_content)
-                
-                
-                if not isinstance(response_dict, dict):
-                    logger.error(f"Response is not a dictionary: {response_dict}")
-                    return []
-                    
-                episode_ids = response_dict.get('episode_ids', [])
-                logger.debug(f"EXTRACTED EPISODE IDS: {episode_ids}")
-                
-                if not isinstance(episode_ids, list):
-                    logger.error(f"episode_ids is not a list: {episode_ids}")
-                    return []
-                    
-                
-                return episode_ids
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing LLM response as JSON: {e}")
-                logger.error(f"Response content: {response_content}")
-                return []
-                
-        except Exception as e:
-            logger.error(f"Error in episode identification: {e}")            
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing LLM response as JSON: {e}")
+            logger.error(f"Response content: {response_content}")
             return []
         
 
@@ -435,17 +590,8 @@ class HybridPath:
             episode_id = episodes[0]
             logger.debug(f"Getting transcript for episode {episode_id}")
 
-            # Load metadata to find transcript path
-            metadata_path = os.path.join(self.data_dir, 'metadata.json')
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-
             # Find matching episode metadata
-            episode_metadata = None
-            for ep in metadata:
-                if ep.get('episode') == episode_id:
-                    episode_metadata = ep
-                    break
+            episode_metadata = self._find_episode_metadata(episode_id)
 
             if not episode_metadata:
                 logger.error(f"Could not find metadata for episode {episode_id}")
@@ -457,12 +603,8 @@ class HybridPath:
                 logger.error(f"No transcript path found for episode {episode_id}")
                 return ""
 
-            # Construct full transcript path using DATA_DIR and transcripts subdirectory
-            full_transcript_path = os.path.join(self.data_dir, 'transcripts', transcript_path)
-
-            # Load transcript
-            with open(full_transcript_path, 'r') as f:
-                transcript_data = json.load(f)
+            # Load transcript (the compact version written at ingest, when there is one)
+            transcript_data = load_transcript(self.data_dir, transcript_path)
 
             # Extract transcript text from the new structure
             try:
@@ -494,6 +636,45 @@ class HybridPath:
         except Exception as e:
             logger.error(f"Error getting transcript context: {e}")
             return ""
+
+    def _find_episode_metadata(self, episode_id: str) -> Optional[Dict]:
+        """
+        Looks up the full metadata record (including transcript_path and youtube_url) for an episode ID.
+        """
+        for ep in load_metadata(self.data_dir):
+            if ep.get('episode') == episode_id:
+                return ep
+        return None
+
+    def _get_summary_context(self, episodes: List[str]) -> str:
+        """
+        Retrieves the precomputed summary and timestamped outline for the first identified episode.
+        Summaries are generated offline by scripts/build_episode_summaries.py.
+        
+        Args:
+            episodes: List of episode IDs, example: ['ep212', 'ep189', 'ep38']
+            
+        Returns:
+            str: Formatted summary context, or an empty string if no up to date summary is available
+        """
+        try:
+            if not episodes:
+                return ""
+
+            episode_metadata = self._find_episode_metadata(episodes[0])
+            if not episode_metadata or not episode_metadata.get('transcript_path'):
+                return ""
+
+            summary = load_episode_summary(self.data_dir, episode_metadata['transcript_path'])
+            if not summary:
+                logger.debug(f"No precomputed summary available for episode {episodes[0]}")
+                return ""
+
+            return format_summary_context(episode_metadata, summary)
+
+        except Exception as e:
+            logger.error(f"Error getting summary context: {e}")
+            return ""
         
 
 
@@ -505,7 +686,8 @@ class HybridPath:
         conversation_history: str,
         transcript_context: str,
         depth: int,
-        name_mappings: str
+        name_mappings: str,
+        context_label: str = "Full Episode Transcript"
     ) -> str:
         """
         Generates a response using the OpenAI LLM based on the transcript context.
@@ -516,69 +698,117 @@ class HybridPath:
             conversation_history: Previous conversation context
             transcript_context: Processed transcript context
             depth: The current depth of the conversation
+            context_label: Heading used for the context section of the prompt
             
         Returns:
             str: The LLM response
         """
         try:
-                       
-
-            # Get prompt from hybrid_prompts.py
-            llm_prompt = get_farcaster_prompt_with_full_transcript_context(
-                full_transcript_context=transcript_context,
-                query=query,
-                name=user_name,
-                depth=depth,
-                name_mappings=name_mappings
-            )
-            logger.debug("Generated prompt for LLM")
-
-
-            # Create messages array starting with conversation history  
-            messages = conversation_history.copy()
-            #messages = []
-            # Add the system prompt as the final message, changing the role from user to developer (prev. system)
-            messages.append({"role": "developer", "content": llm_prompt})
-            #add user's query as the final message
-            messages.append({"role": "user", "content": query})
-
-            logger.info("MESSAGES BEING SENT TO LLM: %s", json.dumps(messages, indent=2))
-
-            # Call OpenAI API
-            #change model to gpt-4o and max tokens to 300 (april 24, 2025)
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=300
+            request = self._response_request(
+                query, user_name, conversation_history, transcript_context, depth, name_mappings, context_label
             )
+            #stream the response so generation stops once the reply no longer fits in a cast
+            response_text = stream_chat_completion(self.openai_client, **request)
             logger.debug("Received response from OpenAI API")
+            logger.debug("LLM RESPONSE: %s", response_text)
 
-            # Extract response text
-            response_text = response.choices[0].message.content.strip()
-            logger.debug(f"LLM RESPONSE: {response_text}")
+            return response_text
+
+        except Exception as e:
+            logger.error(f"Error generating LLM response: {e}")
+            return ERROR_RESPONSE
+
+    async def _generate_llm_response_async(
+        self,
+        query: str,
+        user_name: str,
+        conversation_history: str,
+        transcript_context: str,
+        depth: int,
+        name_mappings: str,
+        context_label: str = "Full Episode Transcript"
+    ) -> str:
+        """_generate_llm_response for an AsyncOpenAI client."""
+        try:
+            request = self._response_request(
+                query, user_name, conversation_history, transcript_context, depth, name_mappings, context_label
+            )
+            response_text = await stream_chat_completion_async(self.openai_client, **request)
+            logger.debug("LLM RESPONSE: %s", response_text)
 
             return response_text
 
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
-            return "I apologize, but I encountered an error while processing your request. Please try again."
+            return ERROR_RESPONSE
 
-    def _generate_name_mapping_string(self, query: str, mentioned_hosts: List[str]) -> str:
+    def _response_request(
+        self,
+        query: str,
+        user_name: str,
+        conversation_history,
+        transcript_context: str,
+        depth: int,
+        name_mappings: str,
+        context_label: str
+    ) -> Dict:
+        """The chat completion arguments for the answer, the same for both clients."""
+        #change model to gpt-4o and max tokens to 300 (april 24, 2025)
+        return {
+            "route": "hybrid",
+            "model": "gpt-4o",
+            "messages": self._build_messages(
+                query, user_name, conversation_history, transcript_context, depth, name_mappings, context_label
+            ),
+            "temperature": 0.7,
+            "max_tokens": 300
+        }
+
+    def _build_messages(
+        self,
+        query: str,
+        user_name: str,
+        conversation_history,
+        transcript_context: str,
+        depth: int,
+        name_mappings: str,
+        context_label: str
+    ) -> list:
+        # Get prompt from hybrid_prompts.py
+        llm_prompt = get_farcaster_prompt_with_full_transcript_context(
+            full_transcript_context=transcript_context,
+            query=query,
+            name=user_name,
+            depth=depth,
+            name_mappings=name_mappings,
+            context_label=context_label
+        )
+        logger.debug("Generated prompt for LLM")
+
+
+        # Put the developer prompt first so its static prefix and the transcript are shared across requests
+        # (OpenAI prompt caching), followed by the conversation history
+        messages = [{"role": "developer", "content": llm_prompt}]
+        messages.extend(conversation_history)
+        #add user's query as the final message
+        messages.append({"role": "user", "content": query})
+
+        log_llm_messages(logger, "MESSAGES BEING SENT TO LLM", messages)
+        return messages
+
+    def _generate_name_mapping_string(self, mentions: QueryMentions) -> str:
         """Generate a string explaining name mappings for the LLM"""
-        if not mentioned_hosts:
+        if not mentions.hosts:
             return ""
         
-        query_words = set(word.strip('.,?!/@').lower() for word in query.split())
+        # The words the user actually wrote for each host
+        variants = mentions.variants
         mappings = []
         
-        for canonical_name in mentioned_hosts:
+        for canonical_name in mentions.hosts:
             # Only process hosts that are in our name_variations dictionary
-            if canonical_name in self.name_variations:
-                for variant in self.name_variations[canonical_name]:
-                    if variant.lower() in query_words:
-                        mappings.append(f"{canonical_name}={variant}")
-                        break
+            if canonical_name in self.name_variations and canonical_name in variants:
+                mappings.append(f"{canonical_name}={variants[canonical_name]}")
         
         if mappings:
             return "Please note the following name mappings: " + ", ".join(mappings)
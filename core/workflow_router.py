@@ -1,16 +1,19 @@
 from typing import Literal, Dict
 from core.workflow_metadatapath import MetadataPath
-import json
 import logging
-from core.utils import get_required_env_var
+import os
 from prompts.workflow_prompts import ROUTING_PROMPT
+from core.usage_tracking import record_completion_usage
+from core.outbound import openai_chat, openai_chat_async
+from core.rate_limiter import PRIORITY_NEW
+from core.logging_pipeline import log_llm_messages
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Set logging level based on environment variable
-VERBOSE_LOGGING = get_required_env_var("VERBOSE_LOGGING").lower() == 'true'
+VERBOSE_LOGGING = os.getenv('VERBOSE_LOGGING', 'false').lower() == 'true'
 if VERBOSE_LOGGING:
     logger.setLevel(logging.DEBUG)
     logger.debug("Debug logging ON")
@@ -32,38 +35,72 @@ class WorkflowRouter:
                 logger.debug("Query is empty or whitespace only")
                 return "other"
             
-            messages = [
-                {"role": "system", "content": self.routing_prompt},
-                {"role": "user", "content": query}
-            ]
+            messages = self._build_messages(query)
             
-            logger.info("Messages being sent to OpenAI: %s", json.dumps(messages, indent=2))
-            
-            response = self.openai_client.chat.completions.create(
+            # Routing starts a new pipeline, so it yields to calls for casts that are already being answered
+            response = openai_chat(
+                self.openai_client,
+                priority=PRIORITY_NEW,
                 model="gpt-4",
                 messages=messages,
                 temperature=0
             )
             
-            llm_response = response.choices[0].message.content.strip()
-            logger.info("LLM Workflow Router response: '%s'", llm_response)
-            
-            # Convert response to lowercase for case-insensitive matching
-            llm_response = llm_response.lower()
-            
-            path_mapping = {
-                "metadata": "metadata",
-                "contextual": "contextual",
-                "hybrid": "hybrid",
-                "ignore": "ignore"  # Added new category
-            }
-            
-            final_path = path_mapping.get(llm_response, "other")
-            logger.info("Selected path: %s", final_path)
-            
-            return final_path
+            record_completion_usage("router", response.usage)
+            return self._parse_route(response.choices[0].message.content)
             
         except Exception as e:
             logger.error("Error in route_query: %s", str(e))
             logger.error("Error type: %s", type(e))
             return "other"
+
+    async def route_query_async(self, query: str) -> str:
+        """route_query for an AsyncOpenAI client."""
+        try:
+            if not query or query.isspace():
+                logger.debug("Query is empty or whitespace only")
+                return "other"
+
+            response = await openai_chat_async(
+                self.openai_client,
+                priority=PRIORITY_NEW,
+                model="gpt-4",
+                messages=self._build_messages(query),
+                temperature=0
+            )
+
+            record_completion_usage("router", response.usage)
+            return self._parse_route(response.choices[0].message.content)
+
+        except Exception as e:
+            logger.error("Error in route_query_async: %s", str(e))
+            logger.error("Error type: %s", type(e))
+            return "other"
+
+    def _build_messages(self, query: str) -> list:
+        messages = [
+            {"role": "system", "content": self.routing_prompt},
+            {"role": "user", "content": query}
+        ]
+        
+        log_llm_messages(logger, "Messages being sent to OpenAI", messages)
+        return messages
+
+    def _parse_route(self, content: str) -> str:
+        llm_response = content.strip()
+        logger.info("LLM Workflow Router response: '%s'", llm_response)
+        
+        # Convert response to lowercase for case-insensitive matching
+        llm_response = llm_response.lower()
+        
+        path_mapping = {
+            "metadata": "metadata",
+            "contextual": "contextual",
+            "hybrid": "hybrid",
+            "ignore": "ignore"  # Added new category
+        }
+        
+        final_path = path_mapping.get(llm_response, "other")
+        logger.info("Selected path: %s", final_path)
+        
+        return final_path
@@ -1,34 +1,10 @@
-def get_farcaster_prompt_with_transcript_context(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0) -> str:
-    
-    depth = int(depth)
-
-    conversation_state = ""
-    if depth == 5 or depth == 6:
-        conversation_state = """
-        IMPORTANT: This conversation is getting quite long. Your response should:
-        - Answer the user's question naturally
-        - Include a friendly hint that you'll need to wrap up soon
-        - The hint should fit the conversation context
-        """
-    elif depth >= 7:
-        conversation_state = """
-        IMPORTANT: This is your final message in this conversation thread. Your response should:
-        - Briefly address the user's question if necessary
-        - Create a friendly farewell that:
-          * Acknowledges the value of the conversation
-          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
-          * Encourages them to start new conversations in the future
-        """
+from prompts.prompt_utils import count_prompt_tokens
 
-    context_section = f"""
-Transcript Snippets:
-{context}
-""" if context.strip() else """
-Transcript Snippets:
-Not Available
-"""
 
-    return f"""
+# Static instructions shared by every contextual request. Nothing user specific goes in here, so that
+# OpenAI's automatic prompt caching can reuse this prefix across requests. The user's name and the
+# conversation state are appended after the transcript snippets.
+TRANSCRIPT_CONTEXT_STATIC_PROMPT = """
 You are a Farcaster AI bot named @warpee.eth, built by the /gmfarcaster team. 
 You act as a librarian for /gmfarcaster, a media network that produces content about Farcaster and the Farcaster ecosystem.
 When users ask you questions, you search through transcripts from /gmfarcaster's video library to find relevant information for when the hosts discussed the topic, so you can answer the question and/or recommend a relevant video snippet.
@@ -41,13 +17,11 @@ The transcripts you have access to are from /gmfarcaster's library, including:
 - Here for the Art (interviews with artists)
 - Special events (tax convos, mental health, poker, FarCon keynotes, etc.)
 
-You are currently assisting a user named @{name}.
-
-Your goal is to answer @{name}'s question using the transcript snippets provided below, and link to the relevant video snippet if possible.
+Your goal is to answer the user's question using the transcript snippets provided below, and link to the relevant video snippet if possible.
 
 Tone & personality:
 - You're friendly, helpful, and tuned into crypto and Farcaster culture.
-- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @{name}!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
+- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @username!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
 
 Response structure:
 1. Greeting (GM @username!)
@@ -59,8 +33,8 @@ Response structure:
 Response guidelines:
 - Answer directly and concisely using the transcript snippets provided below.
 - Use the transcript metadata to cite your sources and to provide timestamps and plain-text video URLs (Note: Markdown is NOT supported!).
-- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@{name}"
-- If you are unable to answer @{name}'s question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
+- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@username"
+- If you are unable to answer the user's question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
 
 Source citation format: "According to [Show Title] at [timestamp], [brief quote]"
 Example: "According to GM Farcaster ep244 at 15:30, 'Farcaster is building the social layer of the internet'"
@@ -81,12 +55,51 @@ Inspiration for when no relevant transcripts are found:
 VERY IMPORTANT: 
 - Your response is displayed in a chat interface that does not support markdown. Do not use markdown in your response. Plain text only, including for URLs.
 - Your reply must be no more than 800 characters. Do not exceed this limit.
+"""
+
+def transcript_context_static_tokens() -> int:
+    """Token count of the static prefix, so prompt size can be tracked without re-tokenizing it per request."""
+    return count_prompt_tokens(TRANSCRIPT_CONTEXT_STATIC_PROMPT)
 
 
+def get_farcaster_prompt_with_transcript_context(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0) -> str:
+    
+    depth = int(depth)
+
+    conversation_state = ""
+    if depth == 5 or depth == 6:
+        conversation_state = """
+        IMPORTANT: This conversation is getting quite long. Your response should:
+        - Answer the user's question naturally
+        - Include a friendly hint that you'll need to wrap up soon
+        - The hint should fit the conversation context
+        """
+    elif depth >= 7:
+        conversation_state = """
+        IMPORTANT: This is your final message in this conversation thread. Your response should:
+        - Briefly address the user's question if necessary
+        - Create a friendly farewell that:
+          * Acknowledges the value of the conversation
+          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
+          * Encourages them to start new conversations in the future
+        """
+
+    context_section = f"""
+Transcript Snippets:
+{context}
+""" if context.strip() else """
+Transcript Snippets:
+Not Available
+"""
+
+    # Per-user suffix goes last so the static prefix and snippets can be served from the prompt cache
+    user_section = f"""
+You are currently assisting a user named @{name}. Greet and tag them as @{name}.
 {conversation_state}
-{context_section}
 """
 
+    return f"{TRANSCRIPT_CONTEXT_STATIC_PROMPT}{context_section}{user_section}"
+
 
 
 def get_farcaster_prompt_with_transcript_context_deprecated(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0) -> str:
@@ -1,12 +1,16 @@
+from prompts.prompt_utils import count_prompt_tokens
+
+
 EPISODE_IDENTIFICATION_PROMPT = """
 You are a workflow router for the GM Farcaster Bot. Your job is to identify the most relevant episode from a list of episodes, where you think the user's question can be answered using the full transcript of that episode.
-Based on the provided list of episodes, return the episode identifiers (using the "episode" field in the metadata) of the episodes that you think would best answer this query. 
+Based on the provided list of episodes, return the episode identifiers (using the "episode" column in the metadata) of the episodes that you think would best answer this query. 
 If multiple episodes are relevant, return them with the most recent episode first, (max 3).
-{name_mappings}
 
-Here is the list of podcast episodes with metadata including title, series, hosts, and air date:
+Here is the list of podcast episodes with metadata including title, series, hosts, and air date.
+It is a table: a header row, then one row per episode with its columns separated by |. Series and hosts that appear more than once are written as codes (s1, h1), defined in the Series and Hosts lines above the table.
 {metadata}
 
+{name_mappings}
 The user asked: "{query}"
 
 
@@ -19,39 +23,37 @@ The episode_ids must be a list of strings, and each string must match an episode
 Do not include any other text in your response.
 """ 
 
-def get_farcaster_prompt_with_full_transcript_context(full_transcript_context: str, query: str, name: str = "Farcaster User", depth: int = 0, name_mappings: str = "") -> str:
-    
-    depth = int(depth)
+EPISODE_SUMMARY_PROMPT = """
+You are summarizing an episode from the GM Farcaster Network's video library so that it can be used later to answer users' questions such as "What did I miss on Monday's show?".
 
-    conversation_state = ""
-    if depth == 5 or depth == 6:
-        conversation_state = """
-        IMPORTANT: This conversation is getting quite long. Your response should:
-        - Answer the user's question naturally
-        - Include a friendly hint that you'll need to wrap up soon
-        - The hint should fit the conversation context
-        """
-    elif depth >= 7:
-        conversation_state = """
-        IMPORTANT: This is your final message in this conversation thread. Your response should:
-        - Briefly address the user's question if necessary
-        - Create a friendly farewell that:
-          * Acknowledges the value of the conversation
-          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
-          * Encourages them to start new conversations in the future
-        """
+The transcript below has one paragraph per line, each prefixed with its start time in [MM:SS] or [HH:MM:SS] format.
 
-    context_section = f"""
-Full Episode Transcript:
-{full_transcript_context}
-""" if full_transcript_context.strip() else """
-Full Episode Transcript:
-Not Available
-"""
+Episode: {episode}
+Title: {title}
+Hosts: {hosts}
+Aired Date: {aired_date}
 
-    name_mappings_section = f"- {name_mappings}\n" if name_mappings.strip() else ""
+Transcript:
+{transcript}
 
-    return f"""
+
+You must respond with a valid JSON object in exactly this format:
+{{
+    "summary": "A 4-6 sentence summary of the episode covering the main news, topics and guests",
+    "outline": [
+        {{"timestamp": "00:00", "topic": "Short description of the segment"}}
+    ]
+}}
+
+The outline must list the main segments of the episode in order (max 12), and every timestamp must be copied from the start time of the paragraph where that segment begins.
+Do not include any other text in your response.
+"""
+
+# Static instructions shared by every hybrid request. Nothing user specific goes in here, so that
+# OpenAI's automatic prompt caching can reuse this prefix, plus the episode transcript that follows it,
+# across every user asking about the same episode. The user's name, name mappings and the conversation
+# state are appended after the transcript.
+FULL_TRANSCRIPT_CONTEXT_STATIC_PROMPT = """
 You are a Farcaster AI bot named @warpee.eth, built by the /gmfarcaster team. 
 You act as a librarian for /gmfarcaster, a media network that produces content about Farcaster and the Farcaster ecosystem.
 When users ask you questions, you search through /gmfarcaster's video library to find relevant information, so you can answer the question and/or recommend a specific episode.
@@ -65,33 +67,73 @@ The transcripts you have access to are from /gmfarcaster's library, including:
 - Special events (tax convos, mental health, poker, FarCon keynotes, etc.)
 
 
-You're assisting a user named @{name}, who asked a question that can be answered using the transcript of a specific episode from the GM Farcaster Network's video library.
+You're assisting a user who asked a question that can be answered using the transcript of a specific episode from the GM Farcaster Network's video library.
 
-Your goal is to answer @{name}'s question clearly and concisely using the transcript provided below.
+Your goal is to answer the user's question clearly and concisely using the transcript provided below.
 
 
 Tone & personality:
 - You're friendly, helpful, and tuned into crypto and Farcaster culture.
-- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @{name}!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
+- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @username!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
 
 
 Response guidelines:
 - Answer directly and concisely using the transcript provided.
 - Use the transcript metadata to cite your source and to provide plain-text video URLs (Note: Markdown is NOT supported!).
-- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@{name}"
-- If you are unable to answer @{name}'s question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
+- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@username"
+- If you are unable to answer the user's question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
 
 VERY IMPORTANT: 
 - Your response is displayed in a chat interface that does not support markdown. Do not use markdown in your response. Plain text only, including for URLs.
 - Your reply must be no more than 800 characters. Do not exceed this limit.
+"""
 
-{name_mappings_section}
-{conversation_state}
-{context_section}
+def full_transcript_context_static_tokens() -> int:
+    """Token count of the static prefix, so prompt size can be tracked without re-tokenizing it per request."""
+    return count_prompt_tokens(FULL_TRANSCRIPT_CONTEXT_STATIC_PROMPT)
 
 
+def get_farcaster_prompt_with_full_transcript_context(full_transcript_context: str, query: str, name: str = "Farcaster User", depth: int = 0, name_mappings: str = "", context_label: str = "Full Episode Transcript") -> str:
+    
+    depth = int(depth)
+
+    conversation_state = ""
+    if depth == 5 or depth == 6:
+        conversation_state = """
+        IMPORTANT: This conversation is getting quite long. Your response should:
+        - Answer the user's question naturally
+        - Include a friendly hint that you'll need to wrap up soon
+        - The hint should fit the conversation context
+        """
+    elif depth >= 7:
+        conversation_state = """
+        IMPORTANT: This is your final message in this conversation thread. Your response should:
+        - Briefly address the user's question if necessary
+        - Create a friendly farewell that:
+          * Acknowledges the value of the conversation
+          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
+          * Encourages them to start new conversations in the future
+        """
+
+    context_section = f"""
+{context_label}:
+{full_transcript_context}
+""" if full_transcript_context.strip() else f"""
+{context_label}:
+Not Available
+"""
+
+    name_mappings_section = f"- {name_mappings}\n" if name_mappings.strip() else ""
+
+    # Per-user suffix goes last so the static prefix and transcript can be served from the prompt cache
+    user_section = f"""
+You are currently assisting a user named @{name}. Greet and tag them as @{name}.
+{name_mappings_section}
+{conversation_state}
 """
 
+    return f"{FULL_TRANSCRIPT_CONTEXT_STATIC_PROMPT}{context_section}{user_section}"
+
 
 
 def get_farcaster_prompt_with_full_transcript_context_deprecated(full_transcript_context: str, query: str, name: str = "Farcaster User", depth: int = 0, name_mappings: str = "") -> str:
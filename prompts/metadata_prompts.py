@@ -1,28 +1,10 @@
-def get_farcaster_prompt_with_metadata_context(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0, metadata_context: str = "", name_mappings: str = "") -> str:
-    
-    depth = int(depth)
-    
-    conversation_state = ""
-    if depth == 5 or depth == 6:
-        conversation_state = """
-        IMPORTANT: This conversation is getting quite long. Your response should:
-        - Answer the user's question naturally
-        - Include a friendly hint that you'll need to wrap up soon
-        - The hint should fit the conversation context
-        """
-    elif depth >= 7:
-        conversation_state = """
-        IMPORTANT: This is your final message in this conversation thread. Your response should:
-        - Briefly address the user's question if necessary
-        - Create a friendly farewell that:
-          * Acknowledges the value of the conversation
-          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
-          * Encourages them to start new conversations in the future
-        """
+from prompts.prompt_utils import count_prompt_tokens
 
-    name_mappings_section = f"- {name_mappings}\n" if name_mappings.strip() else ""
 
-    return f"""
+# Static instructions shared by every metadata request. Nothing user specific goes in here, so that
+# OpenAI's automatic prompt caching can reuse this prefix across requests. The user's name, name mappings
+# and the conversation state are appended after the metadata context.
+METADATA_CONTEXT_STATIC_PROMPT = """
 You are a Farcaster AI bot named @warpee.eth, built by the /gmfarcaster team. 
 You act as a librarian for /gmfarcaster, a media network that produces content about Farcaster and the Farcaster ecosystem.
 When users ask you questions, you search through /gmfarcaster's video library to find relevant information, so you can answer the question and/or recommend a specific episode.
@@ -35,34 +17,68 @@ The show data and transcripts you have access to are from /gmfarcaster's library
 - Here for the Art (interviews with artists)
 - Special events (tax convos, mental health, poker, FarCon keynotes, etc.)
 
-You are currently assisting a user named @{name}.
-
-Your goal is to answer @{name}'s question using the structured metadata provided below, and link to the relevant video if possible.
+Your goal is to answer the user's question using the structured metadata provided below, and link to the relevant video if possible.
 
 Tone & personality:
 - You're friendly, helpful, and tuned into crypto and Farcaster culture.
-- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @{name}!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
+- Light humor and references to show lore are encouraged when appropriate. You can use phrases like "GM @username!" as a greeting, "wowow" when you're excited, or "buh-bye" as a closing in your responses if they fit naturally.
 
 Response guidelines:
 - Answer directly and concisely using the metadata provided.
+- If the metadata context starts with computed facts, those counts and dates are exact. Use them instead of counting episodes yourself.
+- The episode metadata is a table: a header row, then one row per episode with its columns separated by |. Series and hosts that appear more than once are written as codes (s1, h1), defined in the Series and Hosts lines above the table. When you mention one, write its full name, never the code.
 - If it helps answer the user's query, include the plain-text video URL in your reply. (Note: Markdown is NOT supported!).
-- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@{name}"
-- If you are unable to answer @{name}'s question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
+- When speaking directly to the user, or referring to other Farcaster users, tag them with an @ sign, like this: "@username"
+- If you are unable to answer the user's question, you can promote our YouTube channel  https://www.youtube.com/@GMFarcaster, and/or tag @adrienne or @nounishprof for additional help.
 
 VERY IMPORTANT: 
 - Your response is displayed in a chat interface that does not support markdown. Do not use markdown in your response. Plain text only, including for URLs.
 - Your reply must be no more than 800 characters. Do not exceed this limit.
+"""
 
+def metadata_context_static_tokens() -> int:
+    """Token count of the static prefix, so prompt size can be tracked without re-tokenizing it per request."""
+    return count_prompt_tokens(METADATA_CONTEXT_STATIC_PROMPT)
 
-{name_mappings_section}
-{conversation_state}
 
+def get_farcaster_prompt_with_metadata_context(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0, metadata_context: str = "", name_mappings: str = "") -> str:
+    
+    depth = int(depth)
+    
+    conversation_state = ""
+    if depth == 5 or depth == 6:
+        conversation_state = """
+        IMPORTANT: This conversation is getting quite long. Your response should:
+        - Answer the user's question naturally
+        - Include a friendly hint that you'll need to wrap up soon
+        - The hint should fit the conversation context
+        """
+    elif depth >= 7:
+        conversation_state = """
+        IMPORTANT: This is your final message in this conversation thread. Your response should:
+        - Briefly address the user's question if necessary
+        - Create a friendly farewell that:
+          * Acknowledges the value of the conversation
+          * Gives a playful, in-character reason for leaving (e.g., "gotta go mint some NFTs")
+          * Encourages them to start new conversations in the future
+        """
+
+    name_mappings_section = f"- {name_mappings}\n" if name_mappings.strip() else ""
+
+    context_section = f"""
 Here is the metadata context for your reference:
 {metadata_context}
+"""
 
-
+    # Per-user suffix goes last so the static prefix and metadata can be served from the prompt cache
+    user_section = f"""
+You are currently assisting a user named @{name}. Greet and tag them as @{name}.
+{name_mappings_section}
+{conversation_state}
 """
 
+    return f"{METADATA_CONTEXT_STATIC_PROMPT}{context_section}{user_section}"
+
 
 
 def get_farcaster_prompt_with_metadata_context_deprecated(context: str, query: str, conversation: str, name: str = "Farcaster User", depth: int = 0, metadata_context: str = "", name_mappings: str = "") -> str:
@@ -0,0 +1,27 @@
+"""
+Shared helpers for building prompts.
+
+Prompts are laid out as: static instructions -> context block -> per-user suffix.
+OpenAI caches prompt prefixes automatically, so keeping the large static instructions (and then the
+episode transcript) ahead of anything user specific lets requests share a long cached prefix.
+"""
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def count_prompt_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Counts tokens in a static prompt section. Cached, so each static prefix is tokenized once, on first use;
+    tiktoken and its encoder are only loaded then, not when the prompt modules are imported.
+    Returns 0 if the tokenizer isn't available.
+    """
+    try:
+        import tiktoken
+        enc = tiktoken.encoding_for_model(model)
+        return len(enc.encode(text))
+    except Exception as e:
+        logger.warning(f"Could not count static prompt tokens: {e}")
+        return 0
@@ -0,0 +1,198 @@
+"""
+Episode Summary Build Script
+============================
+
+This script is an offline batch job that precomputes a summary and a timestamped outline for every episode
+listed in metadata.json. HybridPath uses these summaries to answer summary-type questions
+(e.g. "What did I miss on Monday's show?") without re-sending the full transcript to the LLM.
+
+Summaries are written to summaries/summary_<name>.json in the published data version (see core/data_store.py),
+next to the transcripts directory.
+Each summary stores the sha256 of the transcript it was generated from, so an episode is only
+regenerated when its transcript changes.
+
+Environment Variables Required:
+----------------------------
+- DATA_DIR: Base directory for storing files (defaults to './data')
+- OPENAI_API_KEY: OpenAI API key used to generate the summaries
+
+Usage:
+------
+# Generate summaries for any new or changed transcripts
+python scripts/build_episode_summaries.py
+
+# Regenerate a single episode
+python scripts/build_episode_summaries.py --episode ep50
+
+# Regenerate everything, even if the transcript hash has not changed
+python scripts/build_episode_summaries.py --force
+
+Run after download_transcripts.py or update_transcripts.py.
+"""
+
+import os
+import sys
+import json
+import logging
+import time
+import argparse
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from openai import OpenAI
+
+# Allow imports from the project root when run as `python scripts/build_episode_summaries.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Load environment variables from .env file
+load_dotenv()
+
+from core.data_store import resolve_data_dir
+from core.transcript_store import load_transcript
+from core.episode_summaries import (
+    build_timestamped_transcript,
+    compute_file_sha256,
+    get_summaries_dir,
+    get_summary_path,
+    parse_timestamp,
+)
+from prompts.hybrid_prompts import EPISODE_SUMMARY_PROMPT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "gpt-4o"
+
+
+def load_existing_summary(summary_path):
+    """Load an existing summary file, returning None if it doesn't exist or is unreadable."""
+    if not os.path.exists(summary_path):
+        return None
+    try:
+        with open(summary_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read existing summary {summary_path}: {str(e)}")
+        return None
+
+
+def generate_summary(openai_client, episode_metadata, transcript_data):
+    """Ask the LLM for a summary and outline of one episode. Returns the parsed dict."""
+    prompt = EPISODE_SUMMARY_PROMPT.format(
+        episode=episode_metadata.get('episode', 'N/A'),
+        title=episode_metadata.get('title', 'N/A'),
+        hosts=", ".join(episode_metadata.get('hosts', [])),
+        aired_date=episode_metadata.get('aired_date', 'N/A'),
+        transcript=build_timestamped_transcript(transcript_data)
+    )
+
+    response = openai_client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[{"role": "system", "content": prompt}],
+        response_format={"type": "json_object"},
+        temperature=0.3
+    )
+    result = json.loads(response.choices[0].message.content)
+
+    if not isinstance(result.get('summary'), str) or not result['summary'].strip():
+        raise ValueError("LLM response did not contain a summary")
+
+    # Keep only well formed outline entries
+    outline = []
+    for item in result.get('outline', []):
+        if isinstance(item, dict) and item.get('topic') and parse_timestamp(item.get('timestamp', '')) is not None:
+            outline.append({"timestamp": item['timestamp'], "topic": item['topic']})
+
+    return {"summary": result['summary'].strip(), "outline": outline}
+
+
+def write_summary(summary_path, summary):
+    """Write the summary atomically so the API never reads a half written file."""
+    tmp_path = f"{summary_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, summary_path)
+
+
+def build_episode_summaries(episode_filter=None, force=False):
+    start_time = time.time()
+    logger.info(f"Starting summary build at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # Summaries are added to the published data version; later refreshes carry them over to new versions
+    data_dir = resolve_data_dir()
+    metadata_path = os.path.join(data_dir, 'metadata.json')
+    transcript_dir = os.path.join(data_dir, 'transcripts')
+
+    try:
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+    except Exception as e:
+        logger.error(f"Error reading metadata file: {str(e)}")
+        sys.exit(1)
+
+    os.makedirs(get_summaries_dir(data_dir), exist_ok=True)
+    openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+    generated, skipped, failed = 0, 0, 0
+    for episode_metadata in metadata:
+        episode_id = episode_metadata.get('episode')
+        transcript_path = episode_metadata.get('transcript_path')
+
+        if episode_filter and episode_id != episode_filter:
+            continue
+        if not transcript_path:
+            logger.warning(f"No transcript path for episode {episode_id}, skipping")
+            skipped += 1
+            continue
+
+        full_transcript_path = os.path.join(transcript_dir, transcript_path)
+        if not os.path.exists(full_transcript_path):
+            logger.warning(f"Transcript {transcript_path} not found locally, skipping")
+            skipped += 1
+            continue
+
+        summary_path = get_summary_path(data_dir, transcript_path)
+        transcript_sha256 = compute_file_sha256(full_transcript_path)
+
+        existing = load_existing_summary(summary_path)
+        if existing and existing.get('transcript_sha256') == transcript_sha256 and not force:
+            logger.debug(f"Summary for {episode_id} is up to date, skipping")
+            skipped += 1
+            continue
+
+        try:
+            episode_start = time.time()
+            transcript_data = load_transcript(data_dir, transcript_path)
+
+            result = generate_summary(openai_client, episode_metadata, transcript_data)
+            write_summary(summary_path, {
+                "episode": episode_id,
+                "transcript_path": transcript_path,
+                "transcript_sha256": transcript_sha256,
+                "transcript_size": os.path.getsize(full_transcript_path),
+                "model": SUMMARY_MODEL,
+                "generated_at": datetime.now(timezone.utc).isoformat(),
+                "summary": result['summary'],
+                "outline": result['outline']
+            })
+            generated += 1
+            logger.info(f"Generated summary for {episode_id} in {time.time() - episode_start:.2f} seconds")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error generating summary for {episode_id}: {str(e)}")
+
+    duration = time.time() - start_time
+    logger.info(f"Summary build completed in {duration:.2f} seconds: "
+                f"{generated} generated, {skipped} skipped, {failed} failed")
+
+    if failed:
+        sys.exit(1)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute episode summaries and outlines for hybrid summary queries')
+    parser.add_argument('--episode', help='Only build the summary for this episode ID (e.g., ep50)')
+    parser.add_argument('--force', action='store_true', help='Regenerate summaries even if the transcript has not changed')
+    args = parser.parse_args()
+
+    build_episode_summaries(episode_filter=args.episode, force=args.force)
@@ -9,10 +9,15 @@ from either S3 (production) or local sample data (development).
 Key Features:
 ------------
 1. Dual mode operation (sample/production)
-2. Downloads metadata.json and all transcript files
-3. Verifies all files are valid JSON
-4. Performs a full refresh (deletes existing files)
-5. Provides detailed timing information
+2. Downloads metadata.json and all transcript files (every page of the bucket listing)
+3. Verifies metadata.json and every transcript; a checksum manifest (core/transcript_manifest.py) means only
+   new or changed transcripts are parsed, across a process pool
+   New or changed transcripts are then compacted (core/transcript_store.py) for faster loading by the API
+4. Performs a full refresh, or with --sync only downloads new or changed files
+   Either way the new data is staged as a new version and published atomically (see core/data_store.py),
+   so the running API never sees a half-refreshed directory and needs no restart
+5. Downloads in parallel through a bounded thread pool and reports objects/s and MB/s
+6. Provides detailed timing information
 
 Environment Variables Required:
 ----------------------------
@@ -26,20 +31,45 @@ File Structure:
 --------------
 Sample Mode:
 - Source: ./data/sample_transcripts/sample_metadata.json and ./data/sample_transcripts/*
-- Destination: ./data/metadata.json and ./data/transcripts/*
+- Destination: ./data/versions/<version>/metadata.json and ./data/versions/<version>/transcripts/*
 
 Production Mode:
 - Source: S3 bucket (metadata.json and transcript_*.json)
-- Destination: ./data/metadata.json and ./data/transcripts/*
+- Destination: ./data/versions/<version>/metadata.json and ./data/versions/<version>/transcripts/*
+
+./data/CURRENT names the version the API serves. It is replaced only after the new version has been verified.
+Old versions are deleted after a grace period (DATA_KEEP_VERSIONS, DATA_VERSION_GRACE_SECONDS).
+- A local directory laid out like the bucket can stand in for S3 with --source-dir (used for testing)
+
+Sync Mode (--sync):
+------------------
+The ETag and size of every file downloaded from the source are recorded in the version's .sync_manifest.json.
+A sync lists the whole source, downloads only objects whose ETag or size differ from the manifest (or whose
+local file is missing), and removes local transcripts that were deleted from the source. Each file is
+downloaded to a temporary name and then moved into place, so a failed sync never leaves a half-written
+transcript behind.
+
+Verification:
+------------
+The sha256, size and mtime of every verified transcript are recorded in the version's .transcript_manifest.json.
+Transcripts that still match it are not read again; new or changed ones are parsed and schema-checked in a
+process pool. A sync therefore only parses what it downloaded.
+
+Compaction:
+----------
+Each transcript_<x>.json gets a transcript_<x>.compact.json.gz next to it holding only the fields the bot reads.
+The API loads it instead of the original. Only transcripts without a current compact file are compacted, and the
+size and load-time reduction is logged per file. The original stays, since syncs, verification and summaries use it.
 
 Process Flow:
 ------------
 1. Load environment variables and initialize logging
 2. Determine operation mode (sample/production)
-3. Clean existing data directory
+3. Create a staging directory for the new version
 4. Copy/download files based on mode
-5. Verify all files
-6. Log timing information
+5. Verify all files and compact new transcripts
+6. Publish the new version and remove old ones
+7. Log timing information
 
 Error Handling:
 --------------
@@ -52,10 +82,13 @@ Usage:
 Run at application startup to ensure latest transcripts are available:
     python download_transcripts.py
 
-Author: GM Farcaster Network
+Only download new or changed transcripts, with 16 parallel downloads:
+    python download_transcripts.py --sync --workers 16
+
+Sync from a local directory instead of S3:
+    python download_transcripts.py --sync --source-dir /path/to/bucket_copy
 
-TO DO: 
-- Add a check to only download transcripts if they are new or have changed
+Author: GM Farcaster Network
 """
 
 import os
@@ -64,16 +97,202 @@ import logging
 import sys
 import json
 import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
 from dotenv import load_dotenv
 import time
 from datetime import datetime
 
+# Allow imports from the project root when run as `python scripts/download_transcripts.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # Load environment variables from .env file
 load_dotenv()
 
+from core.data_store import data_root, create_staging_dir, publish_version, discard_staging_dir, gc_versions
+from core.transcript_manifest import verify_transcript_dir
+from core.transcript_store import compact_transcript_dir
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SYNC_MANIFEST_FILENAME = '.sync_manifest.json'
+DEFAULT_WORKERS = 8
+
+
+def is_transcript_key(key):
+    return os.path.basename(key).startswith('transcript_') and key.endswith('.json')
+
+
+class S3Source:
+    """The production transcript bucket."""
+
+    def __init__(self, bucket, workers=DEFAULT_WORKERS):
+        self.bucket = bucket
+        # boto3 clients are thread safe; size the connection pool for the download threads
+        self.s3 = boto3.client('s3', config=Config(max_pool_connections=max(10, workers)))
+
+    def describe(self):
+        return f"s3://{self.bucket}"
+
+    def list_objects(self):
+        """Yields {'Key', 'ETag', 'Size'} for every object, following the listing across pages of 1,000 keys."""
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket):
+            for obj in page.get('Contents', []):
+                yield {'Key': obj['Key'], 'ETag': obj['ETag'].strip('"'), 'Size': obj['Size']}
+
+    def download(self, key, local_path):
+        self.s3.download_file(self.bucket, key, local_path)
+
+
+class LocalDirectorySource:
+    """A local directory laid out like the bucket, standing in for S3. ETags are content MD5s, as S3 computes them."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def describe(self):
+        return self.directory
+
+    def list_objects(self):
+        for root, _, files in os.walk(self.directory):
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                md5 = hashlib.md5()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        md5.update(chunk)
+                key = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                yield {'Key': key, 'ETag': md5.hexdigest(), 'Size': os.path.getsize(path)}
+
+    def download(self, key, local_path):
+        shutil.copyfile(os.path.join(self.directory, key), local_path)
+
+
+def load_sync_manifest(data_dir):
+    """Returns {key: {'etag', 'size'}} for the files recorded by the last download, or {} if there is none."""
+    manifest_path = os.path.join(data_dir, SYNC_MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f).get('objects', {})
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.warning(f"Ignoring unreadable sync manifest {manifest_path}: {str(e)}")
+        return {}
+
+
+def save_sync_manifest(data_dir, objects):
+    manifest_path = os.path.join(data_dir, SYNC_MANIFEST_FILENAME)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'updated_at': datetime.now().isoformat(), 'objects': objects}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def local_path_for_key(data_dir, key):
+    if key == 'metadata.json':
+        return os.path.join(data_dir, 'metadata.json')
+    return os.path.join(data_dir, 'transcripts', os.path.basename(key))
+
+
+def is_unchanged(obj, manifest, local_path):
+    """True if the manifest records this ETag and size and the local file is still there with that size."""
+    entry = manifest.get(obj['Key'])
+    if not entry or entry.get('etag') != obj['ETag'] or entry.get('size') != obj['Size']:
+        return False
+    return os.path.exists(local_path) and os.path.getsize(local_path) == obj['Size']
+
+
+def download_object(source, key, local_path):
+    """Downloads to a temporary file and moves it into place. Returns the file size."""
+    tmp_path = f"{local_path}.part.{threading.get_ident()}"
+    try:
+        source.download(key, tmp_path)
+        os.replace(tmp_path, local_path)
+        return os.path.getsize(local_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def sync_from_source(source, data_dir, workers=DEFAULT_WORKERS):
+    """
+    Brings metadata.json and data/transcripts up to date with the source, downloading only new or changed
+    objects through a pool of `workers` threads.
+
+    Returns:
+        tuple: (True if every object is in sync, number of objects downloaded or removed)
+    """
+    start_time = time.time()
+    transcript_dir = os.path.join(data_dir, 'transcripts')
+    os.makedirs(transcript_dir, exist_ok=True)
+
+    logger.info(f"Listing objects in {source.describe()}")
+    objects = [obj for obj in source.list_objects() if obj['Key'] == 'metadata.json' or is_transcript_key(obj['Key'])]
+    if not any(obj['Key'] == 'metadata.json' for obj in objects):
+        logger.error("metadata.json not found in source")
+        return False, 0
+    if not any(is_transcript_key(obj['Key']) for obj in objects):
+        logger.error("No transcript files found in source")
+        return False, 0
+    list_duration = time.time() - start_time
+    logger.info(f"Listed {len(objects)} objects in {format_duration(list_duration)}")
+
+    manifest = load_sync_manifest(data_dir)
+    to_download = [obj for obj in objects if not is_unchanged(obj, manifest, local_path_for_key(data_dir, obj['Key']))]
+    skipped = len(objects) - len(to_download)
+    logger.info(f"{len(to_download)} new or changed objects to download, {skipped} unchanged")
+
+    download_start = time.time()
+    downloaded_bytes = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_object, source, obj['Key'], local_path_for_key(data_dir, obj['Key'])): obj
+            for obj in to_download
+        }
+        for future in as_completed(futures):
+            obj = futures[future]
+            try:
+                downloaded_bytes += future.result()
+                manifest[obj['Key']] = {'etag': obj['ETag'], 'size': obj['Size']}
+                logger.info(f"Downloaded {obj['Key']}")
+            except Exception as e:
+                logger.error(f"Error downloading {obj['Key']}: {str(e)}")
+                manifest.pop(obj['Key'], None)
+                failed.append(obj['Key'])
+    download_duration = time.time() - download_start
+
+    # Remove transcripts that were deleted from the source since the last download
+    listed_keys = {obj['Key'] for obj in objects}
+    removed = 0
+    for key in [k for k in manifest if k not in listed_keys]:
+        local_path = local_path_for_key(data_dir, key)
+        if is_transcript_key(key) and os.path.exists(local_path):
+            os.remove(local_path)
+            removed += 1
+        del manifest[key]
+
+    save_sync_manifest(data_dir, manifest)
+
+    downloaded = len(to_download) - len(failed)
+    rate_duration = max(download_duration, 1e-6)
+    logger.info(
+        f"Sync finished: {downloaded} downloaded, {skipped} unchanged, {removed} removed, {len(failed)} failed | "
+        f"{downloaded_bytes / 1e6:.2f} MB in {format_duration(download_duration)} "
+        f"({downloaded / rate_duration:.1f} objects/s, {downloaded_bytes / 1e6 / rate_duration:.2f} MB/s, {workers} workers)"
+    )
+    if failed:
+        logger.error(f"Failed to download {len(failed)} objects: {', '.join(sorted(failed))}")
+        return False, downloaded + removed
+    return True, downloaded + removed
+
+
 def format_duration(seconds):
     """Format duration in seconds to a human-readable string."""
     if seconds < 60:
@@ -102,41 +321,29 @@ def verify_metadata(metadata_path):
         logger.error(f"Error reading metadata file: {str(e)}")
         return False
 
-def verify_transcripts(directory):
-    """Verify that downloaded transcripts are valid JSON files."""
-    if not os.path.exists(directory):
-        logger.error(f"Transcript directory {directory} does not exist")
-        return False
-    
-    files = [f for f in os.listdir(directory) if f.startswith('transcript_') and f.endswith('.json')]
-    if not files:
-        logger.error("No transcript files found in directory")
-        return False
-    
-    for file in files:
-        try:
-            with open(os.path.join(directory, file), 'r') as f:
-                json.load(f)  # Verify it's valid JSON
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON in file: {file}")
-            return False
-        except Exception as e:
-            logger.error(f"Error reading file {file}: {str(e)}")
-            return False
-    
-    logger.info(f"Successfully verified {len(files)} transcript files")
-    return True
+def verify_transcripts(data_dir):
+    """Verify the transcripts in data_dir/transcripts against the checksum manifest, parsing only new or changed files."""
+    ok, problems = verify_transcript_dir(data_dir)
+    for problem in problems:
+        logger.error(f"Transcript verification failed: {problem}")
+    return ok
 
-def setup_sample_data(data_dir):
-    """Set up sample data by copying from sample directories."""
+def compact_transcripts(data_dir):
+    """Write compact versions of new or changed transcripts. Failures are logged, not fatal: the API falls back to the original."""
+    ok, _ = compact_transcript_dir(data_dir)
+    if not ok:
+        logger.warning("Some transcripts could not be compacted; the original JSON will be served for them")
+
+def setup_sample_data(data_dir, target_dir):
+    """Set up sample data in target_dir by copying from the sample directories in data_dir."""
     start_time = time.time()
     logger.info("Setting up sample data")
     
     # Define paths
     sample_metadata = os.path.join(data_dir, 'sample_transcripts', 'sample_metadata.json')
     sample_transcripts = os.path.join(data_dir, 'sample_transcripts')
-    metadata_path = os.path.join(data_dir, 'metadata.json')
-    transcript_dir = os.path.join(data_dir, 'transcripts')
+    metadata_path = os.path.join(target_dir, 'metadata.json')
+    transcript_dir = os.path.join(target_dir, 'transcripts')
     
     # Verify source files exist
     if not os.path.exists(sample_metadata):
@@ -146,11 +353,6 @@ def setup_sample_data(data_dir):
         logger.error(f"Sample transcripts directory not found: {sample_transcripts}")
         return False
     
-    # Clean and recreate directories
-    if os.path.exists(metadata_path):
-        os.remove(metadata_path)
-    if os.path.exists(transcript_dir):
-        shutil.rmtree(transcript_dir)
     os.makedirs(transcript_dir, exist_ok=True)
     
     # Copy metadata
@@ -174,93 +376,80 @@ def setup_sample_data(data_dir):
         return False
     
     # Verify the copied files
-    if not verify_metadata(metadata_path) or not verify_transcripts(transcript_dir):
+    if not verify_metadata(metadata_path) or not verify_transcripts(target_dir):
         logger.error("Verification of sample data failed")
         return False
+    compact_transcripts(target_dir)
     
     duration = time.time() - start_time
     logger.info(f"Sample data setup completed in {format_duration(duration)}")
     return True
 
-def download_transcripts():
+def download_transcripts(sync=False, workers=DEFAULT_WORKERS, source_dir=None):
     start_time = time.time()
     logger.info(f"Starting download process at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
         # Get environment variables from .env file
         use_samples = os.getenv('USE_SAMPLES', 'true').lower() == 'true'
-        data_dir = os.getenv('DATA_DIR', './data')
+        data_dir = data_root()
         
         logger.info(f"Using data directory: {data_dir}")
-        logger.info(f"Mode: {'Sample' if use_samples else 'Production'}")
         
-        if use_samples:
-            return setup_sample_data(data_dir)
+        if use_samples and not source_dir:
+            logger.info("Mode: Sample")
+            staging_dir = create_staging_dir(seed_from_current=False)
+            if not setup_sample_data(data_dir, staging_dir):
+                discard_staging_dir(staging_dir)
+                return False
+            publish_version(staging_dir)
+            gc_versions()
+            return True
         
-        # Production mode - get S3 configuration
-        bucket = os.getenv('S3_BUCKET')
-        if not bucket:
-            logger.error("S3_BUCKET environment variable not set")
-            sys.exit(1)
+        # Production mode - get S3 configuration, unless a local directory stands in for the bucket
+        if source_dir:
+            if not os.path.isdir(source_dir):
+                logger.error(f"Source directory not found: {source_dir}")
+                sys.exit(1)
+            source = LocalDirectorySource(source_dir)
+        else:
+            bucket = os.getenv('S3_BUCKET')
+            if not bucket:
+                logger.error("S3_BUCKET environment variable not set")
+                sys.exit(1)
+            source = S3Source(bucket, workers=workers)
+        logger.info(f"Mode: {'Sync' if sync else 'Full refresh'} from {source.describe()}")
             
-        transcript_dir = os.path.join(data_dir, 'transcripts')
-        metadata_path = os.path.join(data_dir, 'metadata.json')
-        
-        # Clean and recreate directories
-        if os.path.exists(metadata_path):
-            os.remove(metadata_path)
-        if os.path.exists(transcript_dir):
-            shutil.rmtree(transcript_dir)
-        os.makedirs(transcript_dir, exist_ok=True)
-        
-        # Initialize S3 client
-        s3 = boto3.client('s3')
-        
-        # Download and verify metadata first
-        metadata_start = time.time()
-        logger.info("Downloading metadata.json")
+        # The refresh is written to a staging version and only published once it is complete and verified,
+        # so the API keeps serving the current version throughout. A sync starts from hard links to the
+        # current version (including its manifest); a full refresh starts empty and downloads everything.
+        staging_dir = create_staging_dir(seed_from_current=sync)
         try:
-            s3.download_file(bucket, 'metadata.json', metadata_path)
-            if not verify_metadata(metadata_path):
+            ok, changed = sync_from_source(source, staging_dir, workers=workers)
+            if not ok:
+                logger.error("Download from source failed")
+                sys.exit(1)
+            # Nothing new to publish: keep serving the current version rather than staging an identical one
+            if sync and not changed:
+                logger.info("SYNC FOUND NO CHANGES: keeping the current version")
+                discard_staging_dir(staging_dir)
+                logger.info(f"Total process completed in {format_duration(time.time() - start_time)}")
+                return True
+
+            if not verify_metadata(os.path.join(staging_dir, 'metadata.json')):
                 logger.error("Metadata verification failed")
                 sys.exit(1)
-            metadata_duration = time.time() - metadata_start
-            logger.info(f"Metadata download and verification completed in {format_duration(metadata_duration)}")
-        except Exception as e:
-            logger.error(f"Error downloading metadata: {str(e)}")
-            sys.exit(1)
-        
-        # List and download transcript files
-        transcripts_start = time.time()
-        logger.info(f"Downloading transcripts from {bucket} to {transcript_dir}")
-        objects = s3.list_objects_v2(Bucket=bucket).get('Contents', [])
-        transcript_objects = [obj for obj in objects if obj['Key'].startswith('transcript_') and obj['Key'].endswith('.json')]
-        
-        if not transcript_objects:
-            logger.error("No transcript files found in S3 bucket")
-            sys.exit(1)
-            
-        downloaded_files = []
-        for obj in transcript_objects:
-            key = obj['Key']
-            local_path = os.path.join(transcript_dir, os.path.basename(key))
-            logger.info(f"Downloading {key} to {local_path}")
-            s3.download_file(bucket, key, local_path)
-            downloaded_files.append(local_path)
-        
-        if not downloaded_files:
-            logger.error("No transcript files were downloaded")
-            sys.exit(1)
-            
-        logger.info(f"Downloaded {len(downloaded_files)} transcript files")
-        
-        # Verify the downloaded transcript files
-        if not verify_transcripts(transcript_dir):
-            logger.error("Transcript verification failed")
-            sys.exit(1)
-            
-        transcripts_duration = time.time() - transcripts_start
-        logger.info(f"Transcript download and verification completed in {format_duration(transcripts_duration)}")
+            # Transcripts carried over unchanged from the current version are matched against its manifest, not re-parsed
+            if not verify_transcripts(staging_dir):
+                logger.error("Transcript verification failed")
+                sys.exit(1)
+            compact_transcripts(staging_dir)
+
+            publish_version(staging_dir)
+        except BaseException:
+            discard_staging_dir(staging_dir)
+            raise
+        gc_versions()
         
         total_duration = time.time() - start_time
         logger.info(f"Total process completed in {format_duration(total_duration)}")
@@ -271,4 +460,10 @@ def download_transcripts():
         sys.exit(1)
 
 if __name__ == "__main__":
-    download_transcripts() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Download transcripts and metadata from S3 (or the sample data)')
+    parser.add_argument('--sync', action='store_true', help='Only download new or changed files instead of a full refresh')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Parallel downloads (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--source-dir', help='Local directory laid out like the S3 bucket, used instead of S3')
+    args = parser.parse_args()
+
+    download_transcripts(sync=args.sync, workers=max(1, args.workers), source_dir=args.source_dir)
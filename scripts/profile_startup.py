@@ -0,0 +1,190 @@
+"""
+Startup Profile Script
+======================
+
+This script measures how long `import api` takes in a fresh interpreter, which is most of a dyno's cold start,
+and where that time goes. Each run starts a new `python -X importtime` process, so nothing is cached between runs.
+A temporary DATA_DIR is built from the sample transcripts and placeholder credentials are used, so no API is called.
+The import includes the warm-start preload of core/warm_start.py (metadata, transcripts, tokenizers), which shows up
+as the self time of the api module.
+
+Reported:
+- Wall-clock time of `import api` (median over --runs)
+- The modules api imports directly, by cumulative import time
+- Self import time summed per top-level package
+
+With --check it exits with 1 if the median import time exceeds the cold-start budget (STARTUP_BUDGET_MS, or
+--budget-ms), or if `import api` imports a package that is meant to load lazily (LAZY_PACKAGES).
+
+Usage:
+------
+# Profile the import of api.py
+python scripts/profile_startup.py
+
+# Enforce the cold-start budget (used as a regression check)
+python scripts/profile_startup.py --check
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(PROJECT_ROOT, 'data', 'sample_transcripts')
+
+# Cold-start budget for `import api`, with the sample data preloaded
+STARTUP_BUDGET_MS = 750
+# Packages that api.py only loads on first use; importing one at startup is a regression.
+# (tiktoken is loaded by the preload on purpose, so the workers share its encoders.)
+LAZY_PACKAGES = ("openai", "pinecone", "boto3", "botocore")
+
+# Placeholder settings so api.py can be imported; nothing here talks to an API
+PLACEHOLDER_ENV = {
+    "OPENAI_API_KEY": "profile",
+    "PINECONE_API_KEY": "profile",
+    "PINECONE_ENVIRONMENT": "profile",
+    "PINECONE_INDEX_NAME": "profile",
+    "NEYNAR_API_KEY": "profile",
+    "NEYNAR_BOT_SIGNER_UUID": "profile",
+    "BOT_ACCOUNT_FID": "0",
+    "VERBOSE_LOGGING": "false",
+    "WARM_CONNECTIONS": "false",
+}
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import api; print(time.perf_counter() - start)"
+
+
+def build_data_dir() -> str:
+    """Creates a temporary DATA_DIR with the sample metadata and transcripts."""
+    data_dir = tempfile.mkdtemp(prefix='gmfc101_startup_')
+    transcripts_dir = os.path.join(data_dir, 'transcripts')
+    os.makedirs(transcripts_dir)
+    shutil.copy(os.path.join(SAMPLE_DIR, 'sample_metadata.json'), os.path.join(data_dir, 'metadata.json'))
+    for filename in os.listdir(SAMPLE_DIR):
+        if filename.startswith('transcript_') and filename.endswith('.json'):
+            shutil.copy(os.path.join(SAMPLE_DIR, filename), transcripts_dir)
+    return data_dir
+
+
+def parse_importtime(stderr: str):
+    """
+    Parses `-X importtime` output into (module, self_us, cumulative_us, depth) tuples.
+    Nested imports are indented by two spaces per level.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, raw_name = line[len('import time:'):].split('|', 2)
+        depth = (len(raw_name) - len(raw_name.lstrip(' ')) - 1) // 2
+        modules.append((raw_name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def profile_once(data_dir: str):
+    """Imports api in a fresh interpreter. Returns (wall seconds, parsed importtime entries)."""
+    env = dict(os.environ)
+    env.update(PLACEHOLDER_ENV)
+    env['DATA_DIR'] = data_dir
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_SNIPPET],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import api failed:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def summarize(modules, top: int):
+    """Returns the direct imports of api and the per-package self times, both sorted by cost, in milliseconds."""
+    direct = []
+    api_depth = None
+    # importtime lists a module after everything it imported, so api's direct imports are the entries just
+    # before it at one level deeper
+    for name, self_us, cumulative_us, depth in reversed(modules):
+        if name == 'api':
+            api_depth = depth
+            continue
+        if api_depth is not None:
+            if depth <= api_depth:
+                break
+            if depth == api_depth + 1:
+                direct.append((name, cumulative_us / 1000))
+
+    by_package = defaultdict(float)
+    for name, self_us, _, _ in modules:
+        by_package[name.split('.')[0]] += self_us / 1000
+
+    return (
+        sorted(direct, key=lambda item: item[1], reverse=True)[:top],
+        sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the cold-start import of api.py.')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time (default: 5)')
+    parser.add_argument('--top', type=int, default=15, help='Modules and packages to list (default: 15)')
+    parser.add_argument('--check', action='store_true', help='Exit with 1 if the budget is exceeded or a lazy package is imported')
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help=f'Cold-start budget for import api (default: {STARTUP_BUDGET_MS})')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    data_dir = build_data_dir()
+    try:
+        runs = [profile_once(data_dir) for _ in range(max(1, args.runs))]
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    wall_ms = [seconds * 1000 for seconds, _ in runs]
+    median_ms = statistics.median(wall_ms)
+    # The per-module breakdown is taken from the run closest to the median
+    modules = min(runs, key=lambda run: abs(run[0] * 1000 - median_ms))[1]
+    direct, by_package = summarize(modules, args.top)
+    imported = {name for name, _, _, _ in modules}
+    lazy_imported = sorted(package for package in LAZY_PACKAGES if package in imported)
+
+    print(f"import api: median {median_ms:.1f}ms, min {min(wall_ms):.1f}ms, max {max(wall_ms):.1f}ms "
+          f"over {len(wall_ms)} runs (budget {args.budget_ms:.0f}ms)")
+    print("\nDirect imports of api, by cumulative time (the api module's own time includes the preload):")
+    for name, ms in direct:
+        print(f"  {name:<45} {ms:>9.1f}ms")
+    print("\nSelf time per top-level package:")
+    for package, ms in by_package:
+        print(f"  {package:<45} {ms:>9.1f}ms")
+    print(f"\nLazy packages imported at startup: {', '.join(lazy_imported) or 'none'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "median_ms": median_ms,
+                "runs_ms": wall_ms,
+                "budget_ms": args.budget_ms,
+                "direct_imports_ms": dict(direct),
+                "package_self_ms": dict(by_package),
+                "lazy_packages_imported": lazy_imported,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.check:
+        failures = []
+        if median_ms > args.budget_ms:
+            failures.append(f"median import time {median_ms:.1f}ms exceeds the {args.budget_ms:.0f}ms budget")
+        if lazy_imported:
+            failures.append(f"packages meant to load lazily were imported: {', '.join(lazy_imported)}")
+        if failures:
+            for failure in failures:
+                print(f"STARTUP CHECK FAILED: {failure}")
+            sys.exit(1)
+        print("Startup check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Batch Replay Script
+===================
+
+This script replays recorded casts through the full webhook pipeline (handle_webhook_v2) in dry-run mode,
+so nothing is posted to Farcaster. It is used for regression testing (diff the answers and routes of two runs)
+and for throughput sizing (how many casts per second a given worker count can sustain).
+
+Input is a JSONL file with one cast per line. Each line can be either a full Neynar webhook payload
+({"type": "cast.created", "data": {...}}) or just the cast object ({"hash": ..., "text": ..., "author": {...}}).
+Casts are read in chunks, so arbitrarily large files can be replayed. For each chunk the query embeddings
+are created up front in batched API calls, and the casts are then processed by a pool of worker threads.
+
+Each line of the output JSONL holds the result for one cast: route, answer, token usage per LLM call,
+seconds spent in each pipeline stage, plus the HTTP status and response body the webhook would have returned.
+
+Environment Variables Required:
+----------------------------
+Same as api.py (OPENAI_API_KEY, PINECONE_*, NEYNAR_*, BOT_ACCOUNT_FID, VERBOSE_LOGGING, DATA_DIR)
+
+Usage:
+------
+# Replay casts with 8 workers
+python scripts/replay_casts.py casts.jsonl --output replay_results.jsonl --workers 8
+
+# Only replay the first 50 casts, with a larger embedding batch
+python scripts/replay_casts.py casts.jsonl --limit 50 --embedding-batch-size 200
+"""
+
+import os
+import sys
+import json
+import logging
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from dotenv import load_dotenv
+
+# Allow imports from the project root when run as `python scripts/replay_casts.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def read_casts(input_path: str):
+    """Yields (line_number, webhook payload) for every cast in the input file, wrapping bare casts."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping line {line_number}: invalid JSON ({e})")
+                continue
+
+            if 'type' not in record:
+                record = {"type": "cast.created", "data": record}
+            yield line_number, record
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded casts through the webhook pipeline in dry-run mode.')
+    parser.add_argument('input', help='JSONL file of webhook payloads or cast objects')
+    parser.add_argument('--output', default='replay_results.jsonl', help='JSONL file to write per-cast results to')
+    parser.add_argument('--workers', type=int, default=4, help='Number of casts processed concurrently')
+    parser.add_argument('--chunk-size', type=int, default=200, help='Number of casts read (and embedded) at a time')
+    parser.add_argument('--embedding-batch-size', type=int, default=100,
+                        help='Query texts per embedding request when pre-computing embeddings (0 to disable)')
+    parser.add_argument('--limit', type=int, default=None, help='Only replay the first N casts')
+    args = parser.parse_args()
+
+    # Imported here so the API clients are only created once the arguments are valid
+    import api
+    from core.respond_toquery import handle_webhook_v2
+    from core.request_trace import start_trace, end_trace
+    from core.usage_tracking import get_usage_stats
+    from core.workflow_contextpath import prime_query_embeddings
+
+    def replay_one(line_number, payload):
+        trace = start_trace(payload.get('data', {}).get('hash'))
+        result = {"line": line_number}
+        try:
+            with api.app.app_context():
+                response, status_code = handle_webhook_v2(
+                    payload,
+                    api.openai_client,
+                    api.index,
+                    api.NEYNAR_HEADERS,
+                    api.NEYNAR_SIGNER_UUID,
+                    use_llm=True,
+                    dry_run=True
+                )
+                result["status_code"] = status_code
+                result["response"] = response.get_json()
+        except Exception as e:
+            logger.error(f"Error replaying line {line_number}: {e}")
+            result["error"] = str(e)
+        finally:
+            end_trace()
+        result.update(trace.to_dict())
+        return result
+
+    casts = read_casts(args.input)
+    if args.limit is not None:
+        casts = islice(casts, args.limit)
+
+    processed = 0
+    errors = 0
+    routes = {}
+    latencies = []
+    start_time = time.time()
+
+    with open(args.output, 'w', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        while True:
+            chunk = list(islice(casts, args.chunk_size))
+            if not chunk:
+                break
+
+            if args.embedding_batch_size > 0:
+                texts = [payload.get('data', {}).get('text', '') for _, payload in chunk]
+                try:
+                    prime_query_embeddings(api.openai_client, texts, batch_size=args.embedding_batch_size)
+                except Exception as e:
+                    # Not fatal: each search falls back to creating its own embedding
+                    logger.warning(f"Could not pre-compute query embeddings for chunk: {e}")
+
+            for result in executor.map(lambda item: replay_one(*item), chunk):
+                out.write(json.dumps(result) + "\n")
+                processed += 1
+                latencies.append(result["total_seconds"])
+                routes[result["route"] or "none"] = routes.get(result["route"] or "none", 0) + 1
+                if "error" in result or result.get("status_code", 200) >= 400:
+                    errors += 1
+
+            logger.info(f"Replayed {processed} casts...")
+
+    elapsed = time.time() - start_time
+    if processed == 0:
+        logger.error("No casts found in input file")
+        sys.exit(1)
+
+    print("\nReplay Summary:")
+    print(f"Casts replayed: {processed} ({errors} errors) in {elapsed:.1f}s with {args.workers} workers")
+    print(f"Throughput: {processed / elapsed:.2f} casts/s")
+    print(f"Latency per cast: p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s, "
+          f"max {max(latencies):.2f}s")
+    print(f"Routes: {json.dumps(routes)}")
+    print(f"Token usage by route: {json.dumps(get_usage_stats(), indent=2)}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Micro-benchmark Script
+======================
+
+This script times the CPU-bound hot paths of the bot against the sample transcripts in data/sample_transcripts.
+It makes no network calls: the OpenAI client is never used, and a temporary DATA_DIR is built from the samples.
+
+Covered:
+- ContextualPath.find_expanded_context (match near the start, middle and end of a transcript)
+- MetadataPath._prefilter_metadata and HybridPath._prefilter_metadata
+- answering aggregate metadata questions locally (core/metadata_query.py)
+- serializing metadata for prompts, as JSON and as the compact table (core/metadata_serializer.py)
+- _check_token_count (needs the tiktoken encoding in the local cache; skipped otherwise)
+- truncate_to_byte_limit
+- transcript loading, from the original JSON and from the compact version (core/transcript_store.py)
+- prompt assembly for the contextual, metadata and hybrid prompts
+
+It also reports the size, in characters and (when the tiktoken encoding is available) tokens, of the metadata
+context as JSON and as the compact table. Pass --metadata-file data/metadata.json to measure the real catalogue.
+
+Each case is warmed up, then timed over several repetitions (each repetition runs the function enough times
+to take at least --min-sample-ms), with garbage collection disabled while timing. Per-call timings
+(min, p50, p90, p99, mean) are written to a JSON file so results can be diffed between commits.
+
+Usage:
+------
+# Run all benchmarks and save the results
+python scripts/run_benchmarks.py --output bench_results.json
+
+# Run only the cases whose name contains "prefilter"
+python scripts/run_benchmarks.py --filter prefilter
+
+# Compare against an earlier run; exits with 1 if any case got slower than --threshold
+python scripts/run_benchmarks.py --output bench_new.json --compare bench_old.json --threshold 0.10
+
+# Measure the metadata context sizes against the production metadata
+python scripts/run_benchmarks.py --filter serialize --metadata-file data/metadata.json
+"""
+
+import os
+import sys
+import json
+import gc
+import copy
+import logging
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import argparse
+from datetime import datetime, timezone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(PROJECT_ROOT, 'data', 'sample_transcripts')
+
+# Allow imports from the project root when run as `python scripts/run_benchmarks.py`
+sys.path.insert(0, PROJECT_ROOT)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    "What episodes did dwr.eth appear on?",
+    "When did GM Farcaster ep50 air?",
+    "Which episodes of The Hub were hosted by dylsteck.eth?",
+    "What did I miss on the latest episode?",
+    "How many times has dwr been a guest since March 2024?",
+]
+
+
+def build_data_dir(metadata_copies: int) -> str:
+    """
+    Creates a temporary DATA_DIR with a metadata.json and the sample transcripts (plus their compact versions).
+    The sample metadata only has a handful of episodes, so it is repeated (with new episode ids and dates)
+    to get a catalogue about the size of the real one.
+    """
+    from core.transcript_manifest import is_transcript_file
+    from core.transcript_store import compact_transcript_dir
+
+    data_dir = tempfile.mkdtemp(prefix='gmfc101_bench_')
+    transcripts_dir = os.path.join(data_dir, 'transcripts')
+    os.makedirs(transcripts_dir)
+
+    for filename in os.listdir(SAMPLE_DIR):
+        if is_transcript_file(filename):
+            shutil.copy(os.path.join(SAMPLE_DIR, filename), transcripts_dir)
+    compact_transcript_dir(data_dir)
+
+    with open(os.path.join(SAMPLE_DIR, 'sample_metadata.json'), 'r') as f:
+        sample_metadata = json.load(f)
+
+    metadata = list(sample_metadata)
+    for i in range(1, metadata_copies):
+        for entry in sample_metadata:
+            clone = copy.deepcopy(entry)
+            clone['episode'] = f"{entry['episode']}-{i}"
+            clone['aired_date'] = f"{2020 + i % 5}-{1 + i % 12:02d}-{1 + i % 28:02d}"
+            metadata.append(clone)
+
+    with open(os.path.join(data_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+
+    return data_dir
+
+
+def sentence_probes(transcript_path: str):
+    """Returns search texts taken from sentences near the start, middle and end of a transcript."""
+    with open(transcript_path, 'r') as f:
+        transcript = json.load(f)
+    paragraphs = transcript['results']['channels'][0]['alternatives'][0]['paragraphs']['paragraphs']
+    sentences = [s for para in paragraphs for s in para['sentences'] if len(s['text'].split()) >= 5]
+    return {
+        position: sentences[int(fraction * (len(sentences) - 1))]['text']
+        for position, fraction in (("start", 0.05), ("middle", 0.5), ("end", 0.95))
+    }
+
+
+def time_case(fn, warmup: int, repeat: int, min_sample_seconds: float) -> dict:
+    """Times fn() and returns per-call statistics in milliseconds."""
+    for _ in range(warmup):
+        fn()
+
+    # Calibrate how many calls make up one sample so very fast functions are measurable
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_sample_seconds or number >= 1_000_000:
+            break
+        number *= 2
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            samples.append((time.perf_counter() - start) / number * 1000)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    ordered = sorted(samples)
+
+    def pct(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        "calls_per_sample": number,
+        "repeat": repeat,
+        "min_ms": round(ordered[0], 6),
+        "p50_ms": round(pct(0.5), 6),
+        "p90_ms": round(pct(0.9), 6),
+        "p99_ms": round(pct(0.99), 6),
+        "mean_ms": round(statistics.mean(samples), 6),
+        "stdev_ms": round(statistics.stdev(samples), 6) if len(samples) > 1 else 0.0,
+    }
+
+
+def build_cases(data_dir: str):
+    """Returns a list of (name, callable) benchmark cases. Imports happen here, after DATA_DIR is set."""
+    from core.utils import truncate_to_byte_limit
+    from core.workflow_contextpath import ContextualPath
+    from core.workflow_metadatapath import MetadataPath
+    from core.workflow_hybridpath import HybridPath
+    from prompts.farcaster_prompts import get_farcaster_prompt_with_transcript_context
+    from prompts.metadata_prompts import get_farcaster_prompt_with_metadata_context
+    from prompts.hybrid_prompts import get_farcaster_prompt_with_full_transcript_context
+    from core.transcript_manifest import is_transcript_file
+    from core.transcript_store import load_transcript
+
+    contextual = ContextualPath(openai_client=None)
+    metadata_path = MetadataPath(openai_client=None)
+    hybrid = HybridPath(openai_client=None)
+
+    cases = []
+    transcripts_dir = os.path.join(data_dir, 'transcripts')
+    transcript_files = sorted(f for f in os.listdir(transcripts_dir) if is_transcript_file(f))
+
+    # Transcript loading and expanded context search
+    for filename in transcript_files:
+        full_path = os.path.join(transcripts_dir, filename)
+        label = filename[len('transcript_'):-len('.json')].replace(' ', '_')
+
+        def load(path=full_path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        cases.append((f"load_transcript_json[{label}]", load))
+        cases.append((f"load_transcript_compact[{label}]", lambda f=filename: load_transcript(data_dir, f)))
+
+        for position, search_text in sentence_probes(full_path).items():
+            cases.append((
+                f"find_expanded_context[{label}:{position}]",
+                lambda f=filename, t=search_text: contextual.find_expanded_context(f, t, context_sentences=15)
+            ))
+
+    # Metadata prefiltering
+    for i, query in enumerate(SAMPLE_QUERIES):
+        cases.append((f"metadata_prefilter[q{i}]", lambda q=query: metadata_path._prefilter_metadata(q)))
+        cases.append((f"hybrid_prefilter[q{i}]", lambda q=query: hybrid._prefilter_metadata(q)))
+        mentions = metadata_path.name_matcher.find(query)
+        cases.append((f"metadata_facts[q{i}]", lambda q=query, m=mentions: metadata_path._compute_facts(q, m)))
+
+    # Metadata context serialization, for the whole catalogue (what the prompt gets when nothing matches)
+    from core.metadata_query import strip_context_fields
+    from core.metadata_serializer import serialize_metadata, IDENTIFICATION_COLUMNS
+    cleaned_catalogue = strip_context_fields(metadata_path.metadata)
+    cases.append(("serialize_metadata[json]", lambda: json.dumps(cleaned_catalogue)))
+    cases.append(("serialize_metadata[table]", lambda: serialize_metadata(cleaned_catalogue)))
+    cases.append(("serialize_metadata[identification_table]",
+                  lambda: serialize_metadata(hybrid.metadata, IDENTIFICATION_COLUMNS)))
+
+    # Realistic inputs for token counting, truncation and prompt assembly
+    query = SAMPLE_QUERIES[0]
+    mentions = metadata_path.name_matcher.find(query)
+    filtered_metadata, _ = metadata_path._prefilter_metadata(query, mentions)
+    metadata_context = json.dumps(filtered_metadata)
+    name_mappings = metadata_path._generate_name_mapping_string(mentions)
+    transcript_context = hybrid._get_transcript_context([hybrid.metadata[0]['episode']])
+    first_transcript = transcript_files[0]
+    probe = next(iter(sentence_probes(os.path.join(transcripts_dir, first_transcript)).values()))
+    expanded = contextual.find_expanded_context(first_transcript, probe, context_sentences=15)
+    snippet_context = "\n\n".join([expanded['context'] if expanded else probe] * 3)
+    conversation = "@alice: what's a channel?\n@gmfc101: Channels are topic feeds on Farcaster...\n" * 3
+
+    try:
+        metadata_path._check_token_count("warm up the tokenizer")
+        cases.append(("check_token_count[metadata_context]", lambda: metadata_path._check_token_count(metadata_context)))
+        cases.append(("check_token_count[full_transcript]", lambda: hybrid._check_token_count(transcript_context)))
+    except Exception as e:
+        print(f"Skipping token count benchmarks, tiktoken encoding not available offline: {e}")
+
+    long_reply = " ".join(["Farcaster is a sufficiently decentralized social network."] * 40)
+    emoji_reply = " ".join(["Channels are great 🎉 for finding your people."] * 40)
+    cases.append(("truncate_to_byte_limit[ascii]", lambda: truncate_to_byte_limit(long_reply, 1000)))
+    cases.append(("truncate_to_byte_limit[emoji]", lambda: truncate_to_byte_limit(emoji_reply, 1000)))
+
+    cases.append(("prompt_assembly[contextual]", lambda: get_farcaster_prompt_with_transcript_context(
+        snippet_context, query, conversation, name="alice", depth=2)))
+    cases.append(("prompt_assembly[metadata]", lambda: get_farcaster_prompt_with_metadata_context(
+        "", query, conversation, name="alice", depth=2, metadata_context=metadata_context, name_mappings=name_mappings)))
+    cases.append(("prompt_assembly[hybrid]", lambda: get_farcaster_prompt_with_full_transcript_context(
+        transcript_context, query, name="alice", depth=2, name_mappings=name_mappings)))
+
+    return cases
+
+
+def metadata_context_sizes(metadata: list) -> dict:
+    """
+    Size of the metadata context for the whole catalogue, as the JSON the prompts used to get and as the compact
+    table, for the metadata prompt and for episode identification.
+    """
+    from core.metadata_query import strip_context_fields
+    from core.metadata_serializer import serialize_metadata, IDENTIFICATION_COLUMNS
+
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model("gpt-4o")
+        count_tokens = lambda text: len(encoding.encode(text))
+    except Exception as e:
+        print(f"Reporting characters only, tiktoken encoding not available offline: {e}")
+        count_tokens = lambda text: None
+
+    cleaned = strip_context_fields(metadata)
+    contexts = {
+        "metadata_prompt": (json.dumps(cleaned), serialize_metadata(cleaned)),
+        "episode_identification": (json.dumps(metadata), serialize_metadata(metadata, IDENTIFICATION_COLUMNS)),
+    }
+    sizes = {}
+    for name, (as_json, as_table) in contexts.items():
+        sizes[name] = {
+            "episodes": len(metadata),
+            "json_chars": len(as_json),
+            "table_chars": len(as_table),
+            "json_tokens": count_tokens(as_json),
+            "table_tokens": count_tokens(as_table),
+        }
+        size = sizes[name]
+        line = f"{name:<25} chars {size['json_chars']:>9} -> {size['table_chars']:>9} ({1 - size['table_chars'] / size['json_chars']:.0%} less)"
+        if size['json_tokens']:
+            line += f", tokens {size['json_tokens']:>8} -> {size['table_tokens']:>8} ({1 - size['table_tokens'] / size['json_tokens']:.0%} less)"
+        print(line)
+    return sizes
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare_results(current: dict, previous: dict, threshold: float) -> int:
+    """Prints the p50 change of every case present in both runs. Returns the number of regressions."""
+    regressions = 0
+    print(f"\nComparison against {previous.get('commit', 'unknown')} (p50, threshold {threshold:.0%}):")
+    for name, result in current["results"].items():
+        old = previous.get("results", {}).get(name)
+        if not old:
+            print(f"  {name:<50} new")
+            continue
+        change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] if old["p50_ms"] else 0.0
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            marker = "  faster"
+        print(f"  {name:<50} {old['p50_ms']:>12.4f}ms -> {result['p50_ms']:>12.4f}ms ({change:+.1%}){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run offline micro-benchmarks of the CPU hot paths.')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative p50 slowdown counted as a regression')
+    parser.add_argument('--filter', help='Only run cases whose name contains this string')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed calls before measuring')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed samples per case')
+    parser.add_argument('--min-sample-ms', type=float, default=20.0, help='Minimum duration of one timed sample')
+    parser.add_argument('--metadata-copies', type=int, default=75,
+                        help='Times the sample metadata is repeated to build a realistic catalogue')
+    parser.add_argument('--metadata-file', help='metadata.json to measure the metadata context sizes on '
+                                                '(default: the benchmark catalogue)')
+    args = parser.parse_args()
+
+    data_dir = build_data_dir(args.metadata_copies)
+    os.environ['DATA_DIR'] = data_dir
+
+    # The handlers log on every call; keep the benchmark output readable
+    logging.disable(logging.WARNING)
+    try:
+        cases = build_cases(data_dir)
+        if args.filter:
+            cases = [(name, fn) for name, fn in cases if args.filter in name]
+
+        metadata_file = args.metadata_file or os.path.join(data_dir, 'metadata.json')
+        with open(metadata_file, 'r') as f:
+            print(f"Metadata context size for {metadata_file}:")
+            context_sizes = metadata_context_sizes(json.load(f))
+        print()
+
+        results = {}
+        for name, fn in cases:
+            results[name] = time_case(fn, args.warmup, args.repeat, args.min_sample_ms / 1000)
+            print(f"{name:<50} p50 {results[name]['p50_ms']:>12.4f}ms  p90 {results[name]['p90_ms']:>12.4f}ms  "
+                  f"min {results[name]['min_ms']:>12.4f}ms")
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "min_sample_ms": args.min_sample_ms,
+            "metadata_copies": args.metadata_copies,
+        },
+        "metadata_context_sizes": context_sizes,
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        if compare_results(output, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
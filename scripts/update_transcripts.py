@@ -5,6 +5,9 @@ Transcript Update Script
 This script is used for ongoing operations to update transcripts and metadata in an existing setup.
 It allows downloading individual transcript files and/or updating the metadata.json file that lists all available transcripts.
 
+Updates are made in a staging copy of the published data version (hard links, so it is cheap) and published atomically
+once verified (see core/data_store.py). The running API switches to the new version at its next request.
+
 Environment Variables Required:
 ----------------------------
 - DATA_DIR: Base directory for storing files (defaults to './data')
@@ -46,9 +49,16 @@ import time
 from datetime import datetime
 import argparse
 
+# Allow imports from the project root when run as `python scripts/update_transcripts.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # Load environment variables from .env file
 load_dotenv()
 
+from core.data_store import resolve_data_dir, create_staging_dir, publish_version, discard_staging_dir, gc_versions
+from core.transcript_manifest import verify_transcript_dir
+from core.transcript_store import compact_transcript_dir
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -75,19 +85,15 @@ def verify_aws_credentials():
         logger.error("Please ensure your AWS user has s3:ListBucket permission for the specified bucket")
         sys.exit(1)
 
-def verify_transcript(file_path):
-    """Verify that the downloaded transcript is a valid JSON file."""
-    try:
-        with open(file_path, 'r') as f:
-            json.load(f)  # Verify it's valid JSON
-        logger.info(f"Successfully verified transcript file: {os.path.basename(file_path)}")
-        return True
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in file: {file_path}")
-        return False
-    except Exception as e:
-        logger.error(f"Error reading file {file_path}: {str(e)}")
-        return False
+def verify_transcripts(data_dir):
+    """
+    Verify the transcripts in data_dir against the checksum manifest. The hard-linked files of the
+    published version still match it, so only the newly downloaded transcript is parsed.
+    """
+    ok, problems = verify_transcript_dir(data_dir)
+    for problem in problems:
+        logger.error(f"Transcript verification failed: {problem}")
+    return ok
 
 def verify_metadata(metadata_path):
     """Verify that metadata.json is valid and contains expected structure."""
@@ -136,28 +142,12 @@ def update_transcripts(transcript_filename=None, download_metadata=False, force=
         verify_aws_credentials()
         
         # Get environment variables
-        data_dir = os.getenv('DATA_DIR', './data')
         bucket = os.getenv('S3_BUCKET')
         
         # Initialize S3 client
         s3 = boto3.client('s3')
-        
-        # Handle metadata download
-        if download_metadata:
-            metadata_path = os.path.join(data_dir, 'metadata.json')
-            if check_file_exists(metadata_path, force=True):
-                logger.info(f"Downloading metadata.json from {bucket}")
-                try:
-                    s3.download_file(bucket, 'metadata.json', metadata_path)
-                    logger.info(f"Downloaded metadata.json to {metadata_path}")
-                    if verify and not verify_metadata(metadata_path):
-                        logger.error("Metadata verification failed")
-                        sys.exit(1)
-                except Exception as e:
-                    logger.error(f"Error downloading metadata: {str(e)}")
-                    sys.exit(1)
-        
-        # Handle transcript download
+
+        # Validate the request and ask for confirmation against the published data before staging anything
         if transcript_filename:
             if not transcript_filename.startswith('transcript_') or not transcript_filename.endswith('.json'):
                 logger.error("Invalid transcript filename. Must start with 'transcript_' and end with '.json'")
@@ -169,27 +159,62 @@ def update_transcripts(transcript_filename=None, download_metadata=False, force=
             except Exception as e:
                 logger.error(f"Transcript file {transcript_filename} not found in S3 bucket")
                 sys.exit(1)
-                
-            transcript_dir = os.path.join(data_dir, 'transcripts')
-            local_path = os.path.join(transcript_dir, transcript_filename)
-            
-            # Create transcript directory if it doesn't exist
-            os.makedirs(transcript_dir, exist_ok=True)
+
+            if not check_file_exists(os.path.join(resolve_data_dir(), 'transcripts', transcript_filename), force):
+                transcript_filename = None
+            if not transcript_filename and not download_metadata:
+                return False
+
+        # Work on a hard-linked copy of the published version; files are downloaded to a temporary name
+        # and moved into place, so the published version's files are never modified
+        data_dir = create_staging_dir(seed_from_current=True)
+        try:
+            # Handle metadata download
+            if download_metadata:
+                metadata_path = os.path.join(data_dir, 'metadata.json')
+                logger.info(f"Downloading metadata.json from {bucket}")
+                try:
+                    s3.download_file(bucket, 'metadata.json', f"{metadata_path}.part")
+                    os.replace(f"{metadata_path}.part", metadata_path)
+                    logger.info(f"Downloaded metadata.json to {metadata_path}")
+                    if verify and not verify_metadata(metadata_path):
+                        logger.error("Metadata verification failed")
+                        sys.exit(1)
+                except Exception as e:
+                    logger.error(f"Error downloading metadata: {str(e)}")
+                    sys.exit(1)
             
-            if check_file_exists(local_path, force):
+            # Handle transcript download
+            if transcript_filename:
+                transcript_dir = os.path.join(data_dir, 'transcripts')
+                local_path = os.path.join(transcript_dir, transcript_filename)
+                
+                # Create transcript directory if it doesn't exist
+                os.makedirs(transcript_dir, exist_ok=True)
+                
                 logger.info(f"Downloading {transcript_filename} from {bucket}")
                 try:
-                    s3.download_file(bucket, transcript_filename, local_path)
+                    s3.download_file(bucket, transcript_filename, f"{local_path}.part")
+                    os.replace(f"{local_path}.part", local_path)
                     logger.info(f"Downloaded {transcript_filename} to {local_path}")
-                    if verify and not verify_transcript(local_path):
+                    if verify and not verify_transcripts(data_dir):
                         logger.error("Transcript verification failed")
                         sys.exit(1)
+                    # Only the new transcript lacks a current compact version, so only it is compacted
+                    if not compact_transcript_dir(data_dir)[0]:
+                        logger.warning(f"Could not compact {transcript_filename}; the original JSON will be served")
                     # Count and display total transcript files after successful download
                     total_transcripts = count_transcript_files(data_dir)
                     logger.info(f"Total transcript files in data directory: {total_transcripts}")
                 except Exception as e:
                     logger.error(f"Error downloading transcript: {str(e)}")
                     sys.exit(1)
+
+            publish_version(data_dir)
+        except BaseException:
+            discard_staging_dir(data_dir)
+            raise
+        gc_versions()
         
         duration = time.time() - start_time
         logger.info(f"Update process completed in {duration:.2f} seconds")
@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+from core.episode_resolver import resolve_episode
+from core.metadata_query import MetadataIndex
+from core.name_matcher import NameMatcher
+
+TODAY = date(2025, 3, 15)
+MIN_CONFIDENCE = 0.8
+
+METADATA = [
+    {"episode": "ep50", "title": "GM Farcaster ep50", "series": "GM Farcaster", "hosts": ["adrienne", "nounishprof"],
+     "aired_date": "2024-01-22"},
+    {"episode": "ep51", "title": "GM Farcaster ep51", "series": "GM Farcaster", "hosts": ["adrienne", "nounishprof"],
+     "aired_date": "2024-01-29"},
+    {"episode": "The Hub ep1", "title": "The Hub ep1", "series": "The Hub", "hosts": ["dylsteck.eth"],
+     "aired_date": "2024-02-01"},
+    {"episode": "The Hub ep2", "title": "The Hub ep2", "series": "The Hub", "hosts": ["dylsteck.eth"],
+     "aired_date": "2024-02-08"},
+    {"episode": "ep200", "title": "GM Farcaster ep200 with guest @chaskin.eth", "series": "GM Farcaster",
+     "hosts": ["adrienne", "nounishprof", "chaskin.eth"], "aired_date": "2025-01-10"},
+    {"episode": "Vibe Check ep9", "title": "Vibe Check ep9", "series": "Vibe Check", "hosts": ["dawufi"],
+     "aired_date": "2025-01-10"},
+]
+
+
+@pytest.fixture
+def resolve():
+    index, matcher = MetadataIndex(METADATA), NameMatcher(METADATA)
+
+    def resolve(query):
+        mentions = matcher.find(query)
+        return resolve_episode(index, query, mentions.hosts, mentions.series, today=TODAY)
+    return resolve
+
+
+def test_host_is_matched_without_eth(resolve):
+    resolution = resolve("the episode with chaskin")
+    assert resolution.episode_ids == ["ep200"]
+    assert resolution.confidence >= MIN_CONFIDENCE
+
+
+def test_first_that_is_not_about_the_episode_is_left_to_the_llm(resolve):
+    assert resolve("What did adrienne say about the first farcaster hackathon?").confidence < MIN_CONFIDENCE
+
+
+def test_first_episode_of_a_host(resolve):
+    resolution = resolve("what did adrienne say in the first episode?")
+    assert resolution.episode_ids == ["ep50"]
+    assert resolution.confidence >= MIN_CONFIDENCE
+
+
+def test_latest_series_episode(resolve):
+    resolution = resolve("what happened in the latest hub?")
+    assert resolution.episode_ids == ["The Hub ep2"]
+    assert resolution.confidence >= MIN_CONFIDENCE
+
+
+def test_hash_number_needs_a_series(resolve):
+    resolution = resolve("the #1 tip from the hub")
+    assert "number" not in resolution.reason
+    assert resolution.confidence < MIN_CONFIDENCE
+
+
+def test_hash_number_after_a_series(resolve):
+    resolution = resolve("what was said on the hub #1?")
+    assert resolution.episode_ids == ["The Hub ep1"]
+    assert resolution.confidence >= MIN_CONFIDENCE
+
+
+def test_several_episodes_on_one_day_are_left_to_the_llm(resolve):
+    resolution = resolve("what did I miss on jan 10?")
+    assert sorted(resolution.episode_ids) == ["Vibe Check ep9", "ep200"]
+    assert resolution.confidence < MIN_CONFIDENCE
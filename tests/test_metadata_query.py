@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from core.metadata_query import MetadataIndex, answer_metadata_question
+
+TODAY = date(2025, 3, 15)
+
+METADATA = [
+    {"episode": "ep50", "title": "GM Farcaster ep50", "series": "GM Farcaster", "hosts": ["adrienne", "nounishprof"],
+     "aired_date": "2024-01-22", "youtube_url": "https://youtu.be/ep50"},
+    {"episode": "ep51", "title": "GM Farcaster ep51", "series": "GM Farcaster", "hosts": ["adrienne", "dwr.eth"],
+     "aired_date": "2024-01-29", "youtube_url": "https://youtu.be/ep51"},
+    {"episode": "Vibe Check ep1", "title": "Vibe Check ep1", "series": "Vibe Check", "hosts": ["dawufi", "dwr.eth"],
+     "aired_date": "2024-06-03", "youtube_url": "https://youtu.be/vc1"},
+    {"episode": "ep200", "title": "GM Farcaster ep200", "series": "GM Farcaster",
+     "hosts": ["adrienne", "nounishprof", "chaskin.eth"], "aired_date": "2025-01-10",
+     "youtube_url": "https://youtu.be/ep200"},
+]
+
+
+@pytest.fixture
+def index():
+    return MetadataIndex(METADATA)
+
+
+def ask(index, query, hosts=(), series=()):
+    return answer_metadata_question(index, query, list(hosts), list(series), today=TODAY)
+
+
+@pytest.mark.parametrize("query", [
+    "who hosted the first episode?",
+    "who was the guest on the last episode?",
+    "What is the first episode where they mention frames?",
+])
+def test_questions_the_templates_cannot_render_go_to_the_llm(index, query):
+    facts = ask(index, query)
+    assert facts is not None
+    assert facts.answer is None
+
+
+def test_first_episode_is_answered_from_the_template(index):
+    facts = ask(index, "when was the first episode?")
+    assert facts.answer == 'The first episode is "GM Farcaster ep50", aired January 22, 2024: https://youtu.be/ep50'
+
+
+def test_latest_episode_of_a_series_is_answered_from_the_template(index):
+    facts = ask(index, "what's the latest vibe check episode?", series=["Vibe Check"])
+    assert facts.answer.startswith('The most recent of the Vibe Check episodes is "Vibe Check ep1"')
+
+
+def test_count_is_answered_from_the_template(index):
+    facts = ask(index, "how many times has dwr.eth been a guest?", hosts=["dwr.eth"])
+    assert facts.answer.startswith("@dwr.eth has been on 2 episodes.")
+
+
+def test_count_of_people_goes_to_the_llm(index):
+    assert ask(index, "how many guests have been on gm farcaster episodes?", series=["GM Farcaster"]).answer is None